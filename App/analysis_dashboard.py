@@ -15,6 +15,7 @@ from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.decomposition import PCA
 from sklearn.cluster import KMeans
 from sklearn.metrics import silhouette_score, davies_bouldin_score, calinski_harabasz_score
+from preprocessing_healthcare_data import duplicate_row_masks, profile_table
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -182,6 +183,11 @@ def perform_pca(X, n_components=30):
     
     return X_pca, pca
 
+@st.cache_data
+def get_profile(df):
+    """Profile dữ liệu (thiếu, giá trị khác nhau, top giá trị, trùng lặp) - tính một lần, dùng cho các tab EDA"""
+    return profile_table(df, top_k=15)
+
 # ============================================================================
 # LOAD DỮ LIỆU
 # ============================================================================
@@ -190,6 +196,8 @@ df = load_data()
 if df is None:
     st.stop()
 
+profile = get_profile(df)
+
 # ============================================================================
 # SIDEBAR NAVIGATION
 # ============================================================================
@@ -293,7 +301,7 @@ if page == "🏠 Tổng quan":
             'STT': range(1, len(df.columns)+1),
             'Tên cột': df.columns,
             'Kiểu dữ liệu': df.dtypes.values.astype(str),
-            'Số giá trị duy nhất': [df[col].nunique() for col in df.columns]
+            'Số giá trị duy nhất': [profile['columns'][col]['distinct'] for col in df.columns]
         })
         st.dataframe(cols_df, use_container_width=True, height=400, hide_index=True)
 
@@ -349,7 +357,7 @@ elif page == "📊 EDA - 7 Bước Cơ Bản":
     with tabs[2]:
         st.subheader("3️⃣ Kiểm tra dữ liệu thiếu")
         
-        missing_count = df.isnull().sum()
+        missing_count = pd.Series({col: profile['columns'][col]['nulls'] for col in df.columns})
         missing_percent = (missing_count / len(df)) * 100
         
         missing_df = pd.DataFrame({
@@ -387,8 +395,7 @@ elif page == "📊 EDA - 7 Bước Cơ Bản":
     with tabs[3]:
         st.subheader("4️⃣ Kiểm tra dữ liệu trùng lặp")
         
-        duplicate_rows = df.duplicated()
-        num_duplicates = duplicate_rows.sum()
+        num_duplicates = profile['duplicate_rows']
         
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -402,6 +409,7 @@ elif page == "📊 EDA - 7 Bước Cơ Bản":
             st.warning(f"⚠️ Phát hiện {num_duplicates:,} dòng trùng lặp")
             
             if st.checkbox("Xem mẫu dòng trùng lặp"):
+                duplicate_rows = duplicate_row_masks(df)[1]
                 st.dataframe(df[duplicate_rows].head(20), use_container_width=True)
         else:
             st.success("✅ KHÔNG CÓ DỮ LIỆU TRÙNG LẶP!")
@@ -421,7 +429,8 @@ elif page == "📊 EDA - 7 Bước Cơ Bản":
             col1, col2 = st.columns([2, 1])
             
             with col1:
-                value_counts = df[selected_col].value_counts().head(15)
+                top_values = profile['columns'][selected_col]['top_values']
+                value_counts = pd.Series([count for _, count in top_values], index=[value for value, _ in top_values])
                 
                 fig = px.bar(
                     x=value_counts.values,
@@ -436,7 +445,7 @@ elif page == "📊 EDA - 7 Bước Cơ Bản":
                 st.plotly_chart(fig, use_container_width=True)
             
             with col2:
-                st.metric("Số giá trị duy nhất", df[selected_col].nunique())
+                st.metric("Số giá trị duy nhất", profile['columns'][selected_col]['distinct'])
                 
                 value_counts_df = pd.DataFrame({
                     'Giá trị': value_counts.index,
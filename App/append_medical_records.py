@@ -0,0 +1,252 @@
+"""
+SCRIPT NẠP BỔ SUNG HỒ SƠ KHÁM MỚI
+Làm sạch một file medical_records mới (delta, ví dụ các lượt khám trong ngày) và ghi nối
+vào cleaned_data/ và result.csv mà không chạy lại preprocessing cho toàn bộ dữ liệu cũ.
+
+- Khóa ngoại được kiểm tra trên các bảng dimension đã làm sạch trong cleaned_data/
+- record_id đã có trong kho được loại bằng chỉ mục khóa lưu trên đĩa (KEY_INDEX_FILE),
+  chỉ mục được dựng lại từ file medical_records đã làm sạch nếu file này thay đổi
+- Các dòng cũ không bị đọc lại hay sửa: CSV được ghi nối thêm, với Parquet/Arrow các dòng
+  mới được ghi thành một file phần mới cạnh file chính
+- Các dòng mới được ghi nối vào cuối result.csv, không sắp xếp lại theo bệnh nhân như
+  export_query_result.py (chạy lại export_query_result.py để có result.csv đã sắp xếp)
+
+Cách dùng: python append_medical_records.py <file delta CSV>
+    python append_medical_records.py data/medical_records_2025-01-02.csv
+"""
+
+import pandas as pd
+import numpy as np
+import hashlib
+import os
+import pickle
+import sys
+from datetime import datetime
+
+import preprocessing_healthcare_data as prep
+from export_query_result import QUERY_COLUMNS, join_records, select_result_columns
+
+# ============================================================================
+# CẤU HÌNH
+# ============================================================================
+
+CLEANED_DATA_DIR = "cleaned_data/"
+RESULT_FILE = "result.csv"
+
+# Chỉ mục record_id của kho cleaned (tập khóa của prep.new_key_set), lưu trong CLEANED_DATA_DIR kèm
+# chữ ký (file_signature) của các file medical_records mà nó phản ánh
+KEY_INDEX_FILE = "medical_records_keys.pkl"
+
+# Số byte đầu và cuối mỗi file kho được hash vào chữ ký
+SIGNATURE_SAMPLE_BYTES = 1 << 16
+
+# Số dòng delta xử lý mỗi lần
+CHUNK_SIZE = prep.CHUNK_SIZE
+
+# Các cột của result.csv (query của export_query_result.py)
+RESULT_COLUMNS = QUERY_COLUMNS
+
+# ============================================================================
+# CHỈ MỤC RECORD_ID
+# ============================================================================
+
+def file_signature(path):
+    """Chữ ký của kho, dùng để biết chỉ mục còn khớp với kho hay không
+    
+    Với file chính và mỗi file phần ghi nối: tên, inode, kích thước, thời điểm sửa và hash
+    BLAKE2 của SIGNATURE_SAMPLE_BYTES byte đầu và cuối file. Kích thước + thời điểm sửa không
+    đủ: file được ghi lại với cùng kích thước (cùng số dòng, khác record_id) hoặc được chép đè
+    giữ nguyên thời điểm sửa (cp -p, rsync) vẫn khớp.
+    """
+    signature = []
+    for part in prep.cleaned_table_parts(path):
+        stat = os.stat(part)
+        digest = hashlib.blake2b(digest_size=16)
+        with open(part, 'rb') as f:
+            digest.update(f.read(SIGNATURE_SAMPLE_BYTES))
+            f.seek(max(SIGNATURE_SAMPLE_BYTES, stat.st_size - SIGNATURE_SAMPLE_BYTES))
+            digest.update(f.read())
+        signature.append([os.path.basename(part), stat.st_ino, stat.st_size, stat.st_mtime_ns, digest.hexdigest()])
+    return signature
+
+def load_key_index(store_path, output_dir=CLEANED_DATA_DIR):
+    """Đọc chỉ mục record_id đã lưu; dựng lại từ kho nếu chưa có hoặc kho đã thay đổi
+    
+    Chỉ mục là tập khóa của prep (xem prep.new_key_set): các dãy mã khóa thay thế đã sắp xếp
+    kèm dạng (tiền tố, số chữ số) nếu record_id của kho đổi được sang số nguyên, ngược lại
+    các dãy chuỗi với id_format=None.
+    """
+    key_col = prep.KEY_COLUMNS['medical_records']
+    index_path = os.path.join(output_dir, KEY_INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path, 'rb') as f:
+            key_index = pickle.load(f)
+        if key_index.pop('source') == file_signature(store_path):
+            print(f"✓ Đã đọc chỉ mục record_id: {prep.key_set_size(key_index):,} khóa")
+            return key_index
+        print("⚠ Kho medical_records đã thay đổi, dựng lại chỉ mục record_id")
+    
+    records, _ = prep.read_cleaned_table('medical_records', output_dir, columns=[key_col])
+    key_index = prep.key_set_add(prep.new_key_set(), records[key_col])
+    print(f"✓ Đã dựng chỉ mục record_id từ kho: {prep.key_set_size(key_index):,} khóa")
+    return key_index
+
+def save_key_index(key_index, store_path, output_dir=CLEANED_DATA_DIR):
+    """Lưu chỉ mục record_id (gộp thành một dãy) kèm chữ ký của file kho hiện tại"""
+    runs = key_index['runs']
+    if len(runs) > 1:
+        runs = [np.sort(np.concatenate(runs))]
+    index_path = os.path.join(output_dir, KEY_INDEX_FILE)
+    with open(index_path, 'wb') as f:
+        pickle.dump({'source': file_signature(store_path), **key_index, 'runs': runs}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+
+# ============================================================================
+# LÀM SẠCH DELTA
+# ============================================================================
+
+def load_dimension_tables(output_dir=CLEANED_DATA_DIR):
+    """Cột khóa của các bảng dimension đã làm sạch (dùng để dựng chỉ mục khóa)"""
+    dims = {}
+    for table in prep.FOREIGN_KEYS.values():
+        df, path = prep.read_cleaned_table(table, output_dir, columns=[prep.KEY_COLUMNS[table]])
+        if df is None:
+            print(f"⚠ Không tìm thấy {table}_cleaned, bỏ qua kiểm tra khóa ngoại tới {table.upper()}")
+            continue
+        dims[table] = df
+    return dims
+
+def clean_delta(delta_file, existing_keys, dims, chunksize=CHUNK_SIZE):
+    """Làm sạch file delta theo từng chunk, trả về generator các chunk đã làm sạch và thống kê
+    
+    Các chunk đi qua process_medical_records_chunk như ở chế độ streaming (trùng lặp, khóa
+    ngoại, chuẩn hóa, tổng chi phí) với tập record_id đã gặp bắt đầu từ chỉ mục của kho
+    `existing_keys`, nên dòng có record_id đã có trong kho bị loại như dòng trùng lặp và
+    chỉ mục được cập nhật thêm các record_id mới tại chỗ. Khóa ngoại được đọc theo dạng mã
+    của các bảng dimension.
+    """
+    stats = prep.new_stream_stats()
+    key_indexes = prep.build_key_indexes(dims)
+    
+    def cleaned_chunks():
+        chunks = prep.read_table('medical_records', delta_file, id_formats=prep.reference_id_formats(dims),
+                                 chunksize=chunksize)
+        for chunk in chunks:
+            yield prep.process_medical_records_chunk(chunk, key_indexes, existing_keys, stats)
+    
+    return cleaned_chunks(), stats
+
+# ============================================================================
+# GHI NỐI VÀO KHO VÀ RESULT
+# ============================================================================
+
+def append_to_store(chunks, path, output_format):
+    """Ghi nối các chunk vào bảng medical_records đã làm sạch, theo thứ tự cột của bảng
+    
+    CSV được mở ở chế độ nối thêm. File Parquet/Arrow đã đóng không ghi nối được, nên các
+    chunk mới được ghi thành một file phần mới (prep.new_table_part_path) theo schema của
+    file chính; các file cũ không bị đọc hay ghi lại. File phần được ghi ra file tạm rồi đổi
+    tên, nên bên đọc (prep.read_cleaned_table) không bao giờ gặp file phần ghi dở.
+    """
+    if output_format == 'csv':
+        columns = pd.read_csv(path, encoding='utf-8-sig', nrows=0).columns
+        with open(path, 'a', encoding='utf-8', newline='') as f:
+            for chunk in chunks:
+                chunk.reindex(columns=columns).to_csv(f, index=False, header=False)
+        return
+    
+    schema = prep.read_table_schema(path, output_format)
+    part_path = prep.new_table_part_path(path)
+    tmp_path = part_path + '.tmp'
+    try:
+        prep.write_chunks((chunk.reindex(columns=schema.names) for chunk in chunks), tmp_path, output_format,
+                          schema=schema)
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, part_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def build_result_rows(records, patients, patient_index):
+    """Các dòng result.csv của những hồ sơ mới (INNER JOIN với patients như export_query_result.py)"""
+    record_cols = ['patient_id'] + [col for col in RESULT_COLUMNS + ['ngay_kham']
+                                    if col in records.columns and col not in patients.columns]
+    rows = join_records(patients, records[record_cols], patient_index, ordered=True)
+    return select_result_columns(rows, RESULT_COLUMNS, sort=False)
+
+# ============================================================================
+# HÀM CHÍNH
+# ============================================================================
+
+def append_medical_records(delta_file, output_dir=CLEANED_DATA_DIR, result_file=RESULT_FILE, chunksize=CHUNK_SIZE):
+    """Làm sạch file delta và ghi nối vào kho cleaned và result.csv, trả về thống kê
+    
+    Các dòng mới được ghi nối vào cuối result.csv theo thứ tự của file delta, không chèn vào
+    đúng vị trí theo thứ tự sắp xếp của export_query_result.py.
+    """
+    print("=" * 80)
+    print(f"NẠP BỔ SUNG HỒ SƠ KHÁM: {delta_file}")
+    print("=" * 80)
+    print(f"Thời gian: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    
+    output_format, store_path = prep.find_cleaned_table('medical_records', output_dir)
+    if store_path is None:
+        raise FileNotFoundError(f"Không tìm thấy medical_records_cleaned trong {output_dir}, hãy chạy preprocessing trước")
+    
+    key_index = load_key_index(store_path, output_dir)
+    dims = load_dimension_tables(output_dir)
+    
+    patients = None
+    if os.path.exists(result_file):
+        patients, _ = prep.read_cleaned_table('patients', output_dir, columns=RESULT_COLUMNS)
+        patient_index = prep.build_key_index(patients, 'patient_id')
+    else:
+        print(f"⚠ Chưa có {result_file}, chỉ ghi nối vào kho cleaned (chạy export_query_result.py để tạo)")
+    
+    result_rows = []
+    chunks, stats = clean_delta(delta_file, key_index, dims, chunksize)
+    
+    def tracked_chunks():
+        for chunk in chunks:
+            if patients is not None:
+                result_rows.append(build_result_rows(chunk, patients, patient_index))
+            # Kho lưu mã ID dạng chuỗi
+            yield prep.decode_id_columns(chunk)
+    
+    # Kho cột (.npy) chỉ được ghi nối khi đã có medical_records, nếu không sẽ chỉ chứa các dòng mới
+    cleaned_chunks = tracked_chunks()
+    if prep.WRITE_COLUMN_STORE:
+        if 'medical_records' in prep.read_column_store_manifest(output_dir)['tables']:
+            cleaned_chunks = prep.with_column_store(cleaned_chunks, 'medical_records', output_dir, append=True)
+        else:
+            print("⚠ Kho cột chưa có medical_records, bỏ qua (chạy lại preprocessing để tạo)")
+    
+    print("\n>>> LÀM SẠCH DELTA VÀ GHI NỐI VÀO KHO")
+    append_to_store(cleaned_chunks, store_path, output_format)
+    prep.print_stream_stats(stats)
+    print(f"✓ Đã ghi nối {stats['rows_out']:,} dòng vào {store_path}")
+    
+    # Chỉ mục được lưu sau khi kho đã ghi xong: nếu bị ngắt giữa chừng, chữ ký không
+    # khớp và lần chạy sau sẽ dựng lại chỉ mục từ kho
+    save_key_index(key_index, store_path, output_dir)
+    print(f"✓ Đã cập nhật chỉ mục record_id: {prep.key_set_size(key_index):,} khóa")
+    
+    if patients is not None:
+        with open(result_file, 'a', encoding='utf-8', newline='') as f:
+            for rows in result_rows:
+                rows.to_csv(f, index=False, header=False)
+        print(f"✓ Đã ghi nối {sum(len(rows) for rows in result_rows):,} dòng vào cuối {result_file} "
+              f"(chưa sắp xếp theo bệnh nhân, chạy export_query_result.py để sắp xếp lại)")
+    
+    print("\n" + "=" * 80)
+    print("HOÀN TẤT NẠP BỔ SUNG!")
+    print("=" * 80)
+    
+    return stats
+
+# Chạy chương trình
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Cách dùng: python append_medical_records.py <file delta CSV>")
+        sys.exit(1)
+    append_medical_records(sys.argv[1])
@@ -0,0 +1,271 @@
+"""
+SCRIPT BENCHMARK PREPROCESSING VÀ EXPORT
+Đo thời gian và bộ nhớ đỉnh của từng bước trong preprocessing_healthcare_data.py và
+bước join của export_query_result.py trên dữ liệu tổng hợp ở nhiều quy mô, ghi kết quả
+ra file JSON và so sánh với baseline đã lưu.
+
+Cách dùng:
+    python benchmark_preprocessing.py                     # chạy và so sánh với baseline
+    python benchmark_preprocessing.py --scales 0.1 1 5    # chọn quy mô dữ liệu
+    python benchmark_preprocessing.py --save-baseline     # lưu kết quả làm baseline mới
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import export_query_result
+import preprocessing_healthcare_data as prep
+from generate_synthetic_data import generate_data
+
+# ============================================================================
+# CẤU HÌNH
+# ============================================================================
+
+# Quy mô dữ liệu (so với 400,000 hồ sơ khám) và seed của dữ liệu tổng hợp
+BENCH_SCALES = [0.1, 0.5, 1.0]
+BENCH_SEED = 42
+
+# Thư mục chứa dữ liệu sinh ra cho từng quy mô (dùng lại giữa các lần chạy)
+BENCH_DIR = "benchmarks/"
+
+# Số lần chạy mỗi bước (lấy thời gian nhỏ nhất); bộ nhớ đỉnh đo ở một lần chạy riêng
+BENCH_REPEAT = 3
+
+# Bộ lọc của bước query có lọc (đọc một phần dữ liệu qua export_query_result.query_records)
+BENCH_QUERY_FILTERS = {'loai_kham': 'Tái khám', 'ngay_kham': ('2024-01-01', '2024-06-30')}
+
+RESULTS_FILE = "benchmark_results.json"
+BASELINE_FILE = "benchmark_baseline.json"
+
+# Báo chậm đi khi thời gian vượt baseline quá 20% và chênh lệch ít nhất 0.05s
+# (bỏ qua dao động của các bước rất nhanh)
+REGRESSION_THRESHOLD = 0.2
+MIN_REGRESSION_SECONDS = 0.05
+
+# ============================================================================
+# ĐO MỘT BƯỚC
+# ============================================================================
+
+def copy_tables(data):
+    """Bản sao sâu của các bảng để mỗi lần chạy nhận cùng một đầu vào"""
+    return {name: df.copy() for name, df in data.items()}
+
+def measure(fn, make_args, repeat=BENCH_REPEAT):
+    """Chạy fn(*make_args()) `repeat` lần, trả về (kết quả, thời gian nhỏ nhất, bộ nhớ đỉnh MB)
+    
+    Đầu vào được tạo lại trước mỗi lần chạy (không tính vào thời gian) và output in ra
+    của fn bị bỏ qua. Bộ nhớ đỉnh đo bằng tracemalloc ở một lần chạy thêm vì tracemalloc
+    làm chậm đáng kể.
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        args = make_args()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = fn(*args)
+            times.append(time.perf_counter() - start)
+    
+    args = make_args()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    
+    return result, min(times), peak / 1024**2
+
+def run_export():
+    """Chạy export_query_result.main() (đọc cleaned_data/, join, ghi result.csv) trong thư mục hiện tại"""
+    try:
+        export_query_result.main()
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise RuntimeError(f"export_query_result.py kết thúc với mã lỗi {e.code}")
+
+# ============================================================================
+# CHẠY BENCHMARK CHO MỘT QUY MÔ
+# ============================================================================
+
+@contextlib.contextmanager
+def working_directory(path):
+    """Tạm chuyển thư mục làm việc (preprocessing đọc data/ và ghi cleaned_data/ theo đường dẫn tương đối)"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+def prepare_dataset(scale, seed=BENCH_SEED, bench_dir=BENCH_DIR):
+    """Thư mục dữ liệu của một quy mô, sinh dữ liệu nếu chưa có"""
+    scale_dir = os.path.abspath(os.path.join(bench_dir, f"scale_{scale}_seed_{seed}"))
+    data_dir = os.path.join(scale_dir, prep.DATA_DIR)
+    if not all(os.path.exists(os.path.join(data_dir, f)) for f in prep.FILES.values()):
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_data(scale=scale, seed=seed, output_dir=data_dir)
+    return scale_dir
+
+def benchmark_scale(scale, seed=BENCH_SEED, repeat=BENCH_REPEAT, bench_dir=BENCH_DIR):
+    """Đo từng bước của quy trình trên dữ liệu một quy mô, trả về {tên bước: kết quả đo}
+    
+    Các bước chạy theo đúng thứ tự của main(): đầu ra của mỗi bước là đầu vào của bước sau.
+    Số dòng của mỗi bước là số dòng đầu vào, hoặc được tính từ kết quả khi bước tạo ra dữ liệu (load_data).
+    """
+    scale_dir = prepare_dataset(scale, seed, bench_dir)
+    results = {}
+    
+    def step(name, fn, make_args, rows):
+        result, seconds, peak_mb = measure(fn, make_args, repeat)
+        if callable(rows):
+            rows = rows(result)
+        results[name] = {'time_s': round(seconds, 4), 'peak_mb': round(peak_mb, 2), 'rows': int(rows)}
+        print(f"  {name:<28} {seconds:>9.3f}s {peak_mb:>10.1f} MB")
+        return result
+    
+    with working_directory(scale_dir):
+        data = step('load_data', prep.load_data, lambda: (), prep.count_rows)
+        n_rows = prep.count_rows(data)
+        
+        step('check_missing_values', prep.check_missing_values, lambda: (data,), n_rows)
+        data = step('handle_all_missing_values', prep.handle_all_missing_values, lambda: (copy_tables(data),), n_rows)
+        
+        duplicate_report = step('check_duplicates', prep.check_duplicates, lambda: (data,), n_rows)
+        data = step('remove_duplicates', prep.remove_duplicates, lambda: (copy_tables(data),), n_rows)
+        n_rows = prep.count_rows(data)
+        
+        integrity_issues = step('check_referential_integrity', prep.check_referential_integrity,
+                                lambda: (data,), n_rows)
+        data = step('fix_referential_integrity', prep.fix_referential_integrity,
+                    lambda: (copy_tables(data), integrity_issues), n_rows)
+        n_rows = prep.count_rows(data)
+        
+        data = step('standardize_dates', prep.standardize_dates, lambda: (copy_tables(data),), n_rows)
+        data = step('standardize_numeric', prep.standardize_numeric, lambda: (copy_tables(data),), n_rows)
+        data = step('standardize_strings', prep.standardize_strings, lambda: (copy_tables(data),), n_rows)
+        
+        consistency_issues = step('check_data_consistency', prep.check_data_consistency, lambda: (data,), n_rows)
+        data = step('fix_consistency', prep.fix_consistency,
+                    lambda: (copy_tables(data), consistency_issues), n_rows)
+        
+        outliers_report = step('detect_outliers', prep.detect_outliers, lambda: (data,), n_rows)
+        step('validate_emails', prep.validate_emails, lambda: (data,), n_rows)
+        step('validate_phone_numbers', prep.validate_phone_numbers, lambda: (data,), n_rows)
+        step('evaluate_rules', prep.evaluate_rules, lambda: (data,), n_rows)
+        step('generate_summary_report', prep.generate_summary_report,
+             lambda: (data, {}, duplicate_report, integrity_issues, consistency_issues, outliers_report), n_rows)
+        
+        step('save_cleaned_data', prep.save_cleaned_data, lambda: (data,), n_rows)
+        step('export_join', run_export, lambda: (), len(data['medical_records']))
+        step('query_filtered', export_query_result.query_records,
+             lambda: (export_query_result.QUERY_COLUMNS, BENCH_QUERY_FILTERS), len(data['medical_records']))
+    
+    return results
+
+# ============================================================================
+# SO SÁNH VỚI BASELINE
+# ============================================================================
+
+def compare_with_baseline(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """In bảng so sánh thời gian với baseline, trả về danh sách các bước bị chậm đi"""
+    rows = []
+    regressions = []
+    for scale, steps in results['scales'].items():
+        baseline_steps = baseline.get('scales', {}).get(scale, {})
+        for name, current in steps.items():
+            previous = baseline_steps.get(name)
+            if previous is None:
+                continue
+            ratio = current['time_s'] / max(previous['time_s'], 1e-9)
+            regressed = (ratio > 1 + threshold
+                         and current['time_s'] - previous['time_s'] > MIN_REGRESSION_SECONDS)
+            rows.append({
+                'Quy mô': scale,
+                'Bước': name,
+                'Baseline (s)': previous['time_s'],
+                'Hiện tại (s)': current['time_s'],
+                'Tỷ lệ': round(ratio, 2),
+                'Kết quả': '✗ CHẬM HƠN' if regressed else '✓'
+            })
+            if regressed:
+                regressions.append((scale, name, ratio))
+    
+    print("\n" + "=" * 80)
+    print(f"SO SÁNH VỚI BASELINE (ngưỡng +{threshold:.0%})")
+    print("=" * 80)
+    if rows:
+        print(pd.DataFrame(rows).to_string(index=False))
+    else:
+        print("⚠ Baseline không có quy mô/bước nào trùng với lần chạy này")
+    
+    return regressions
+
+def run_benchmarks(scales=BENCH_SCALES, seed=BENCH_SEED, repeat=BENCH_REPEAT, bench_dir=BENCH_DIR,
+                   results_file=RESULTS_FILE):
+    """Chạy benchmark cho tất cả các quy mô và ghi kết quả ra `results_file`"""
+    results = {
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count()
+        },
+        'seed': seed,
+        'repeat': repeat,
+        'scales': {}
+    }
+    
+    for scale in scales:
+        print("\n" + "=" * 80)
+        print(f"BENCHMARK QUY MÔ {scale}x")
+        print("=" * 80)
+        results['scales'][str(scale)] = benchmark_scale(scale, seed, repeat, bench_dir)
+    
+    with open(results_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n✓ Đã lưu kết quả benchmark vào file: {results_file}")
+    
+    return results
+
+# Chạy chương trình
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark các bước preprocessing và export")
+    parser.add_argument('--scales', type=float, nargs='+', default=BENCH_SCALES)
+    parser.add_argument('--seed', type=int, default=BENCH_SEED)
+    parser.add_argument('--repeat', type=int, default=BENCH_REPEAT)
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help="lưu kết quả lần này làm baseline")
+    args = parser.parse_args()
+    
+    results = run_benchmarks(scales=args.scales, seed=args.seed, repeat=args.repeat)
+    
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✓ Đã lưu baseline vào file: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n✗ {len(regressions)} bước chậm hơn baseline")
+            sys.exit(1)
+        print("\n✓ Không có bước nào chậm hơn baseline")
+    else:
+        print(f"\n⚠ Chưa có baseline ({args.baseline}); chạy với --save-baseline để tạo")
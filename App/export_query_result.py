@@ -1,12 +1,27 @@
 """
 SCRIPT EXPORT KẾT QUẢ QUERY
 Thực hiện query SQL và export ra file CSV
+
+Có thể import để lấy đúng phần dữ liệu cần mà không phải đọc lại result.csv:
+    from export_query_result import query_records
+    df = query_records(
+        columns=['patient_id', 'thanh_pho', 'loai_kham', 'chan_doan'],
+        filters={'thanh_pho': ['Hà Nội', 'Đà Nẵng'], 'ngay_kham': ('2024-01-01', '2024-06-30')}
+    )
 """
 
 import pandas as pd
+import numpy as np
 import os
+import sys
 from datetime import datetime
 
+from preprocessing_healthcare_data import (
+    COLUMNAR_COMPRESSION, HAS_PYARROW, build_key_index, cleaned_table_columns, decode_id_column, decode_id_columns,
+    encode_id_keys, id_key_formats, is_surrogate_key, lookup_keys, lookup_sorted_keys, pa, read_cleaned_table,
+    set_id_key_formats
+)
+
 # Thiết lập hiển thị
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', 100)
@@ -21,70 +36,8 @@ CLEANED_DATA_DIR = "cleaned_data/"
 # Đường dẫn file output
 OUTPUT_FILE = "result.csv"
 
-# ============================================================================
-# ĐỌC DỮ LIỆU
-# ============================================================================
-
-print("=" * 80)
-print("BẮT ĐẦU XỬ LÝ QUERY")
-print("=" * 80)
-print(f"Thời gian: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-
-# Đọc file patients_cleaned.csv
-print("📖 Đang đọc file patients_cleaned.csv...")
-try:
-    patients = pd.read_csv(
-        os.path.join(CLEANED_DATA_DIR, 'patients_cleaned.csv'),
-        encoding='utf-8-sig'
-    )
-    print(f"✓ Đã đọc patients_cleaned.csv: {len(patients):,} dòng, {len(patients.columns)} cột")
-except Exception as e:
-    print(f"✗ Lỗi khi đọc patients_cleaned.csv: {e}")
-    exit(1)
-
-# Đọc file medical_records_cleaned.csv
-print("\n📖 Đang đọc file medical_records_cleaned.csv...")
-try:
-    medical_records = pd.read_csv(
-        os.path.join(CLEANED_DATA_DIR, 'medical_records_cleaned.csv'),
-        encoding='utf-8-sig'
-    )
-    print(f"✓ Đã đọc medical_records_cleaned.csv: {len(medical_records):,} dòng, {len(medical_records.columns)} cột")
-except Exception as e:
-    print(f"✗ Lỗi khi đọc medical_records_cleaned.csv: {e}")
-    exit(1)
-
-# ============================================================================
-# THỰC HIỆN QUERY (JOIN)
-# ============================================================================
-
-print("\n" + "=" * 80)
-print("THỰC HIỆN QUERY - JOIN DỮ LIỆU")
-print("=" * 80)
-
-# Đổi tên cột trang_thai trong medical_records để tránh trùng
-if 'trang_thai' in medical_records.columns:
-    medical_records = medical_records.rename(columns={'trang_thai': 'trang_thai_mr'})
-
-# Thực hiện INNER JOIN
-print("\n🔄 Đang thực hiện INNER JOIN...")
-df_result = patients.merge(
-    medical_records,
-    on='patient_id',
-    how='inner'
-)
-print(f"✓ Đã join: {len(df_result):,} bản ghi")
-
-# ============================================================================
-# CHỌN CÁC CỘT THEO YÊU CẦU
-# ============================================================================
-
-print("\n" + "=" * 80)
-print("CHỌN CÁC CỘT THEO QUERY")
-print("=" * 80)
-
 # Danh sách các cột cần lấy (theo thứ tự trong query)
-columns_needed = [
+QUERY_COLUMNS = [
     'patient_id',      # AS id
     'gioi_tinh',
     'tuoi',
@@ -101,100 +54,330 @@ columns_needed = [
     'chan_doan'        # AS chuan_doan
 ]
 
-# Kiểm tra các cột có tồn tại không
-missing_columns = [col for col in columns_needed if col not in df_result.columns]
-if missing_columns:
-    print(f"⚠ Cảnh báo: Các cột sau không tồn tại: {missing_columns}")
-    # Kiểm tra các cột tương tự
-    for col in missing_columns:
-        similar_cols = [c for c in df_result.columns if col.lower() in c.lower() or c.lower() in col.lower()]
-        if similar_cols:
-            print(f"   - Có thể dùng: {similar_cols}")
-    # Chỉ lấy các cột có sẵn
-    columns_needed = [col for col in columns_needed if col in df_result.columns]
-
-# Sắp xếp trước khi chọn cột (nếu có ngay_kham)
-if 'ngay_kham' in df_result.columns:
-    df_result = df_result.sort_values(['patient_id', 'ngay_kham'])
-else:
-    df_result = df_result.sort_values('patient_id')
-
-# Chọn các cột
-df_final = df_result[columns_needed].copy()
-
 # Đổi tên cột theo yêu cầu
-df_final = df_final.rename(columns={
+RESULT_RENAMES = {
     'patient_id': 'id',
     'ket_qua_xet_nghiem': 'ket_qua',
     'chan_doan': 'chuan_doan'
-})
+}
+
+# Cách join: 'sorted' dùng mã số nguyên của patient_id (BN0000001 -> 1) để lấy dòng bệnh nhân
+# theo vị trí/tìm nhị phân và sắp xếp kết quả trên mảng số; 'hash' dùng chỉ mục băm (pd.Index);
+# 'auto' dùng 'sorted' khi mã của hai bảng cùng dạng, ngược lại dùng 'hash'
+JOIN_STRATEGY = 'auto'
 
-print(f"✓ Đã chọn {len(df_final.columns)} cột")
-print(f"✓ Số bản ghi: {len(df_final):,}")
+# Đích của kết quả: DataFrame/Arrow table trong bộ nhớ, hoặc file theo phần mở rộng
+IN_MEMORY_OUTPUTS = ('dataframe', 'arrow')
+FILE_OUTPUTS = {'.csv': 'csv', '.parquet': 'parquet'}
 
 # ============================================================================
-# HIỂN THỊ THÔNG TIN KẾT QUẢ
+# ĐỌC DỮ LIỆU (ĐẨY BỘ LỌC XUỐNG TRƯỚC KHI JOIN)
 # ============================================================================
 
-print("\n" + "=" * 80)
-print("THÔNG TIN KẾT QUẢ")
-print("=" * 80)
+def source_column(col):
+    """Tên cột gốc của một cột kết quả (ví dụ 'chuan_doan' -> 'chan_doan')"""
+    sources = {renamed: col for col, renamed in RESULT_RENAMES.items()}
+    return sources.get(col, col)
+
+def split_filters(filters, patient_columns, record_columns):
+    """Chia bộ lọc theo bảng: cột có trong patients lọc trên patients (như khi chọn cột),
+    các cột còn lại lọc trên medical_records; bộ lọc patient_id áp dụng cho cả hai bảng"""
+    patient_filters, record_filters = {}, {}
+    for col, condition in (filters or {}).items():
+        col = source_column(col)
+        if col == 'patient_id':
+            patient_filters[col] = record_filters[col] = condition
+        elif col in patient_columns:
+            patient_filters[col] = condition
+        elif col in record_columns:
+            record_filters[col] = condition
+        else:
+            raise ValueError(f"Cột lọc không có trong patients và medical_records: {col}")
+    return patient_filters, record_filters
+
+def read_query_tables(columns=QUERY_COLUMNS, filters=None, data_dir=CLEANED_DATA_DIR):
+    """Đọc patients và medical_records đã làm sạch cho query
+    
+    Chỉ đọc các cột cần (patients: các cột được chọn; medical_records: khóa join, ngay_kham
+    để sắp xếp và các cột patients không có). Bộ lọc được áp dụng ngay khi đọc từng bảng
+    (xem read_cleaned_table), trước khi join.
+    Trả về (patients, đường dẫn, medical_records, đường dẫn).
+    """
+    columns = [source_column(col) for col in columns]
+    patient_columns = cleaned_table_columns('patients', data_dir)
+    if patient_columns is None:
+        raise FileNotFoundError(f"Không tìm thấy patients_cleaned trong {data_dir}")
+    record_columns = cleaned_table_columns('medical_records', data_dir)
+    if record_columns is None:
+        raise FileNotFoundError(f"Không tìm thấy medical_records_cleaned trong {data_dir}")
+    
+    patient_filters, record_filters = split_filters(filters, patient_columns, record_columns)
+    patients, patients_path = read_cleaned_table('patients', data_dir, columns=['patient_id'] + columns,
+                                                 filters=patient_filters)
+    
+    mr_columns = ['patient_id', 'ngay_kham'] + [col for col in columns if col not in patients.columns]
+    medical_records, medical_records_path = read_cleaned_table('medical_records', data_dir, columns=mr_columns,
+                                                               filters=record_filters)
+    return patients, patients_path, medical_records, medical_records_path
 
-print(f"\n📊 Số bản ghi: {len(df_final):,}")
-print(f"📊 Số cột: {len(df_final.columns)}")
-print(f"\n📋 Danh sách cột:")
-for i, col in enumerate(df_final.columns, 1):
-    print(f"   {i:2d}. {col}")
+# ============================================================================
+# THỰC HIỆN QUERY (JOIN)
+# ============================================================================
 
-print(f"\n📋 5 dòng đầu tiên:")
-print(df_final.head().to_string())
+def join_positions(patients, medical_records, patient_index=None, strategy=JOIN_STRATEGY):
+    """Vị trí dòng patients của từng hồ sơ khám (-1 nếu không có)
+    
+    Trả về (vị trí, mã số nguyên patient_id của các hồ sơ); mã là None khi dùng chỉ mục băm.
+    patient_id đã là khóa thay thế cùng dạng mã ở cả hai bảng (xem read_cleaned_table) thì
+    dùng trực tiếp, ngược lại mã số nguyên được tính từ chuỗi.
+    """
+    if strategy not in ('auto', 'sorted', 'hash'):
+        raise ValueError(f"Cách join không hỗ trợ: {strategy} (chọn 'auto', 'sorted' hoặc 'hash')")
+    
+    if strategy != 'hash':
+        patient_ids, record_ids = patients['patient_id'], medical_records['patient_id']
+        if (is_surrogate_key(patient_ids) and is_surrogate_key(record_ids)
+                and id_key_formats(patient_ids)['patient_id'] == id_key_formats(record_ids)['patient_id']):
+            record_codes = record_ids.to_numpy()
+            return lookup_sorted_keys(patient_ids.to_numpy(), record_codes), record_codes
+        patient_keys = encode_id_keys(decode_id_column(patient_ids))
+        record_keys = encode_id_keys(decode_id_column(record_ids))
+        if patient_keys is not None and record_keys is not None and patient_keys[:2] == record_keys[:2]:
+            return lookup_sorted_keys(patient_keys[2], record_keys[2]), record_keys[2]
+        if strategy == 'sorted':
+            print("⚠ patient_id của hai bảng không cùng dạng tiền tố + số, dùng join băm")
+    
+    if patient_index is None:
+        patient_index = build_key_index(patients, 'patient_id')
+    return lookup_keys(patient_index, medical_records['patient_id']), None
 
-print(f"\n📋 Thống kê cơ bản:")
-print(f"   - Số bệnh nhân duy nhất: {df_final['id'].nunique():,}")
-print(f"   - Số giá trị NULL:")
-for col in df_final.columns:
-    null_count = df_final[col].isnull().sum()
-    if null_count > 0:
-        print(f"     + {col}: {null_count:,} ({null_count/len(df_final)*100:.2f}%)")
+def record_order(record_codes, visit_dates):
+    """Thứ tự các hồ sơ theo (patient_id, ngay_kham) từ mã số nguyên, None nếu đã đúng thứ tự
+    
+    Ngày khám được đổi sang hạng (factorize có sắp xếp, giá trị thiếu xếp cuối như
+    sort_values). Phép sắp xếp ổn định nên thứ tự các dòng trùng (patient_id, ngay_kham)
+    giống DataFrame.sort_values(['patient_id', 'ngay_kham']).
+    """
+    record_codes = np.asarray(record_codes, dtype=np.int64)
+    date_rank, uniques = pd.factorize(visit_dates, sort=True)
+    date_rank = np.where(date_rank < 0, len(uniques), date_rank)
+    
+    code_steps = np.diff(record_codes)
+    if ((code_steps > 0) | ((code_steps == 0) & (np.diff(date_rank) >= 0))).all():
+        return None
+    
+    # Gộp hai khóa thành một khóa int64 (sắp xếp ổn định trên một mảng nhanh hơn lexsort)
+    n_ranks = len(uniques) + 1
+    if len(record_codes) and record_codes.max() < np.iinfo(np.int64).max // n_ranks - 1:
+        return np.argsort(record_codes * n_ranks + date_rank, kind='stable')
+    return np.lexsort((date_rank, record_codes))
+
+def join_records(patients, medical_records, patient_index=None, strategy=JOIN_STRATEGY, ordered=False):
+    """INNER JOIN patients x medical_records theo patient_id
+    
+    Mỗi hồ sơ khám lấy dòng bệnh nhân tương ứng theo vị trí (xem join_positions). Các cột
+    trùng tên (ngoài khóa join) được đặt hậu tố _x/_y như merge; trang_thai của
+    medical_records đổi thành trang_thai_mr.
+    ordered=True: kết quả được sắp xếp theo patient_id, ngay_kham. Với mã số nguyên, thứ tự
+    được tính trên mảng số trước khi lấy dòng (bỏ qua nếu hồ sơ đã đúng thứ tự); với
+    join băm, kết quả được sắp xếp bằng sort_values.
+    """
+    # Đổi tên cột trang_thai trong medical_records để tránh trùng
+    if 'trang_thai' in medical_records.columns:
+        medical_records = medical_records.rename(columns={'trang_thai': 'trang_thai_mr'})
+    
+    positions, record_codes = join_positions(patients, medical_records, patient_index, strategy)
+    
+    sort_after = ordered
+    if ordered and record_codes is not None and 'ngay_kham' in medical_records.columns:
+        order = record_order(record_codes, medical_records['ngay_kham'])
+        if order is not None:
+            positions = positions[order]
+            medical_records = medical_records.take(order)
+        sort_after = False
+    matched = positions >= 0
+    
+    overlap_cols = [col for col in patients.columns if col in medical_records.columns and col != 'patient_id']
+    left = patients.take(positions[matched]).rename(columns={col: f'{col}_x' for col in overlap_cols})
+    right = medical_records[matched].drop(columns='patient_id').rename(columns={col: f'{col}_y' for col in overlap_cols})
+    df_result = pd.concat([left.reset_index(drop=True), right.reset_index(drop=True)], axis=1)
+    # Dạng mã của các khóa thay thế: patient_id và cột của patients theo patients, còn lại theo medical_records
+    formats = {**id_key_formats(right), **id_key_formats(left)}
+    set_id_key_formats(df_result, {col: id_format for col, id_format in formats.items() if col in df_result.columns})
+    return sort_by_patient(df_result) if sort_after else df_result
+
+def sort_by_patient(df_result):
+    """Sắp xếp kết quả join theo patient_id, ngay_kham (nếu có)"""
+    if 'ngay_kham' in df_result.columns:
+        return df_result.sort_values(['patient_id', 'ngay_kham'])
+    return df_result.sort_values('patient_id')
+
+def select_result_columns(df_result, columns=QUERY_COLUMNS, rename=True, sort=True):
+    """Chọn (và đổi tên) các cột của kết quả, khóa thay thế được đổi lại thành mã ID dạng chuỗi
+    
+    sort=True: sắp xếp theo patient_id, ngay_kham trước khi chọn cột (không cần nếu kết
+    quả đến từ join_records(..., ordered=True))
+    """
+    columns = [source_column(col) for col in columns]
+    
+    # Kiểm tra các cột có tồn tại không
+    missing_columns = [col for col in columns if col not in df_result.columns]
+    if missing_columns:
+        print(f"⚠ Cảnh báo: Các cột sau không tồn tại: {missing_columns}")
+        # Kiểm tra các cột tương tự
+        for col in missing_columns:
+            similar_cols = [c for c in df_result.columns if col.lower() in c.lower() or c.lower() in col.lower()]
+            if similar_cols:
+                print(f"   - Có thể dùng: {similar_cols}")
+        # Chỉ lấy các cột có sẵn
+        columns = [col for col in columns if col in df_result.columns]
+    
+    # Sắp xếp trước khi chọn cột (nếu có ngay_kham)
+    if sort:
+        df_result = sort_by_patient(df_result)
+    
+    df_final = decode_id_columns(df_result[columns].copy())
+    return df_final.rename(columns=RESULT_RENAMES) if rename else df_final
 
 # ============================================================================
-# EXPORT RA FILE CSV
+# GHI KẾT QUẢ
 # ============================================================================
 
-print("\n" + "=" * 80)
-print("EXPORT RA FILE CSV")
-print("=" * 80)
+def write_result(df, output='dataframe'):
+    """Trả kết quả về đích `output`
+    
+    'dataframe': DataFrame; 'arrow': pyarrow.Table; đường dẫn .csv (UTF-8-BOM để Excel đọc
+    được tiếng Việt) hoặc .parquet: ghi ra file và trả về DataFrame.
+    """
+    if output == 'dataframe':
+        return df
+    
+    output_format = None if output in IN_MEMORY_OUTPUTS else FILE_OUTPUTS.get(os.path.splitext(output)[1].lower())
+    if output != 'arrow' and output_format is None:
+        raise ValueError(f"Đích không hỗ trợ: {output} (chọn {list(IN_MEMORY_OUTPUTS)} hoặc file {list(FILE_OUTPUTS)})")
+    if output_format != 'csv' and not HAS_PYARROW:
+        raise ImportError(f"Cần cài pyarrow để xuất kết quả dạng {output}")
+    
+    if output == 'arrow':
+        return pa.Table.from_pandas(df, preserve_index=False)
+    if output_format == 'csv':
+        df.to_csv(output, index=False, encoding='utf-8-sig')
+    else:
+        df.to_parquet(output, index=False, compression=COLUMNAR_COMPRESSION)
+    return df
+
+def query_records(columns=QUERY_COLUMNS, filters=None, output='dataframe', data_dir=CLEANED_DATA_DIR, rename=True,
+                  strategy=JOIN_STRATEGY):
+    """Query patients x medical_records đã làm sạch, chỉ lấy các cột và dòng cần
+    
+    columns: các cột kết quả (tên gốc hoặc tên sau khi đổi, ví dụ 'chan_doan'/'chuan_doan')
+    filters: {cột: điều kiện}, điều kiện là một giá trị, list giá trị hoặc tuple (min, max),
+    ví dụ {'ngay_kham': ('2024-01-01', '2024-06-30'), 'thanh_pho': ['Hà Nội'], 'loai_kham': 'Tái khám'};
+    được đẩy xuống từng bảng trước khi join
+    output: 'dataframe', 'arrow' hoặc đường dẫn file .csv/.parquet (xem write_result)
+    rename: đổi tên cột theo RESULT_RENAMES
+    strategy: cách join (xem JOIN_STRATEGY)
+    """
+    patients, _, medical_records, _ = read_query_tables(columns, filters, data_dir)
+    df_result = join_records(patients, medical_records, strategy=strategy, ordered=True)
+    df_final = select_result_columns(df_result, columns, rename, sort=False)
+    return write_result(df_final.reset_index(drop=True), output)
+
+# ============================================================================
+# HIỂN THỊ THÔNG TIN KẾT QUẢ
+# ============================================================================
 
-try:
-    # Export ra file CSV với encoding UTF-8-BOM (để Excel đọc được tiếng Việt)
-    df_final.to_csv(
-        OUTPUT_FILE,
-        index=False,
-        encoding='utf-8-sig'
-    )
+def print_result_info(df_final):
+    """In thông tin của kết quả query"""
+    print("\n" + "=" * 80)
+    print("THÔNG TIN KẾT QUẢ")
+    print("=" * 80)
     
-    # Kiểm tra kích thước file
-    file_size = os.path.getsize(OUTPUT_FILE)
-    file_size_mb = file_size / (1024 * 1024)
+    print(f"\n📊 Số bản ghi: {len(df_final):,}")
+    print(f"📊 Số cột: {len(df_final.columns)}")
+    print(f"\n📋 Danh sách cột:")
+    for i, col in enumerate(df_final.columns, 1):
+        print(f"   {i:2d}. {col}")
     
-    print(f"\n✓ Đã export thành công!")
-    print(f"   📁 File: {OUTPUT_FILE}")
-    print(f"   📊 Số dòng: {len(df_final):,}")
-    print(f"   📊 Số cột: {len(df_final.columns)}")
-    print(f"   💾 Kích thước: {file_size_mb:.2f} MB")
+    print(f"\n📋 5 dòng đầu tiên:")
+    print(df_final.head().to_string())
     
-except Exception as e:
-    print(f"\n✗ Lỗi khi export file: {e}")
-    exit(1)
+    print(f"\n📋 Thống kê cơ bản:")
+    print(f"   - Số bệnh nhân duy nhất: {df_final['id'].nunique():,}")
+    print(f"   - Số giá trị NULL:")
+    for col in df_final.columns:
+        null_count = df_final[col].isnull().sum()
+        if null_count > 0:
+            print(f"     + {col}: {null_count:,} ({null_count/len(df_final)*100:.2f}%)")
 
 # ============================================================================
-# HOÀN TẤT
+# HÀM CHÍNH - EXPORT RA FILE CSV
 # ============================================================================
 
-print("\n" + "=" * 80)
-print("HOÀN TẤT!")
-print("=" * 80)
-print(f"Thời gian hoàn thành: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-print(f"\n✅ File kết quả: {OUTPUT_FILE}")
-print("=" * 80)
+def main(output_file=OUTPUT_FILE, data_dir=CLEANED_DATA_DIR, columns=QUERY_COLUMNS, filters=None,
+         strategy=JOIN_STRATEGY):
+    """Chạy query, in thông tin kết quả và export ra `output_file`"""
+    print("=" * 80)
+    print("BẮT ĐẦU XỬ LÝ QUERY")
+    print("=" * 80)
+    print(f"Thời gian: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    
+    # Đọc patients và medical_records (chỉ các cột cần; Parquet/Arrow nếu có, ngược lại CSV)
+    print("📖 Đang đọc bảng patients và medical_records đã làm sạch...")
+    try:
+        patients, patients_path, medical_records, medical_records_path = read_query_tables(columns, filters, data_dir)
+    except Exception as e:
+        print(f"✗ Lỗi khi đọc dữ liệu đã làm sạch: {e}")
+        sys.exit(1)
+    print(f"✓ Đã đọc {patients_path}: {len(patients):,} dòng, {len(patients.columns)} cột")
+    print(f"✓ Đã đọc {medical_records_path}: {len(medical_records):,} dòng, {len(medical_records.columns)} cột")
+    
+    print("\n" + "=" * 80)
+    print("THỰC HIỆN QUERY - JOIN DỮ LIỆU")
+    print("=" * 80)
+    
+    print("\n🔄 Đang thực hiện INNER JOIN...")
+    df_result = join_records(patients, medical_records, strategy=strategy, ordered=True)
+    print(f"✓ Đã join: {len(df_result):,} bản ghi")
+    
+    print("\n" + "=" * 80)
+    print("CHỌN CÁC CỘT THEO QUERY")
+    print("=" * 80)
+    
+    df_final = select_result_columns(df_result, columns, sort=False)
+    print(f"✓ Đã chọn {len(df_final.columns)} cột")
+    print(f"✓ Số bản ghi: {len(df_final):,}")
+    
+    print_result_info(df_final)
+    
+    print("\n" + "=" * 80)
+    print("EXPORT RA FILE CSV")
+    print("=" * 80)
+    
+    try:
+        write_result(df_final, output_file)
+        
+        # Kiểm tra kích thước file
+        file_size_mb = os.path.getsize(output_file) / (1024 * 1024)
+        
+        print(f"\n✓ Đã export thành công!")
+        print(f"   📁 File: {output_file}")
+        print(f"   📊 Số dòng: {len(df_final):,}")
+        print(f"   📊 Số cột: {len(df_final.columns)}")
+        print(f"   💾 Kích thước: {file_size_mb:.2f} MB")
+    except Exception as e:
+        print(f"\n✗ Lỗi khi export file: {e}")
+        sys.exit(1)
+    
+    print("\n" + "=" * 80)
+    print("HOÀN TẤT!")
+    print("=" * 80)
+    print(f"Thời gian hoàn thành: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"\n✅ File kết quả: {output_file}")
+    print("=" * 80)
+    
+    return df_final
 
+# Chạy chương trình
+if __name__ == "__main__":
+    main()
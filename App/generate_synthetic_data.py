@@ -0,0 +1,441 @@
+"""
+SCRIPT SINH DỮ LIỆU Y TẾ TỔNG HỢP
+Sinh 5 bảng patients, doctors, medical_records, medications, diagnoses với cùng cấu trúc
+cột và bộ giá trị mà preprocessing_healthcare_data.py xử lý, để kiểm thử hiệu năng mà
+không cần dữ liệu bệnh nhân thật.
+
+Cách dùng: python generate_synthetic_data.py [hệ số quy mô] [seed]
+    python generate_synthetic_data.py          # 400,000 hồ sơ khám (quy mô 1x)
+    python generate_synthetic_data.py 100 7    # 40 triệu hồ sơ khám, seed 7
+"""
+
+import pandas as pd
+import numpy as np
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from preprocessing_healthcare_data import DATA_DIR, FILES, HAS_PYARROW
+
+if HAS_PYARROW:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+# ============================================================================
+# CẤU HÌNH
+# ============================================================================
+
+# Hệ số quy mô so với bộ dữ liệu gốc (0.1 -> 100) và seed; cùng seed, cùng hệ số
+# thì dữ liệu sinh ra giống hệt nhau, không phụ thuộc số tiến trình
+SCALE = 1.0
+SEED = 42
+
+# Số dòng mỗi bảng ở quy mô 1x
+BASE_ROWS = {
+    'patients': 80_000,
+    'doctors': 2_000,
+    'medical_records': 400_000,
+    'medications': 1_000,
+    'diagnoses': 500
+}
+
+# Tiền tố mã ID (ví dụ BN0000001)
+ID_PREFIXES = {
+    'patients': 'BN',
+    'doctors': 'BS',
+    'medical_records': 'HS',
+    'medications': 'TH',
+    'diagnoses': 'CD'
+}
+
+# Mỗi chunk được sinh trong một tiến trình với seed riêng (seed, bảng, số thứ tự chunk)
+CHUNK_ROWS = 500_000
+WORKERS = os.cpu_count() or 1
+
+# Năm tham chiếu để tính tuổi từ ngày sinh
+REFERENCE_YEAR = 2025
+
+# Tỷ lệ dữ liệu "bẩn" để các bước làm sạch có việc để làm
+MISSING_RATE = 0.05
+DUPLICATE_RATE = 0.001
+INVALID_FK_RATE = 0.0005
+
+# ============================================================================
+# BỘ GIÁ TRỊ (THEO DỮ LIỆU GỐC)
+# ============================================================================
+
+GIOI_TINH = ['Nam', 'Nữ']
+NHOM_MAU = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
+THANH_PHO = [
+    'An Giang', 'Bà Rịa-Vũng Tàu', 'Bình Dương', 'Bình Phước', 'Bình Thuận', 'Bình Định',
+    'Bạc Liêu', 'Bắc Giang', 'Bắc Kạn', 'Bắc Ninh', 'Bến Tre', 'Cần Thơ', 'Hà Nội',
+    'Hải Phòng', 'Hồ Chí Minh', 'Đà Nẵng'
+]
+TIEN_SU_BENH = ['Cao huyết áp', 'Dị ứng', 'Hen suyễn', 'Tim mạch', 'Tiểu đường', 'Viêm dạ dày']
+DI_UNG = ['Penicillin', 'Hải sản', 'Phấn hoa', 'Aspirin', 'Sữa']
+TRANG_THAI_BENH_NHAN = ['Cần theo dõi', 'Khỏe mạnh', 'Tái khám định kỳ', 'Đang điều trị']
+
+# (nhóm tuổi, tuổi nhỏ nhất, tuổi lớn nhất)
+NHOM_TUOI = [
+    ('Trẻ em', 1, 12),
+    ('Thiếu niên', 13, 17),
+    ('Thanh niên', 18, 39),
+    ('Trung niên', 40, 59),
+    ('Cao tuổi', 60, 95)
+]
+
+CHUYEN_KHOA = ['Tim mạch', 'Nội tổng quát', 'Nhi', 'Sản phụ khoa', 'Thần kinh', 'Tiêu hóa',
+               'Hô hấp', 'Cơ xương khớp', 'Ung bướu', 'Truyền nhiễm']
+HOC_VI = ['BS', 'ThS', 'TS', 'PGS.TS', 'BSCKI', 'BSCKII']
+BENH_VIEN = ['BV Bạch Mai', 'BV Chợ Rẫy', 'BV Đa khoa Trung ương', 'BV Nhi Trung ương', 'BV Đa khoa tỉnh']
+
+LOAI_KHAM = ['Cấp cứu', 'Khám mới', 'Khám định kỳ', 'Tái khám', 'Tư vấn']
+TRIEU_CHUNG = [
+    'Biếng ăn', 'Buồn nôn', 'Chóng mặt', 'Chảy máu', 'Chảy máu âm đạo', 'Co giật', 'Ho', 'Ho ra máu',
+    'Hồi hộp', 'Khát nước', 'Khó thở', 'Khó thở khi gắng sức', 'Khó tiêu', 'Khối u', 'Liệt nửa người',
+    'Mất trí nhớ', 'Mệt mỏi', 'Nôn', 'Phát ban', 'Phù chân', 'Quấy khóc', 'Run tay', 'Rối loạn kinh nguyệt',
+    'Sưng vùng bẹn', 'Sưng đỏ', 'Sốt', 'Sốt cao', 'Sụt cân', 'Thở khò khè', 'Tim đập nhanh', 'Tiêu chảy',
+    'Táo bón', 'Tê tay chân', 'Tức ngực', 'Vàng da', 'Yếu cơ', 'Đau bụng dưới', 'Đau bụng trên',
+    'Đau hạ sườn phải', 'Đau khớp', 'Đau lưng', 'Đau ngực', 'Đau ngực khi thở', 'Đau sau chấn thương',
+    'Đau vùng chậu', 'Đau đầu', 'Đái nhiều', 'Đầy bụng', 'Ợ chua', 'Ợ nóng'
+]
+XET_NGHIEM = [
+    'CRP', 'CT bụng', 'CT mạch vành', 'CT não', 'CT phổi', 'Doppler mạch máu não', 'ECG', 'HbA1c',
+    'Khí máu động mạch', 'MRI não', 'Nuôi cấy vi khuẩn', 'Nội soi dạ dày', 'Nội soi phế quản',
+    'Nội soi đại tràng', 'PET scan', 'Siêu âm buồng trứng', 'Siêu âm bụng', 'Siêu âm thai', 'Siêu âm tim',
+    'Siêu âm vú', 'SpO2', 'Test GeneXpert', 'Test gắng sức', 'Test nhanh COVID-19', 'Test nhanh Dengue',
+    'Test rụng trứng', 'Test thở Urê', 'X-quang', 'X-quang phổi', 'X-quang xương', 'Xét nghiệm CRP',
+    'Xét nghiệm HCG', 'Xét nghiệm HP', 'Xét nghiệm Pap smear', 'Xét nghiệm Troponin', 'Xét nghiệm acid uric',
+    'Xét nghiệm chức năng gan', 'Xét nghiệm chức năng thận', 'Xét nghiệm công thức máu',
+    'Xét nghiệm dịch não tủy', 'Xét nghiệm lipid máu', 'Xét nghiệm men gan', 'Xét nghiệm máu',
+    'Xét nghiệm máu toàn phần', 'Xét nghiệm nội tiết', 'Xét nghiệm phân', 'Xét nghiệm vi khuẩn',
+    'Xét nghiệm vi khuẩn âm đạo', 'Xét nghiệm viêm', 'Xét nghiệm đường huyết', 'Xét nghiệm đờm', 'Điện cơ',
+    'Điện não đồ', 'Đo Holter', 'Đo SpO2', 'Đo chức năng hô hấp', 'Đo huyết áp 24h', 'Đo mật độ xương'
+]
+KET_QUA = ['Bình thường', 'Bất thường', 'Bất thường nhẹ', 'Cần theo dõi']
+CHAN_DOAN = [
+    'Alzheimer', 'Bệnh thận mãn', 'Bệnh van tim', 'Bỏng', 'COPD', 'Cao huyết áp', 'Chấn thương', 'Gout',
+    'Gãy xương', 'Hen phế quản', 'Hen phế quản nhi', 'Hội chứng ruột kích thích', 'Lao phổi', 'Loãng xương',
+    'Nhiễm trùng vết thương', 'Nhồi máu cơ tim', 'Parkinson', 'Rối loạn kinh nguyệt', 'Rối loạn nhịp tim',
+    'Suy tim', 'Sỏi mật', 'Sốt xuất huyết', 'Sởi', 'Tai biến mạch máu não', 'Tay chân miệng',
+    'Thai nghén bình thường', 'Thiếu máu', 'Thiếu máu cơ tim', 'Thoát vị', 'Tiêu chảy cấp', 'Tiền sản giật',
+    'Tiểu đường type 1', 'Tiểu đường type 2', 'Tràn dịch màng phổi', 'Trào ngược dạ dày', 'U lành tính',
+    'U nang buồng trứng', 'U xơ tử cung', 'Ung thư dạ dày', 'Ung thư phổi', 'Viêm cơ tim', 'Viêm gan',
+    'Viêm gan B', 'Viêm họng', 'Viêm loét dạ dày', 'Viêm màng não', 'Viêm não', 'Viêm phế quản', 'Viêm phổi',
+    'Viêm phổi nhi', 'Viêm phụ khoa', 'Viêm ruột thừa', 'Viêm tai giữa', 'Viêm túi mật', 'Viêm tụy',
+    'Viêm vú', 'Viêm xoang', 'Viêm đại tràng', 'Xơ gan', 'Xơ vữa động mạch', 'Đau dây thần kinh tọa',
+    'Đau nửa đầu', 'Động kinh'
+]
+MUC_DO = ['Nhẹ', 'Trung bình', 'Nặng']
+PHUONG_PHAP_DIEU_TRI = ['Dùng thuốc', 'Phẫu thuật', 'Vật lý trị liệu', 'Theo dõi', 'Nhập viện điều trị']
+TRANG_THAI_HO_SO = ['Hoàn thành', 'Đang điều trị', 'Chuyển viện', 'Hẹn tái khám']
+GHI_CHU = ['Theo dõi thêm', 'Tái khám sau 1 tuần', 'Uống thuốc đúng giờ', 'Kiêng đồ cay nóng']
+
+HOAT_CHAT = ['Paracetamol', 'Amoxicillin', 'Metformin', 'Amlodipine', 'Omeprazole', 'Atorvastatin',
+             'Ibuprofen', 'Cefuroxime', 'Salbutamol', 'Losartan']
+HAM_LUONG = ['5mg', '10mg', '20mg', '250mg', '500mg', '850mg']
+DANG_BAO_CHE = ['Viên nén', 'Viên nang', 'Siro', 'Thuốc tiêm', 'Thuốc bột']
+DON_VI = ['Hộp', 'Vỉ', 'Chai', 'Ống', 'Gói']
+NHOM_THUOC = ['Kháng sinh', 'Giảm đau', 'Tim mạch', 'Tiêu hóa', 'Hô hấp', 'Nội tiết']
+NHA_SAN_XUAT = ['Dược Hậu Giang', 'Traphaco', 'Imexpharm', 'Pymepharco', 'Sanofi', 'Pfizer']
+
+NHOM_BENH = ['Tim mạch', 'Hô hấp', 'Tiêu hóa', 'Thần kinh', 'Nội tiết', 'Truyền nhiễm', 'Sản phụ khoa',
+             'Nhi khoa', 'Ung bướu', 'Chấn thương']
+
+# ============================================================================
+# HÀM HỖ TRỢ
+# ============================================================================
+
+def table_sizes(scale=SCALE):
+    """Số dòng của từng bảng theo hệ số quy mô"""
+    return {name: max(10, int(round(rows * scale))) for name, rows in BASE_ROWS.items()}
+
+def id_width(n_rows):
+    """Số chữ số của mã ID (tối thiểu 7 như BN0000001)"""
+    return max(7, len(str(n_rows)))
+
+def padded_ids(prefix, numbers, width):
+    """Mã prefix + số đệm 0 đến `width` chữ số cho mảng số thứ tự (số không vượt quá `width` chữ số)
+    
+    Các chữ số được tính bằng phép chia trên mảng rồi ghép thành chuỗi có độ dài cố định,
+    không định dạng từng số một.
+    """
+    chars = np.empty((len(numbers), len(prefix) + width), dtype=np.uint32)
+    chars[:, :len(prefix)] = [ord(c) for c in prefix]
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    chars[:, len(prefix):] = numbers[:, None] // powers % 10 + ord('0')
+    return chars.view(f'U{len(prefix) + width}').ravel()
+
+def make_ids(name, numbers, sizes):
+    """Mã ID dạng tiền tố + số có đệm 0 (ví dụ BN0000001) cho mảng số thứ tự
+    
+    Số được đệm đến độ rộng của bảng; số dài hơn (khóa ngoại trỏ ra ngoài bảng, tới 2 lần số
+    dòng) giữ đủ chữ số của nó thay vì bị cắt thành mã của một dòng có thật. Độ rộng lớn nhất
+    lấy từ numbers.max().
+    """
+    prefix = ID_PREFIXES[name]
+    numbers = np.asarray(numbers, dtype=np.int64)
+    width = id_width(sizes[name])
+    max_width = max(width, len(str(numbers.max(initial=0))))
+    if max_width == width:
+        return padded_ids(prefix, numbers, width)
+    
+    ids = np.empty(len(numbers), dtype=f'U{len(prefix) + max_width}')
+    widths = np.searchsorted(10 ** np.arange(max_width + 1, dtype=np.int64), numbers, side='right')
+    widths = np.maximum(widths, width)
+    for w in np.unique(widths):
+        rows = widths == w
+        ids[rows] = padded_ids(prefix, numbers[rows], w)
+    return ids
+
+def choice(rng, values, n):
+    """Chọn ngẫu nhiên n giá trị từ bộ giá trị, trả về Categorical (không tạo n chuỗi)"""
+    return pd.Categorical.from_codes(rng.integers(0, len(values), n), categories=values)
+
+def numbered(prefix, numbers, suffix=''):
+    """Chuỗi prefix + số + suffix cho cả mảng số (ví dụ 'bn12@email.com')"""
+    return np.char.add(np.char.add(prefix, np.asarray(numbers).astype('U')), suffix)
+
+def with_missing(rng, values, rate=MISSING_RATE):
+    """Thay ngẫu nhiên một tỷ lệ giá trị bằng giá trị thiếu"""
+    values = pd.Series(values)
+    return values.mask(rng.random(len(values)) < rate)
+
+def random_dates(rng, start, end, n):
+    """Chuỗi ngày YYYY-MM-DD ngẫu nhiên trong khoảng [start, end)"""
+    start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+    days = rng.integers(0, (end - start).astype(int), n)
+    return np.datetime_as_string(start + days, unit='D')
+
+def birth_dates(rng, ages):
+    """Ngày sinh khớp với tuổi (tính theo REFERENCE_YEAR)"""
+    years = (REFERENCE_YEAR - ages - 1970).astype('datetime64[Y]').astype('datetime64[D]')
+    return np.datetime_as_string(years + rng.integers(0, 365, len(ages)), unit='D')
+
+def random_ages(rng, n):
+    """Tuổi ngẫu nhiên và nhóm tuổi tương ứng"""
+    ages = rng.integers(1, 96, n)
+    conditions = [(ages >= low) & (ages <= high) for _, low, high in NHOM_TUOI]
+    groups = np.select(conditions, [group for group, _, _ in NHOM_TUOI], default='')
+    return ages, groups
+
+def add_duplicates(rng, df, rate=DUPLICATE_RATE):
+    """Thêm một tỷ lệ dòng trùng lặp hoàn toàn vào cuối chunk"""
+    n_duplicates = int(len(df) * rate)
+    if n_duplicates == 0:
+        return df
+    return pd.concat([df, df.iloc[rng.integers(0, len(df), n_duplicates)]], ignore_index=True)
+
+# ============================================================================
+# SINH TỪNG BẢNG
+# ============================================================================
+
+# Mỗi hàm sinh các dòng có số thứ tự [start + 1, start + n] của bảng
+
+def generate_patients(rng, start, n, sizes):
+    ages, groups = random_ages(rng, n)
+    numbers = np.arange(start + 1, start + n + 1)
+    df = pd.DataFrame({
+        'patient_id': make_ids('patients', numbers, sizes),
+        'ho_ten': numbered('Bệnh nhân ', numbers),
+        'gioi_tinh': choice(rng, GIOI_TINH, n),
+        'ngay_sinh': birth_dates(rng, ages),
+        'tuoi': ages,
+        'nhom_tuoi': groups,
+        'nhom_mau': choice(rng, NHOM_MAU, n),
+        'so_dien_thoai': rng.integers(10**8, 10**9, n),
+        'email': with_missing(rng, numbered('bn', numbers, '@email.com'), MISSING_RATE / 10),
+        'dia_chi': with_missing(rng, np.char.add(numbered('Số ', numbers % 500 + 1), numbered(', đường ', numbers % 97 + 1))),
+        'thanh_pho': choice(rng, THANH_PHO, n),
+        'tien_su_benh': with_missing(rng, choice(rng, TIEN_SU_BENH, n), 0.5),
+        'di_ung': with_missing(rng, choice(rng, DI_UNG, n), 0.7),
+        'trang_thai': choice(rng, TRANG_THAI_BENH_NHAN, n),
+        'ngay_dang_ky': random_dates(rng, '2018-01-01', '2025-01-01', n)
+    })
+    return add_duplicates(rng, df)
+
+def generate_doctors(rng, start, n, sizes):
+    ages = rng.integers(28, 66, n)
+    numbers = np.arange(start + 1, start + n + 1)
+    return pd.DataFrame({
+        'doctor_id': make_ids('doctors', numbers, sizes),
+        'ho_ten': numbered('Bác sĩ ', numbers),
+        'gioi_tinh': choice(rng, GIOI_TINH, n),
+        'ngay_sinh': birth_dates(rng, ages),
+        'tuoi': ages,
+        'chuyen_khoa': choice(rng, CHUYEN_KHOA, n),
+        'hoc_vi': choice(rng, HOC_VI, n),
+        'nam_kinh_nghiem': ages - 26 - rng.integers(0, 3, n),
+        'so_dien_thoai': numbered('0', rng.integers(10**8, 10**9, n)),
+        'email': numbered('bs', numbers, '@benhvien.vn'),
+        'benh_vien': choice(rng, BENH_VIEN, n),
+        'thanh_pho': choice(rng, THANH_PHO, n)
+    })
+
+def generate_medications(rng, start, n, sizes):
+    numbers = np.arange(start + 1, start + n + 1)
+    return pd.DataFrame({
+        'medication_id': make_ids('medications', numbers, sizes),
+        'ten_thuoc': numbered('Thuốc ', numbers),
+        'hoat_chat': choice(rng, HOAT_CHAT, n),
+        'ham_luong': choice(rng, HAM_LUONG, n),
+        'dang_bao_che': choice(rng, DANG_BAO_CHE, n),
+        'nha_san_xuat': choice(rng, NHA_SAN_XUAT, n),
+        'gia_ban': rng.integers(5, 2000, n) * 1000,
+        'don_vi': choice(rng, DON_VI, n),
+        'han_su_dung': random_dates(rng, '2025-01-01', '2029-01-01', n),
+        'nhom_thuoc': choice(rng, NHOM_THUOC, n)
+    })
+
+def generate_diagnoses(rng, start, n, sizes):
+    numbers = np.arange(start + 1, start + n + 1)
+    return pd.DataFrame({
+        'diagnosis_id': make_ids('diagnoses', numbers, sizes),
+        'ma_icd': [f'{chr(65 + i % 26)}{i % 100:02d}' for i in numbers],
+        'ten_benh': choice(rng, CHAN_DOAN, n),
+        'nhom_benh': choice(rng, NHOM_BENH, n),
+        'muc_do': choice(rng, MUC_DO, n),
+        'trieu_chung_chinh': choice(rng, TRIEU_CHUNG, n),
+        'phuong_phap_dieu_tri': choice(rng, PHUONG_PHAP_DIEU_TRI, n),
+        'ty_le_hoi_phuc': numbered('', rng.integers(40, 100, n), '%'),
+        'thoi_gian_dieu_tri': rng.integers(3, 180, n),
+        'ghi_chu': with_missing(rng, choice(rng, GHI_CHU, n), 0.3)
+    })
+
+def generate_medical_records(rng, start, n, sizes):
+    numbers = np.arange(start + 1, start + n + 1)
+    
+    # Khóa ngoại: một tỷ lệ nhỏ trỏ tới bệnh nhân / thuốc không tồn tại
+    patient_numbers = rng.integers(1, sizes['patients'] + 1, n)
+    invalid = rng.random(n) < INVALID_FK_RATE
+    patient_numbers[invalid] += sizes['patients']
+    medication_numbers = rng.integers(1, sizes['medications'] + 1, n)
+    invalid = rng.random(n) < INVALID_FK_RATE
+    medication_numbers[invalid] += sizes['medications']
+    
+    chi_phi_kham = rng.integers(100, 500, n) * 1000
+    chi_phi_thuoc = rng.integers(0, 2000, n) * 1000
+    tong_chi_phi = chi_phi_kham + chi_phi_thuoc
+    # Một tỷ lệ nhỏ tổng chi phí không khớp để bước kiểm tra nhất quán có việc làm
+    mismatch = rng.random(n) < INVALID_FK_RATE
+    tong_chi_phi[mismatch] += rng.integers(2, 50, int(mismatch.sum())) * 1000
+    
+    ngay_kham = random_dates(rng, '2020-01-01', '2025-01-01', n)
+    
+    df = pd.DataFrame({
+        'record_id': make_ids('medical_records', numbers, sizes),
+        'patient_id': make_ids('patients', patient_numbers, sizes),
+        'doctor_id': make_ids('doctors', rng.integers(1, sizes['doctors'] + 1, n), sizes),
+        'diagnosis_id': make_ids('diagnoses', rng.integers(1, sizes['diagnoses'] + 1, n), sizes),
+        'medication_id': make_ids('medications', medication_numbers, sizes),
+        'ngay_kham': ngay_kham,
+        'loai_kham': choice(rng, LOAI_KHAM, n),
+        'trieu_chung': choice(rng, TRIEU_CHUNG, n),
+        'xet_nghiem': choice(rng, XET_NGHIEM, n),
+        'ket_qua_xet_nghiem': with_missing(rng, choice(rng, KET_QUA, n), 0.2),
+        'chan_doan': choice(rng, CHAN_DOAN, n),
+        'muc_do': choice(rng, MUC_DO, n),
+        'phuong_phap_dieu_tri': choice(rng, PHUONG_PHAP_DIEU_TRI, n),
+        'so_ngay_dung_thuoc': rng.integers(1, 60, n),
+        'chi_phi_kham': chi_phi_kham,
+        'chi_phi_thuoc': chi_phi_thuoc,
+        'tong_chi_phi': tong_chi_phi,
+        'bao_hiem': choice(rng, ['Có', 'Không'], n),
+        'trang_thai': choice(rng, TRANG_THAI_HO_SO, n),
+        'ngay_tai_kham': with_missing(rng, random_dates(rng, '2020-02-01', '2025-03-01', n), 0.4),
+        'khoa': choice(rng, CHUYEN_KHOA, n),
+        'ghi_chu': with_missing(rng, choice(rng, GHI_CHU, n), 0.5)
+    })
+    return add_duplicates(rng, df)
+
+GENERATORS = {
+    'patients': generate_patients,
+    'doctors': generate_doctors,
+    'medical_records': generate_medical_records,
+    'medications': generate_medications,
+    'diagnoses': generate_diagnoses
+}
+
+# ============================================================================
+# SINH SONG SONG THEO CHUNK VÀ GHI FILE
+# ============================================================================
+
+def to_csv_bytes(df, header=True):
+    """Chuyển DataFrame sang CSV (UTF-8); dùng bộ ghi CSV của pyarrow nếu có vì nhanh hơn nhiều"""
+    if HAS_PYARROW:
+        buffer = io.BytesIO()
+        pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buffer,
+                         write_options=pa_csv.WriteOptions(include_header=header))
+        return buffer.getvalue()
+    return df.to_csv(index=False, header=header).encode('utf-8')
+
+def generate_chunk(name, chunk_index, sizes, seed=SEED):
+    """Sinh một chunk của bảng (chạy trong tiến trình con), trả về (số dòng, nội dung CSV dạng bytes)
+    
+    Seed của chunk chỉ phụ thuộc (seed, bảng, số thứ tự chunk) nên kết quả không đổi
+    khi thay số tiến trình.
+    """
+    table_index = list(GENERATORS).index(name)
+    rng = np.random.default_rng([seed, table_index, chunk_index])
+    start = chunk_index * CHUNK_ROWS
+    n = min(CHUNK_ROWS, sizes[name] - start)
+    df = GENERATORS[name](rng, start, n, sizes)
+    return len(df), to_csv_bytes(df, header=(chunk_index == 0))
+
+def write_table(name, sizes, executor, seed=SEED, output_dir=DATA_DIR, window=WORKERS * 2):
+    """Sinh và ghi một bảng ra CSV; các chunk chạy song song, ghi ra theo đúng thứ tự
+    
+    Chỉ giữ tối đa `window` chunk đang chờ ghi để bộ nhớ không tăng theo quy mô.
+    Trả về số dòng đã ghi (gồm cả dòng trùng lặp thêm vào mỗi chunk).
+    """
+    output_file = os.path.join(output_dir, FILES[name])
+    n_chunks = -(-sizes[name] // CHUNK_ROWS)
+    n_rows = 0
+    
+    def write(future):
+        nonlocal n_rows
+        rows, content = future.result()
+        f.write(content)
+        n_rows += rows
+    
+    with open(output_file, 'wb') as f:
+        f.write('\ufeff'.encode('utf-8'))  # BOM như file CSV gốc (utf-8-sig)
+        pending = []
+        for chunk_index in range(n_chunks):
+            pending.append(executor.submit(generate_chunk, name, chunk_index, sizes, seed))
+            if len(pending) >= window:
+                write(pending.pop(0))
+        for future in pending:
+            write(future)
+    
+    print(f"✓ Đã sinh {output_file}: {n_rows:,} dòng ({sizes[name]:,} dòng gốc + {n_rows - sizes[name]:,} dòng trùng lặp, "
+          f"{n_chunks} chunk)")
+    return n_rows
+
+def generate_data(scale=SCALE, seed=SEED, output_dir=DATA_DIR, workers=WORKERS):
+    """Sinh toàn bộ 5 bảng vào `output_dir`, trả về số dòng đã ghi của mỗi bảng"""
+    print("=" * 80)
+    print(f"SINH DỮ LIỆU TỔNG HỢP (QUY MÔ {scale}x, SEED {seed}, {workers} TIẾN TRÌNH)")
+    print("=" * 80)
+    
+    sizes = table_sizes(scale)
+    os.makedirs(output_dir, exist_ok=True)
+    start_time = time.perf_counter()
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        rows = {
+            name: write_table(name, sizes, executor, seed=seed, output_dir=output_dir, window=workers * 2)
+            for name in GENERATORS
+        }
+    
+    print(f"\n✓ Hoàn tất sau {time.perf_counter() - start_time:.1f}s: {sum(rows.values()):,} dòng "
+          f"- dữ liệu nằm trong thư mục: {output_dir}")
+    return rows
+
+# Chạy chương trình
+if __name__ == "__main__":
+    scale = float(sys.argv[1]) if len(sys.argv) > 1 else SCALE
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else SEED
+    generate_data(scale=scale, seed=seed)
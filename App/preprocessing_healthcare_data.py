@@ -10,6 +10,40 @@ import warnings
 import os
 import json
 import re
+import sys
+import time
+import glob
+import hashlib
+import contextlib
+import io
+import inspect
+import pickle
+import shutil
+import tracemalloc
+import threading
+import functools
+import types
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    pa = pq = None
+    HAS_PYARROW = False
+
+try:
+    import duckdb
+    HAS_DUCKDB = True
+except ImportError:
+    duckdb = None
+    HAS_DUCKDB = False
+
+try:
+    import resource
+except ImportError:  # Windows không có module resource
+    resource = None
 
 warnings.filterwarnings('ignore')
 
@@ -34,119 +68,448 @@ FILES = {
     'diagnoses': 'diagnoses.csv'
 }
 
+# Schema khai báo cho từng bảng (theo tên trong FILES):
+# - cột ít giá trị phân biệt -> category
+# - cột số -> kiểu số nguyên nhỏ nhất đủ chứa (nullable để giữ được giá trị thiếu)
+# Cột không khai báo (mã ID, họ tên, email, ngày tháng...) được pandas tự suy luận.
+TABLE_SCHEMAS = {
+    'patients': {
+        'gioi_tinh': 'category',
+        'nhom_tuoi': 'category',
+        'nhom_mau': 'category',
+        'thanh_pho': 'category',
+        'tien_su_benh': 'category',
+        'di_ung': 'category',
+        'trang_thai': 'category',
+        'tuoi': 'Int8'
+    },
+    'doctors': {
+        'gioi_tinh': 'category',
+        'chuyen_khoa': 'category',
+        'hoc_vi': 'category',
+        'thanh_pho': 'category',
+        'tuoi': 'Int8',
+        'nam_kinh_nghiem': 'Int8'
+    },
+    'medical_records': {
+        'loai_kham': 'category',
+        'trieu_chung': 'category',
+        'xet_nghiem': 'category',
+        'ket_qua_xet_nghiem': 'category',
+        'chan_doan': 'category',
+        'muc_do': 'category',
+        'trang_thai': 'category',
+        'so_ngay_dung_thuoc': 'Int16',
+        'chi_phi_kham': 'Int32',
+        'chi_phi_thuoc': 'Int32',
+        'tong_chi_phi': 'Int32'
+    },
+    'medications': {
+        'dang_bao_che': 'category',
+        'don_vi': 'category',
+        'nhom_thuoc': 'category',
+        'gia_ban': 'Int32'
+    },
+    'diagnoses': {
+        'nhom_benh': 'category',
+        'muc_do': 'category',
+        'thoi_gian_dieu_tri': 'Int16'
+    }
+}
+
+# Khóa chính của từng bảng
+KEY_COLUMNS = {
+    'patients': 'patient_id',
+    'doctors': 'doctor_id',
+    'medical_records': 'record_id',
+    'medications': 'medication_id',
+    'diagnoses': 'diagnosis_id'
+}
+
+# Khóa ngoại trong medical_records -> bảng được tham chiếu
+FOREIGN_KEYS = {
+    'patient_id': 'patients',
+    'doctor_id': 'doctors',
+    'diagnosis_id': 'diagnoses',
+    'medication_id': 'medications'
+}
+
+# Các cột mã ID (khóa chính và khóa ngoại)
+ID_COLUMNS = set(KEY_COLUMNS.values()) | set(FOREIGN_KEYS)
+
+# Các cột ngày tháng cần chuẩn hóa (định dạng YYYY-MM-DD)
+DATE_COLUMNS = {
+    'patients': ['ngay_sinh', 'ngay_dang_ky'],
+    'doctors': ['ngay_sinh'],
+    'medical_records': ['ngay_kham'],
+    'medications': ['han_su_dung']
+}
+
+# Các cột số cần chuẩn hóa
+NUMERIC_COLUMNS = {
+    'patients': ['tuoi'],
+    'doctors': ['tuoi', 'nam_kinh_nghiem'],
+    'medical_records': ['chi_phi_kham', 'chi_phi_thuoc', 'tong_chi_phi', 'so_ngay_dung_thuoc'],
+    'medications': ['gia_ban'],
+    'diagnoses': ['ty_le_hoi_phuc']
+}
+
+# Cột chuỗi có tỷ lệ giá trị phân biệt / số dòng không vượt quá ngưỡng này
+# được giữ ở dạng category sau khi chuẩn hóa (trừ các cột mã ID)
+CATEGORY_MAX_RATIO = 0.5
+
+# Bỏ khoảng trắng đầu/cuối và gộp nhiều khoảng trắng thành một trong các cột chuỗi. Tắt mặc
+# định để giữ nguyên kết quả đầu ra như trước: bước chuẩn hóa chuỗi cũ chỉ xét cột kiểu
+# object, mà pandas >= 3 đọc cột chuỗi thành kiểu str nên không cột nào được chuẩn hóa.
+# Bật lên sẽ thay đổi các file đã làm sạch và result.csv khi dữ liệu có khoảng trắng thừa.
+NORMALIZE_WHITESPACE = False
+
+# Khóa thay thế (surrogate key): cột mã ID dạng tiền tố + số có đệm 0 (ví dụ BN0000001) được
+# đổi sang int32 ngay khi đọc; dạng (tiền tố, số chữ số) của cột được lưu kèm bảng trong
+# DataFrame.attrs (xem id_key_formats). Trùng lặp, toàn vẹn tham chiếu, join và sắp xếp chạy
+# trên số nguyên; dạng chuỗi chỉ được tạo lại khi lưu, xuất kết quả hoặc hiển thị. Cột có giá
+# trị thiếu hoặc mã không cùng dạng được giữ dạng chuỗi.
+SURROGATE_KEYS = True
+
+# Điền giá trị mặc định cho các cột mô tả bị thiếu (tien_su_benh, di_ung: 'Không';
+# ket_qua_xet_nghiem: 'Chưa có kết quả'; ghi_chu: ''). Tắt mặc định để giữ nguyên kết quả
+# đầu ra như trước: lệnh df['cot'].fillna(..., inplace=True) cũ không sửa bảng với pandas
+# copy-on-write (pandas >= 3), nên các cột này vẫn để trống trong file đã làm sạch.
+# Bật lên sẽ thay đổi patients_cleaned, medical_records_cleaned, diagnoses_cleaned và result.csv.
+FILL_MISSING_DEFAULTS = False
+
+# Số thread đọc song song các file CSV (1 = đọc tuần tự)
+LOAD_WORKERS = len(FILES)
+
+# Parser CSV cho từng file: 'c' (mặc định của pandas) hoặc 'pyarrow' (đa luồng, cần cài pyarrow)
+CSV_ENGINE = 'c'
+
+# Định dạng lưu dữ liệu đã làm sạch: 'csv', 'parquet' hoặc 'arrow' (Arrow IPC dạng stream).
+# Parquet/Arrow giữ nguyên kiểu category/ngày/số và cần cài pyarrow.
+OUTPUT_FORMAT = 'csv'
+OUTPUT_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+COLUMNAR_COMPRESSION = 'zstd'
+
+# Kho cột: mỗi cột số/ngày và mã của mỗi cột category của các bảng đã làm sạch được ghi
+# thêm thành một file .npy (kèm manifest.json) trong thư mục con COLUMN_STORE_DIR của thư mục
+# output, để các tiến trình khác đọc bằng np.load(mmap_mode='r') mà không phải parse CSV.
+# Mặc định tắt vì kho cột tốn thêm thời gian ghi và dung lượng đĩa
+WRITE_COLUMN_STORE = False
+COLUMN_STORE_DIR = 'columns'
+
+# Chế độ in-place: các bước làm sạch sửa trực tiếp trên bảng đầu vào thay vì tạo bản sao,
+# mỗi bảng chỉ giữ khoảng một bản làm việc trong suốt quy trình
+INPLACE_MODE = False
+
+# Ghi nhận bộ nhớ của các bảng và bộ nhớ đỉnh (tracemalloc) sau từng bước
+MEMORY_REPORT = False
+
+# Checkpoint theo nội dung: kết quả mỗi bước được lưu vào CHECKPOINT_DIR (bảng dạng Arrow IPC)
+# với khóa là fingerprint của các file đầu vào, mã nguồn và hằng cấu hình các bước từ đầu đến bước đó
+USE_CHECKPOINTS = False
+CHECKPOINT_DIR = ".checkpoints/"
+
+# Sai số hạng (rank error, tính theo tỉ lệ số dòng) của quantile sketch dùng để tính ngưỡng
+# IQR của medical_records ở chế độ streaming/song song theo shard (bảng nằm trong bộ nhớ
+# dùng quantile chính xác); 0 hoặc None để tính chính xác
+OUTLIER_SKETCH_EPSILON = 0.001
+OUTLIER_COLUMNS = {
+    'patients': ['tuoi'],
+    'medical_records': ['chi_phi_kham', 'chi_phi_thuoc', 'tong_chi_phi']
+}
+
+# Số giá trị phổ biến nhất giữ lại cho mỗi cột trong profile bảng (xem profile_table)
+PROFILE_TOP_K = 15
+
+# Thời gian, số dòng và bộ nhớ đỉnh của từng bước được ghi vào REPORT_FILE; đặt
+# PROFILE_TRACE_FILE để ghi nối thêm trace dạng JSON-lines (mỗi dòng một bước) qua các lần chạy
+REPORT_FILE = 'data_quality_report.json'
+PROFILE_TRACE_FILE = None
+
+# Chế độ song song: medical_records được chia theo hash của patient_id thành SHARD_WORKERS
+# phần và làm sạch trên nhiều tiến trình (1 = tắt)
+SHARD_WORKERS = 1
+
+# Chế độ đồ thị phụ thuộc: các bước được chia theo bảng, mỗi bước khai báo bảng/báo cáo
+# đầu vào và đầu ra, các nhánh độc lập chạy đồng thời trên DAG_WORKERS luồng (0 = tắt)
+DAG_WORKERS = 0
+
+# Chế độ streaming: medical_records được xử lý theo từng chunk CHUNK_SIZE dòng,
+# chỉ các bảng dimension nhỏ (patients, doctors, diagnoses, medications) nằm trong bộ nhớ
+STREAMING_MODE = False
+CHUNK_SIZE = 100_000
+
+# Engine làm sạch medical_records: 'pandas' (cài đặt tham chiếu) hoặc 'duckdb' (xử lý medical_records
+# theo luồng bằng DuckDB: chạy trong tiến trình, không cần server, cần cài duckdb). Với 'duckdb',
+# loại trùng lặp, anti-join khóa ngoại, chuẩn hóa và sửa tổng chi phí chạy bằng SQL đa luồng
+# (ENGINE_THREADS), dữ liệu vượt ENGINE_MEMORY_LIMIT được tràn ra đĩa trong ENGINE_TEMP_DIR.
+# Các bảng dimension luôn dùng pandas.
+ENGINE = 'pandas'
+ENGINE_THREADS = os.cpu_count()
+ENGINE_MEMORY_LIMIT = '2GB'
+ENGINE_TEMP_DIR = '.engine_tmp/'
+
 # ============================================================================
 # BƯỚC 2: ĐỌC DỮ LIỆU
 # ============================================================================
 
-def load_data():
-    """Đọc tất cả các file CSV"""
-    data = {}
-    for name, filename in FILES.items():
-        filepath = DATA_DIR + filename
+def read_table(name, filepath, id_formats=None, out=None, **kwargs):
+    """Đọc một file CSV theo schema khai báo trong TABLE_SCHEMAS
+    
+    Cột category được đọc thẳng thành category. Cột số được đọc theo kiểu pandas tự suy
+    luận rồi mới ép về kiểu khai báo, vì parser CSV tràn số âm thầm khi đọc thẳng vào kiểu
+    hẹp (ví dụ 99999999999 thành 1215752191 với Int32); cột nào có giá trị không ép được
+    (không phải số, vượt phạm vi kiểu) thì giữ kiểu tự suy luận. Cột mã ID được đổi sang khóa
+    thay thế (xem encode_id_columns) theo dạng mã trong `id_formats` nếu có; khi đọc theo chunk
+    thì ép kiểu và đổi trên từng chunk, các chunk sau dùng cùng dạng mã với chunk trước.
+    """
+    schema = TABLE_SCHEMAS.get(name, {})
+    
+    def apply_schema(df, formats):
+        for col, dtype in schema.items():
+            if col in df.columns and dtype != 'category':
+                try:
+                    df[col] = df[col].astype(dtype)
+                except (ValueError, TypeError, OverflowError):
+                    print(f"  ⚠ {name}.{col}: Giữ kiểu {df[col].dtype}", file=out)
+        return encode_id_columns(df, formats)
+    
+    def apply_schema_chunks(reader):
+        formats = dict(id_formats or {})
+        for chunk in reader:
+            chunk = apply_schema(chunk, formats)
+            formats = {**id_key_formats(chunk), **formats}
+            yield chunk
+    
+    categorical = {col: dtype for col, dtype in schema.items() if dtype == 'category'}
+    # Đọc với encoding UTF-8-BOM
+    df = pd.read_csv(filepath, encoding='utf-8-sig', dtype=categorical, **kwargs)
+    if kwargs.get('chunksize'):
+        return apply_schema_chunks(df)
+    return apply_schema(df, id_formats)
+
+def load_data(tables=None, workers=LOAD_WORKERS, engine=CSV_ENGINE, out=None):
+    """Đọc tất cả các file CSV (hoặc chỉ các bảng trong `tables`)
+    
+    workers > 1: đọc các file song song bằng thread pool, thời gian đọc xấp xỉ
+    thời gian đọc file lớn nhất thay vì tổng thời gian của tất cả các file.
+    engine='pyarrow': dùng parser CSV đa luồng của pyarrow cho từng file.
+    """
+    if engine == 'pyarrow' and not HAS_PYARROW:
+        print("⚠ Chưa cài pyarrow, dùng parser 'c' mặc định", file=out)
+        engine = 'c'
+    
+    names = [name for name in FILES if tables is None or name in tables]
+    
+    def read_one(name):
         try:
-            # Đọc với encoding UTF-8-BOM
-            data[name] = pd.read_csv(filepath, encoding='utf-8-sig')
-            print(f"✓ Đã đọc {filename}: {len(data[name])} dòng, {len(data[name].columns)} cột")
+            return read_table(name, DATA_DIR + FILES[name], engine=engine, out=out), None
         except Exception as e:
-            print(f"✗ Lỗi khi đọc {filename}: {e}")
+            return None, e
+    
+    if workers > 1 and len(names) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = dict(zip(names, executor.map(read_one, names)))
+    else:
+        results = {name: read_one(name) for name in names}
+    
+    data = {}
+    for name in names:
+        df, error = results[name]
+        filename = FILES[name]
+        if error is not None:
+            print(f"✗ Lỗi khi đọc {filename}: {error}", file=out)
+            continue
+        data[name] = df
+        memory_mb = df.memory_usage(deep=True).sum() / 1024**2
+        print(f"✓ Đã đọc {filename}: {len(df)} dòng, {len(df.columns)} cột, {memory_mb:.1f} MB", file=out)
     return data
 
-def basic_info(data):
+def basic_info(data, out=None):
     """Hiển thị thông tin cơ bản của từng bảng"""
     for name, df in data.items():
-        print(f"\n{'='*60}")
-        print(f"BẢNG: {name.upper()}")
-        print(f"{'='*60}")
-        print(f"Kích thước: {df.shape[0]} dòng x {df.shape[1]} cột")
-        print(f"\nKiểu dữ liệu:")
-        print(df.dtypes)
-        print(f"\n5 dòng đầu tiên:")
-        print(df.head())
+        print(f"\n{'='*60}", file=out)
+        print(f"BẢNG: {name.upper()}", file=out)
+        print(f"{'='*60}", file=out)
+        print(f"Kích thước: {df.shape[0]} dòng x {df.shape[1]} cột", file=out)
+        print(f"\nKiểu dữ liệu:", file=out)
+        print(df.dtypes, file=out)
+        print(f"\n5 dòng đầu tiên:", file=out)
+        print(decode_id_columns(df.head()), file=out)
 
 # ============================================================================
 # BƯỚC 3: KIỂM TRA DỮ LIỆU THIẾU
 # ============================================================================
 
-def check_missing_values(data):
-    """Kiểm tra và báo cáo giá trị thiếu"""
-    print("\n" + "="*80)
-    print("KIỂM TRA DỮ LIỆU THIẾU")
-    print("="*80)
+def check_missing_values(data, profiles=None, out=None):
+    """Kiểm tra và báo cáo giá trị thiếu
+    
+    profiles: profile đã tính của các bảng (xem profile_tables); tự tính nếu không có
+    """
+    print("\n" + "="*80, file=out)
+    print("KIỂM TRA DỮ LIỆU THIẾU", file=out)
+    print("="*80, file=out)
+    
+    if profiles is None:
+        profiles = profile_tables(data)
     
     missing_report = {}
     
     for name, df in data.items():
-        missing_count = df.isnull().sum()
-        missing_percent = (missing_count / len(df)) * 100
-        
-        missing_df = pd.DataFrame({
-            'Cột': missing_count.index,
-            'Số lượng thiếu': missing_count.values,
-            'Tỷ lệ (%)': missing_percent.values
-        })
-        missing_df = missing_df[missing_df['Số lượng thiếu'] > 0].sort_values('Số lượng thiếu', ascending=False)
-        
-        if len(missing_df) > 0:
-            print(f"\n{name.upper()}:")
-            print(missing_df.to_string(index=False))
-            missing_report[name] = missing_df
-        else:
-            print(f"\n{name.upper()}: Không có dữ liệu thiếu ✓")
-            missing_report[name] = None
+        missing_report[name] = report_missing_counts(name, missing_counts(profiles[name]), len(df), out=out)
     
     return missing_report
 
-def handle_missing_patients(df):
+def report_missing_counts(name, missing_count, n_rows, out=None):
+    """In bảng giá trị thiếu của một bảng từ số lượng thiếu theo cột"""
+    missing_percent = (missing_count / max(n_rows, 1)) * 100
+    
+    missing_df = pd.DataFrame({
+        'Cột': missing_count.index,
+        'Số lượng thiếu': missing_count.values,
+        'Tỷ lệ (%)': missing_percent.values
+    })
+    missing_df = missing_df[missing_df['Số lượng thiếu'] > 0].sort_values('Số lượng thiếu', ascending=False)
+    
+    if len(missing_df) > 0:
+        print(f"\n{name.upper()}:", file=out)
+        print(missing_df.to_string(index=False), file=out)
+        return missing_df
+    
+    print(f"\n{name.upper()}: Không có dữ liệu thiếu ✓", file=out)
+    return None
+
+def to_json_value(value):
+    """Đổi giá trị numpy/pandas sang kiểu JSON được (số, chuỗi, None)"""
+    if value is None or (np.ndim(value) == 0 and pd.isna(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return str(pd.Timestamp(value))
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+def profile_column(series, top_k=PROFILE_TOP_K):
+    """Profile một cột trong một lần duyệt: số giá trị thiếu, số giá trị khác nhau, min/max
+    và top-k giá trị phổ biến nhất (đều suy ra từ một lần factorize)
+    
+    Khóa thay thế được profile như cột mã ID dạng chuỗi (chỉ đổi lại các giá trị top-k).
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    present = codes[codes >= 0]
+    counts = np.bincount(present, minlength=len(uniques))
+    top = np.argsort(-counts, kind='stable')[:top_k]
+    
+    surrogate = is_surrogate_key(series)
+    top_values = decode_id_column(set_id_key_formats(pd.Series(uniques[top], name=series.name), id_key_formats(series)))
+    column_profile = {
+        'dtype': str(top_values.dtype if surrogate else series.dtype),
+        'nulls': int(len(codes) - len(present)),
+        'distinct': int(len(uniques)),
+        'min': None,
+        'max': None,
+        'top_values': [[to_json_value(value), int(counts[i])] for value, i in zip(top_values, top)]
+    }
+    
+    orderable = pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_datetime64_any_dtype(series.dtype)
+    if orderable and not surrogate and not pd.api.types.is_bool_dtype(series.dtype) and len(uniques) > 0:
+        column_profile['min'] = to_json_value(uniques.min())
+        column_profile['max'] = to_json_value(uniques.max())
+    
+    return column_profile
+
+def profile_table(df, top_k=PROFILE_TOP_K):
+    """Profile một bảng: profile từng cột và số dòng hoàn toàn trùng lặp (theo hash)"""
+    return {
+        'rows': len(df),
+        'columns': {col: profile_column(df[col], top_k) for col in df.columns},
+        'duplicate_rows': int(duplicate_row_masks(df)[1].sum())
+    }
+
+def profile_tables(data, top_k=PROFILE_TOP_K):
+    """Profile tất cả các bảng, dùng chung cho bước kiểm tra thiếu, báo cáo và dashboard"""
+    return {name: profile_table(df, top_k) for name, df in data.items()}
+
+def missing_counts(table_profile):
+    """Số giá trị thiếu theo cột (Series) từ profile của bảng"""
+    return pd.Series(
+        {col: column_profile['nulls'] for col, column_profile in table_profile['columns'].items()},
+        dtype='int64'
+    )
+
+def working_copy(df, inplace=False):
+    """Bảng làm việc của một bước: bản sao (mặc định) hoặc chính bảng đầu vào khi inplace=True"""
+    return df if inplace else df.copy()
+
+def fill_missing(df, col, value):
+    """Điền giá trị thiếu của một cột (kể cả cột category chưa có `value` trong categories)
+    
+    Không làm gì khi FILL_MISSING_DEFAULTS tắt (xem phần cấu hình)
+    """
+    if not FILL_MISSING_DEFAULTS:
+        return
+    series = df[col]
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    df[col] = series.fillna(value)
+
+def handle_missing_patients(df, inplace=False):
     """Xử lý dữ liệu thiếu trong bảng patients"""
-    df_clean = df.copy()
+    df_clean = working_copy(df, inplace)
     
     # Email: Thay thế bằng giá trị mặc định hoặc tạo từ patient_id
     if df_clean['email'].isnull().any():
         mask = df_clean['email'].isnull()
-        df_clean.loc[mask, 'email'] = df_clean.loc[mask, 'patient_id'].str.lower() + '@email.com'
+        df_clean.loc[mask, 'email'] = decode_id_column(df_clean.loc[mask, 'patient_id']).str.lower() + '@email.com'
     
     # Tiền sử bệnh: Thay thế 'Không' nếu thiếu
     if 'tien_su_benh' in df_clean.columns and df_clean['tien_su_benh'].isnull().any():
-        df_clean['tien_su_benh'].fillna('Không', inplace=True)
+        fill_missing(df_clean, 'tien_su_benh', 'Không')
     
     # Dị ứng: Thay thế 'Không' nếu thiếu
     if 'di_ung' in df_clean.columns and df_clean['di_ung'].isnull().any():
-        df_clean['di_ung'].fillna('Không', inplace=True)
+        fill_missing(df_clean, 'di_ung', 'Không')
     
     return df_clean
 
-def handle_missing_medical_records(df):
+def handle_missing_medical_records(df, inplace=False):
     """Xử lý dữ liệu thiếu trong bảng medical_records"""
-    df_clean = df.copy()
+    df_clean = working_copy(df, inplace)
     
     # Ghi chú: Thay thế bằng chuỗi rỗng nếu thiếu
     if 'ghi_chu' in df_clean.columns and df_clean['ghi_chu'].isnull().any():
-        df_clean['ghi_chu'].fillna('', inplace=True)
+        fill_missing(df_clean, 'ghi_chu', '')
     
     # Kết quả xét nghiệm: Thay thế 'Chưa có kết quả' nếu thiếu
     if 'ket_qua_xet_nghiem' in df_clean.columns and df_clean['ket_qua_xet_nghiem'].isnull().any():
-        df_clean['ket_qua_xet_nghiem'].fillna('Chưa có kết quả', inplace=True)
+        fill_missing(df_clean, 'ket_qua_xet_nghiem', 'Chưa có kết quả')
     
     return df_clean
 
-def handle_missing_diagnoses(df):
+def handle_missing_diagnoses(df, inplace=False):
     """Xử lý dữ liệu thiếu trong bảng diagnoses"""
-    df_clean = df.copy()
+    df_clean = working_copy(df, inplace)
     
     # Ghi chú: Thay thế bằng chuỗi rỗng nếu thiếu
     if 'ghi_chu' in df_clean.columns and df_clean['ghi_chu'].isnull().any():
-        df_clean['ghi_chu'].fillna('', inplace=True)
+        fill_missing(df_clean, 'ghi_chu', '')
     
     return df_clean
 
-def handle_all_missing_values(data):
+def handle_all_missing_values(data, inplace=False):
     """Xử lý tất cả dữ liệu thiếu"""
+    handlers = {
+        'patients': handle_missing_patients,
+        'medical_records': handle_missing_medical_records,
+        'diagnoses': handle_missing_diagnoses
+    }
+    
     data_clean = {}
-    data_clean['patients'] = handle_missing_patients(data['patients'])
-    data_clean['doctors'] = data['doctors'].copy()  # Giả sử không cần xử lý
-    data_clean['medical_records'] = handle_missing_medical_records(data['medical_records'])
-    data_clean['medications'] = data['medications'].copy()  # Giả sử không cần xử lý
-    data_clean['diagnoses'] = handle_missing_diagnoses(data['diagnoses'])
+    for name, df in data.items():
+        if name in handlers:
+            data_clean[name] = handlers[name](df, inplace=inplace)
+        else:
+            data_clean[name] = working_copy(df, inplace)  # doctors, medications: giả sử không cần xử lý
     
     return data_clean
 
@@ -154,76 +517,134 @@ def handle_all_missing_values(data):
 # BƯỚC 4: KIỂM TRA DỮ LIỆU TRÙNG LẶP
 # ============================================================================
 
-def check_duplicates(data):
-    """Kiểm tra và báo cáo dữ liệu trùng lặp"""
-    print("\n" + "="*80)
-    print("KIỂM TRA DỮ LIỆU TRÙNG LẶP")
-    print("="*80)
+def duplicate_row_masks(df, row_hash=None):
+    """Mặt nạ dòng hoàn toàn trùng lặp (keep=False và keep='first') dựa trên hash 64-bit
+    
+    Hash của từng dòng (pd.util.hash_pandas_object) được tính một lần; chỉ các dòng có
+    hash trùng nhau mới được so sánh lại trên giá trị thật, nên kết quả chính xác như
+    df.duplicated() nhưng không phải băm lại toàn bộ các cột chuỗi.
+    """
+    if row_hash is None:
+        row_hash = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    
+    all_mask = np.zeros(len(df), dtype=bool)
+    first_mask = np.zeros(len(df), dtype=bool)
+    candidates = pd.Series(row_hash).duplicated(keep=False).to_numpy()
+    if candidates.any():
+        subset = df[candidates]
+        all_mask[candidates] = subset.duplicated(keep=False).to_numpy()
+        first_mask[candidates] = subset.duplicated(keep='first').to_numpy()
+    return all_mask, first_mask
+
+def compute_duplicate_info(df, key_col=None):
+    """Tính một lần thông tin trùng lặp của một bảng
+    
+    Gồm hash từng dòng, mặt nạ trùng lặp toàn dòng và mặt nạ trùng lặp theo khóa chính
+    (keep=False để báo cáo, keep='first' để xóa).
+    """
+    row_hash = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    row_all, row_first = duplicate_row_masks(df, row_hash)
+    info = {
+        'row_hash': row_hash,
+        'row_all': row_all,
+        'row_first': row_first,
+        'key_col': None
+    }
+    
+    if key_col and key_col in df.columns:
+        keys = df[key_col]
+        info['key_col'] = key_col
+        info['key_all'] = keys.duplicated(keep=False).to_numpy()
+        info['key_first'] = keys.duplicated(keep='first').to_numpy()
+    
+    return info
+
+def get_duplicate_info(name, df, cache=None):
+    """Lấy thông tin trùng lặp của một bảng từ cache (nếu khớp số dòng) hoặc tính mới"""
+    info = cache.get(name) if cache is not None else None
+    if info is None or len(info['row_hash']) != len(df):
+        info = compute_duplicate_info(df, KEY_COLUMNS.get(name))
+        if cache is not None:
+            cache[name] = info
+    return info
+
+def drop_rows(df, mask, inplace=False):
+    """Xóa các dòng theo mặt nạ boolean (theo vị trí dòng)"""
+    if inplace and df.index.is_unique:
+        df.drop(df.index[mask], inplace=True)
+        return df
+    return df[~mask]
+
+def check_duplicates(data, cache=None, out=None):
+    """Kiểm tra và báo cáo dữ liệu trùng lặp
+    
+    cache: dict lưu thông tin trùng lặp từng bảng để remove_duplicates dùng lại
+    """
+    print("\n" + "="*80, file=out)
+    print("KIỂM TRA DỮ LIỆU TRÙNG LẶP", file=out)
+    print("="*80, file=out)
     
     duplicate_report = {}
     
     for name, df in data.items():
-        # Tìm khóa chính của từng bảng
-        key_cols = {
-            'patients': 'patient_id',
-            'doctors': 'doctor_id',
-            'medical_records': 'record_id',
-            'medications': 'medication_id',
-            'diagnoses': 'diagnosis_id'
-        }
-        
-        key_col = key_cols.get(name)
+        info = get_duplicate_info(name, df, cache)
+        key_col = info['key_col']
         
         # Kiểm tra trùng lặp theo khóa chính
-        if key_col and key_col in df.columns:
-            duplicate_keys = df[df.duplicated(subset=[key_col], keep=False)]
-            if len(duplicate_keys) > 0:
-                print(f"\n{name.upper()}: Có {len(duplicate_keys)} dòng trùng lặp theo {key_col}")
-                duplicate_report[name] = duplicate_keys
+        if key_col:
+            n_duplicate_keys = int(info['key_all'].sum())
+            if n_duplicate_keys > 0:
+                print(f"\n{name.upper()}: Có {n_duplicate_keys} dòng trùng lặp theo {key_col}", file=out)
+                duplicate_report[name] = df[info['key_all']]
             else:
-                print(f"\n{name.upper()}: Không có trùng lặp theo {key_col} ✓")
+                print(f"\n{name.upper()}: Không có trùng lặp theo {key_col} ✓", file=out)
         
         # Kiểm tra dòng hoàn toàn trùng lặp
-        full_duplicates = df[df.duplicated(keep=False)]
-        if len(full_duplicates) > 0:
-            print(f"{name.upper()}: Có {len(full_duplicates)} dòng hoàn toàn trùng lặp")
+        n_full_duplicates = int(info['row_all'].sum())
+        if n_full_duplicates > 0:
+            print(f"{name.upper()}: Có {n_full_duplicates} dòng hoàn toàn trùng lặp", file=out)
         else:
-            print(f"{name.upper()}: Không có dòng hoàn toàn trùng lặp ✓")
+            print(f"{name.upper()}: Không có dòng hoàn toàn trùng lặp ✓", file=out)
     
     return duplicate_report
 
-def remove_duplicates(data):
-    """Xóa dữ liệu trùng lặp"""
-    data_clean = {}
+def remove_duplicates(data, inplace=False, cache=None, out=None):
+    """Xóa dữ liệu trùng lặp
     
-    key_cols = {
-        'patients': 'patient_id',
-        'doctors': 'doctor_id',
-        'medical_records': 'record_id',
-        'medications': 'medication_id',
-        'diagnoses': 'diagnosis_id'
-    }
+    Dùng lại thông tin trùng lặp đã tính ở check_duplicates (qua `cache`) và cập nhật
+    cache theo các dòng còn lại.
+    """
+    data_clean = {}
     
     for name, df in data.items():
-        df_clean = df.copy()
-        key_col = key_cols.get(name)
+        info = get_duplicate_info(name, df, cache)
         
-        # Xóa trùng lặp theo khóa chính (giữ dòng đầu tiên)
-        if key_col and key_col in df_clean.columns:
-            before = len(df_clean)
-            df_clean = df_clean.drop_duplicates(subset=[key_col], keep='first')
-            after = len(df_clean)
-            if before != after:
-                print(f"{name}: Đã xóa {before - after} dòng trùng lặp")
+        if info['key_col']:
+            # Xóa trùng lặp theo khóa chính (giữ dòng đầu tiên). Các dòng hoàn toàn trùng
+            # lặp có cùng khóa nên cũng đã bị xóa ở bước này.
+            drop_mask = info['key_first']
+            n_dropped = int(drop_mask.sum())
+            if n_dropped > 0:
+                print(f"{name}: Đã xóa {n_dropped} dòng trùng lặp", file=out)
+        else:
+            # Xóa dòng hoàn toàn trùng lặp
+            drop_mask = info['row_first']
+            n_dropped = int(drop_mask.sum())
+            if n_dropped > 0:
+                print(f"{name}: Đã xóa {n_dropped} dòng hoàn toàn trùng lặp", file=out)
         
-        # Xóa dòng hoàn toàn trùng lặp
-        before = len(df_clean)
-        df_clean = df_clean.drop_duplicates(keep='first')
-        after = len(df_clean)
-        if before != after:
-            print(f"{name}: Đã xóa {before - after} dòng hoàn toàn trùng lặp")
+        data_clean[name] = drop_rows(df, drop_mask, inplace) if n_dropped > 0 else working_copy(df, inplace)
         
-        data_clean[name] = df_clean
+        if cache is not None:
+            n_rows = len(data_clean[name])
+            cache[name] = {
+                'row_hash': info['row_hash'][~drop_mask],
+                'row_all': np.zeros(n_rows, dtype=bool),
+                'row_first': np.zeros(n_rows, dtype=bool),
+                'key_col': info['key_col'],
+                'key_all': np.zeros(n_rows, dtype=bool),
+                'key_first': np.zeros(n_rows, dtype=bool)
+            }
     
     return data_clean
 
@@ -231,79 +652,393 @@ def remove_duplicates(data):
 # BƯỚC 5: KIỂM TRA TÍNH TOÀN VẸN THAM CHIẾU
 # ============================================================================
 
-def check_referential_integrity(data):
-    """Kiểm tra tính toàn vẹn tham chiếu giữa các bảng"""
-    print("\n" + "="*80)
-    print("KIỂM TRA TÍNH TOÀN VẸN THAM CHIẾU")
-    print("="*80)
+def build_key_index(df, key_col):
+    """Chỉ mục khóa (hash index) của một bảng, dựng một lần và dùng lại cho mọi lần tra cứu
+    
+    Trả về {'index': pd.Index các khóa, 'id_format': dạng (tiền tố, số chữ số) nếu cột khóa
+    là khóa thay thế, None nếu cột giữ dạng chuỗi}. Vị trí trong chỉ mục trùng với vị trí
+    dòng trong bảng nên kết quả tra cứu dùng được trực tiếp cho phép join theo vị trí
+    (xem lookup_keys).
+    """
+    keys = df[key_col]
+    return {
+        'index': pd.Index(keys.to_numpy(), name=key_col),
+        'id_format': id_key_formats(keys).get(key_col) if is_surrogate_key(keys) else None
+    }
+
+def build_key_indexes(data):
+    """Dựng chỉ mục khóa cho các bảng được medical_records tham chiếu"""
+    return {
+        table: build_key_index(data[table], KEY_COLUMNS[table])
+        for table in FOREIGN_KEYS.values()
+        if table in data
+    }
+
+def lookup_keys(key_index, keys):
+    """Vị trí dòng trong bảng của từng khóa (-1 nếu không tồn tại)
+    
+    Các khóa cần tra được đưa về cùng dạng với chỉ mục trước (xem key_values). Nếu bảng
+    có khóa trùng lặp, lấy vị trí của lần xuất hiện đầu tiên.
+    """
+    index = key_index['index']
+    keys = key_values(keys, key_index['id_format'])
+    if index.is_unique:
+        return index.get_indexer(keys)
+    
+    first = ~index.duplicated(keep='first')
+    positions = np.flatnonzero(first)
+    found = index[first].get_indexer(keys)
+    return np.where(found >= 0, positions[found], -1)
+
+def id_key_bytes(values, length):
+    """Ma trận byte (n x length) của các mã ID và mặt nạ các mã dài đúng `length` byte
+    
+    Các chuỗi được chuyển sang mảng bytes cố định độ dài (thêm một byte để phát hiện mã
+    dài hơn, mã không phải ASCII được coi như chuỗi rỗng).
+    """
+    objects = values.to_numpy(dtype=object, na_value='')
+    try:
+        raw = np.asarray(objects, dtype=f'S{length + 1}')
+    except UnicodeEncodeError:
+        ascii_mask = values.fillna('').astype(str).str.isascii().to_numpy(dtype=bool)
+        raw = np.asarray(np.where(ascii_mask, objects, ''), dtype=f'S{length + 1}')
+    chars = raw.view(np.uint8).reshape(len(raw), length + 1)
+    return chars[:, :length], chars[:, length] == 0
+
+def id_key_codes(values, prefix, width):
+    """Mã số nguyên của từng mã ID theo dạng (tiền tố, số chữ số), -1 nếu thiếu hoặc không đúng dạng
+    
+    Các ký tự được kiểm tra và đổi sang số trên ma trận byte theo từng cột ký tự, không
+    tách chuỗi từng dòng.
+    """
+    values = pd.Series(values, copy=False)
+    try:
+        prefix_bytes = prefix.encode('ascii')
+    except UnicodeEncodeError:
+        return np.full(len(values), -1, dtype=np.int64)
+    
+    chars, valid = id_key_bytes(values, len(prefix) + width)
+    valid &= ~values.isna().to_numpy()
+    for j, byte in enumerate(prefix_bytes):
+        valid &= chars[:, j] == byte
+    
+    codes = np.zeros(len(values), dtype=np.int64)
+    for j in range(len(prefix), len(prefix) + width):
+        # Byte không phải chữ số cho giá trị > 9 (phép trừ trên uint8 bị tràn)
+        digit = chars[:, j] - np.uint8(ord('0'))
+        valid &= digit <= 9
+        codes = codes * 10 + digit
+    return np.where(valid, codes, -1)
+
+def id_key_format(values):
+    """Dạng (tiền tố, số chữ số) của mã ID theo giá trị không thiếu đầu tiên, None nếu không có"""
+    values = pd.Series(values, copy=False)
+    present = values.notna().to_numpy()
+    if not present.any():
+        return None
+    
+    first = str(values.iloc[present.argmax()])
+    prefix = first.rstrip('0123456789')
+    width = len(first) - len(prefix)
+    if width == 0 or width > 18:
+        return None
+    return prefix, width
+
+def encode_id_keys(values):
+    """Mã số nguyên của các mã ID dạng tiền tố + số có cùng độ dài (ví dụ BN0000001 -> 1)
+    
+    Vì các mã có cùng tiền tố và cùng số chữ số, thứ tự của mã số nguyên trùng với thứ tự
+    chuỗi. Dạng (tiền tố, số chữ số) lấy theo mã đầu tiên.
+    Trả về (tiền tố, số chữ số, mảng int64); None nếu có giá trị thiếu hoặc mã không cùng dạng.
+    """
+    values = pd.Series(values, copy=False)
+    id_format = id_key_format(values)
+    if id_format is None or values.isna().any():
+        return None
+    
+    codes = id_key_codes(values, *id_format)
+    if (codes < 0).any():
+        return None
+    return (*id_format, codes)
+
+def decode_id_keys(codes, prefix, width):
+    """Mã ID dạng chuỗi từ mã số nguyên (ngược lại của encode_id_keys), dựng trên ma trận byte
+    
+    Có pyarrow: trả về mảng chuỗi pyarrow (kiểu str của pandas) dựng thẳng từ buffer byte,
+    không tạo từng đối tượng chuỗi; ngược lại trả về mảng numpy.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    length = len(prefix) + width
+    chars = np.empty((len(codes), length), dtype=np.uint8)
+    chars[:, :len(prefix)] = np.frombuffer(prefix.encode('ascii'), dtype=np.uint8)
+    rest = codes
+    for j in range(length - 1, len(prefix) - 1, -1):
+        rest, digit = np.divmod(rest, 10)
+        chars[:, j] = digit + ord('0')
+    
+    if HAS_PYARROW:
+        offsets = np.arange(0, (len(codes) + 1) * length, length, dtype=np.int64)
+        array = pa.Array.from_buffers(pa.large_string(), len(codes), [None, pa.py_buffer(offsets), pa.py_buffer(chars)])
+        return array.to_pandas().array
+    return chars.view(f'S{length}').ravel().astype(str)
+
+# Khóa trong DataFrame.attrs chứa dạng {cột: (tiền tố, số chữ số)} của các cột đã đổi sang
+# khóa thay thế. Dạng mã đi cùng bảng (kể cả khi lọc/sao chép/pickle sang tiến trình khác)
+# nên đổi ngược lại được ở bất kỳ đâu mà không cần trạng thái toàn cục.
+ID_FORMATS_ATTR = 'id_key_formats'
+
+def id_key_formats(obj):
+    """Dạng mã {cột: (tiền tố, số chữ số)} lưu kèm bảng hoặc cột (DataFrame/Series.attrs)"""
+    return {col: tuple(id_format) for col, id_format in obj.attrs.get(ID_FORMATS_ATTR, {}).items()}
+
+def set_id_key_formats(obj, formats):
+    """Ghi dạng mã của các khóa thay thế vào attrs của bảng/cột (xóa mục nếu rỗng), trả về obj"""
+    attrs = {key: value for key, value in obj.attrs.items() if key != ID_FORMATS_ATTR}
+    if formats:
+        attrs[ID_FORMATS_ATTR] = {col: tuple(id_format) for col, id_format in formats.items()}
+    obj.attrs = attrs
+    return obj
+
+def is_surrogate_key(series):
+    """Cột có phải là khóa thay thế (cột mã ID đã đổi sang số nguyên) hay không"""
+    return series.name in id_key_formats(series) and pd.api.types.is_integer_dtype(series.dtype)
+
+def encode_id_column(series, id_format=None):
+    """Khóa thay thế int32 của một cột mã ID (xem SURROGATE_KEYS)
+    
+    id_format: dạng (tiền tố, số chữ số) phải dùng, ví dụ dạng của cột khóa ở bảng được
+    tham chiếu hoặc của các chunk trước; None thì lấy theo mã đầu tiên của cột.
+    Trả về (cột, dạng mã); giữ nguyên cột và trả về dạng None nếu cột có giá trị thiếu,
+    mã không đúng dạng hoặc mã vượt quá int32.
+    """
+    if not SURROGATE_KEYS or series.name not in ID_COLUMNS or not pd.api.types.is_string_dtype(series.dtype):
+        return series, None
+    id_format = id_format or id_key_format(series)
+    if id_format is None:
+        return series, None
+    
+    codes = id_key_codes(series, *id_format)
+    if (codes < 0).any() or codes.max(initial=0) > np.iinfo(np.int32).max:
+        return series, None
+    return pd.Series(codes.astype(np.int32), index=series.index, name=series.name), tuple(id_format)
+
+def encode_id_columns(df, formats=None):
+    """Đổi các cột mã ID của bảng sang khóa thay thế (sửa trực tiếp trên bảng)
+    
+    formats: {cột: dạng mã} phải dùng cho từng cột (xem encode_id_column); cột có dạng None
+    được giữ dạng chuỗi. Dạng mã của các cột đã đổi được ghi vào df.attrs (xem id_key_formats).
+    """
+    formats = formats or {}
+    encoded_formats = id_key_formats(df)
+    for col in df.columns:
+        if col in ID_COLUMNS and (col not in formats or formats[col] is not None):
+            encoded, id_format = encode_id_column(df[col], formats.get(col))
+            if id_format is not None:
+                df[col] = encoded
+                encoded_formats[col] = id_format
+    return set_id_key_formats(df, encoded_formats)
+
+def decode_id_column(series):
+    """Cột mã ID dạng chuỗi của một khóa thay thế; cột khác được giữ nguyên"""
+    if not is_surrogate_key(series):
+        return series
+    return pd.Series(decode_id_keys(series.to_numpy(), *id_key_formats(series)[series.name]),
+                     index=series.index, name=series.name)
+
+def decode_id_columns(df):
+    """Bảng với các khóa thay thế được đổi lại thành mã ID dạng chuỗi (để lưu/xuất/hiển thị)"""
+    decoded = {col: decode_id_column(df[col]) for col in df.columns if is_surrogate_key(df[col])}
+    if not decoded:
+        return df
+    formats = {col: id_format for col, id_format in id_key_formats(df).items() if col not in decoded}
+    return set_id_key_formats(df.assign(**decoded), formats)
+
+def reference_id_formats(data):
+    """Dạng mã của cột khóa mỗi bảng trong `data` ({cột khóa: dạng mã hoặc None nếu giữ chuỗi})
     
-    integrity_issues = {}
+    Dùng làm `formats` khi đọc bảng/chunk tham chiếu tới các bảng này (xem encode_id_columns),
+    để khóa ngoại được mã hóa đúng như khóa của bảng được tham chiếu.
+    """
+    formats = {}
+    for name, df in data.items():
+        key_col = KEY_COLUMNS.get(name)
+        if key_col in df.columns:
+            formats[key_col] = id_key_formats(df).get(key_col) if is_surrogate_key(df[key_col]) else None
+    return formats
+
+def key_values(values, id_format):
+    """Các khóa ở cùng dạng với chỉ mục khóa có dạng mã `id_format` (None: chỉ mục dạng chuỗi)
+    
+    Cột khóa ngoại chỉ khác dạng với khóa của bảng được tham chiếu khi một trong hai cột có
+    giá trị thiếu hoặc mã không đúng dạng nên giữ dạng chuỗi. Khi đó mã được đổi theo dạng
+    của chỉ mục; mã thiếu hoặc không đúng dạng có mã -1, không khớp với khóa nào.
+    """
+    if id_format is None:
+        return decode_id_column(values)
+    if is_surrogate_key(values) and id_key_formats(values)[values.name] == id_format:
+        return values
+    return pd.Series(id_key_codes(decode_id_column(values), *id_format), index=values.index, name=values.name)
+
+def lookup_sorted_keys(key_codes, codes):
+    """Vị trí dòng trong bảng của từng mã số nguyên (-1 nếu không tồn tại), không dùng bảng băm
+    
+    - mã của bảng liên tiếp (dense, ví dụ BN0000001..BN0080000): vị trí = mã - mã đầu tiên
+    - mã tăng dần: tìm nhị phân trên chính mảng mã
+    - còn lại: sắp xếp mã của bảng một lần (ổn định) rồi tìm nhị phân
+    Như lookup_keys, nếu bảng có mã trùng lặp thì lấy vị trí của lần xuất hiện đầu tiên.
+    """
+    n = len(key_codes)
+    if n == 0:
+        return np.full(len(codes), -1, dtype=np.intp)
+    
+    steps = np.diff(key_codes)
+    if (steps == 1).all():
+        positions = codes - key_codes[0]
+        return np.where((positions >= 0) & (positions < n), positions, -1).astype(np.intp)
+    
+    order = None
+    sorted_codes = key_codes
+    if not (steps > 0).all():
+        order = np.argsort(key_codes, kind='stable')
+        sorted_codes = key_codes[order]
+    positions = np.minimum(np.searchsorted(sorted_codes, codes), n - 1)
+    found = sorted_codes[positions] == codes
+    if order is not None:
+        positions = order[positions]
+    return np.where(found, positions, -1).astype(np.intp)
+
+def new_key_set():
+    """Tập khóa đã gặp (dùng để xóa trùng lặp giữa các chunk mà không giữ từng khóa trong set)
+    
+    Khóa được lưu thành các dãy đã sắp xếp ('runs') theo kiểu LSM: mã số nguyên theo
+    'id_format' (4-8 byte mỗi khóa) hoặc mảng chuỗi nếu id_format=None. Dãy mới được gộp với
+    dãy trước khi dãy trước không dài hơn hai lần, nên chỉ có O(log n) dãy và mỗi khóa được
+    sắp xếp lại O(log n) lần. 'missing' cho biết đã gặp khóa thiếu hay chưa.
+    """
+    return {'runs': [], 'id_format': None, 'missing': False}
+
+def key_set_size(key_set):
+    """Số khóa (không thiếu) trong tập khóa"""
+    return sum(len(run) for run in key_set['runs'])
+
+def key_set_array(values, id_format):
+    """Mảng các khóa không thiếu ở dạng của tập khóa (mã -1 nếu không đổi được theo id_format)
+    
+    Khóa số nguyên không phải khóa thay thế (ví dụ hash của dòng) được giữ nguyên.
+    """
+    values = values[values.notna().to_numpy()]
+    if id_format is None and pd.api.types.is_integer_dtype(values.dtype) and not is_surrogate_key(values):
+        return values.to_numpy()
+    values = key_values(values, id_format)
+    return values.to_numpy() if id_format is not None else np.asarray(values, dtype=str)
+
+def key_set_contains(key_set, values):
+    """Mặt nạ các giá trị đã có trong tập khóa (tìm nhị phân trên từng dãy)
+    
+    Như Series.duplicated, giá trị thiếu được coi là có trong tập nếu đã gặp khóa thiếu.
+    """
+    missing = values.isna().to_numpy()
+    found = np.zeros(len(values), dtype=bool)
+    found[missing] = key_set['missing']
+    codes = key_set_array(values, key_set['id_format'])
+    present = np.zeros(len(codes), dtype=bool)
+    for run in key_set['runs']:
+        positions = np.minimum(np.searchsorted(run, codes), len(run) - 1)
+        present |= run[positions] == codes
+    found[~missing] = present
+    return found
+
+def key_set_add(key_set, values):
+    """Thêm các khóa chưa có trong tập khóa (sửa trực tiếp trên key_set, trả về key_set)
+    
+    Tập khóa rỗng lấy dạng mã của `values` nếu là khóa thay thế. Nếu có khóa không đổi được
+    theo dạng mã của tập, toàn bộ tập chuyển về dạng chuỗi.
+    """
+    key_set['missing'] |= bool(values.isna().any())
+    if not key_set['runs'] and is_surrogate_key(values):
+        key_set['id_format'] = id_key_formats(values)[values.name]
+    
+    id_format = key_set['id_format']
+    codes = key_set_array(values, id_format)
+    if id_format is not None and (codes < 0).any():
+        runs = [np.asarray(decode_id_keys(run, *id_format), dtype=str) for run in key_set['runs']]
+        key_set['runs'] = [np.sort(np.concatenate(runs))] if runs else []
+        key_set['id_format'] = None
+        codes = key_set_array(values, None)
+    if len(codes) == 0:
+        return key_set
+    
+    runs = key_set['runs']
+    runs.append(np.sort(codes))
+    while len(runs) > 1 and len(runs[-2]) <= 2 * len(runs[-1]):
+        run = runs.pop()
+        runs[-1] = np.sort(np.concatenate([runs[-1], run]), kind='stable')
+    return key_set
+
+def validate_foreign_keys(mr, key_indexes):
+    """Kiểm tra tất cả khóa ngoại của medical_records trên các chỉ mục khóa
+    
+    Trả về (số dòng lỗi theo từng khóa ngoại, mặt nạ kết hợp các dòng có ít nhất
+    một khóa ngoại không hợp lệ).
+    """
+    invalid_counts = {}
+    invalid_mask = np.zeros(len(mr), dtype=bool)
+    
+    for fk_col, table in FOREIGN_KEYS.items():
+        if fk_col not in mr.columns or table not in key_indexes:
+            continue
+        mask = lookup_keys(key_indexes[table], mr[fk_col]) < 0
+        invalid_counts[fk_col] = int(mask.sum())
+        invalid_mask |= mask
+    
+    return invalid_counts, invalid_mask
+
+def check_referential_integrity(data, key_indexes=None, out=None):
+    """Kiểm tra tính toàn vẹn tham chiếu giữa các bảng
     
-    # Kiểm tra patient_id trong medical_records
-    mr = data['medical_records']
-    patients = data['patients']
+    Kết quả gồm số dòng lỗi theo từng khóa ngoại ('invalid_patient_ids', ...) và
+    'invalid_mask': mặt nạ các dòng medical_records cần xóa.
+    """
+    print("\n" + "="*80, file=out)
+    print("KIỂM TRA TÍNH TOÀN VẸN THAM CHIẾU", file=out)
+    print("="*80, file=out)
     
-    invalid_patient_ids = mr[~mr['patient_id'].isin(patients['patient_id'])]
-    if len(invalid_patient_ids) > 0:
-        print(f"\n✗ MEDICAL_RECORDS: {len(invalid_patient_ids)} dòng có patient_id không tồn tại trong PATIENTS")
-        integrity_issues['invalid_patient_ids'] = invalid_patient_ids
-    else:
-        print(f"\n✓ MEDICAL_RECORDS: Tất cả patient_id đều hợp lệ")
-    
-    # Kiểm tra doctor_id trong medical_records
-    doctors = data['doctors']
-    invalid_doctor_ids = mr[~mr['doctor_id'].isin(doctors['doctor_id'])]
-    if len(invalid_doctor_ids) > 0:
-        print(f"✗ MEDICAL_RECORDS: {len(invalid_doctor_ids)} dòng có doctor_id không tồn tại trong DOCTORS")
-        integrity_issues['invalid_doctor_ids'] = invalid_doctor_ids
-    else:
-        print(f"✓ MEDICAL_RECORDS: Tất cả doctor_id đều hợp lệ")
-    
-    # Kiểm tra diagnosis_id trong medical_records
-    diagnoses = data['diagnoses']
-    invalid_diagnosis_ids = mr[~mr['diagnosis_id'].isin(diagnoses['diagnosis_id'])]
-    if len(invalid_diagnosis_ids) > 0:
-        print(f"✗ MEDICAL_RECORDS: {len(invalid_diagnosis_ids)} dòng có diagnosis_id không tồn tại trong DIAGNOSES")
-        integrity_issues['invalid_diagnosis_ids'] = invalid_diagnosis_ids
-    else:
-        print(f"✓ MEDICAL_RECORDS: Tất cả diagnosis_id đều hợp lệ")
-    
-    # Kiểm tra medication_id trong medical_records
-    medications = data['medications']
-    invalid_medication_ids = mr[~mr['medication_id'].isin(medications['medication_id'])]
-    if len(invalid_medication_ids) > 0:
-        print(f"✗ MEDICAL_RECORDS: {len(invalid_medication_ids)} dòng có medication_id không tồn tại trong MEDICATIONS")
-        integrity_issues['invalid_medication_ids'] = invalid_medication_ids
-    else:
-        print(f"✓ MEDICAL_RECORDS: Tất cả medication_id đều hợp lệ")
+    if key_indexes is None:
+        key_indexes = build_key_indexes(data)
+    invalid_counts, invalid_mask = validate_foreign_keys(data['medical_records'], key_indexes)
+    
+    integrity_issues = {}
+    for i, (fk_col, count) in enumerate(invalid_counts.items()):
+        prefix = "\n" if i == 0 else ""
+        if count > 0:
+            print(f"{prefix}✗ MEDICAL_RECORDS: {count} dòng có {fk_col} không tồn tại trong {FOREIGN_KEYS[fk_col].upper()}",
+                  file=out)
+            integrity_issues[f'invalid_{fk_col}s'] = count
+        else:
+            print(f"{prefix}✓ MEDICAL_RECORDS: Tất cả {fk_col} đều hợp lệ", file=out)
+    
+    if integrity_issues:
+        integrity_issues['invalid_mask'] = invalid_mask
     
     return integrity_issues
 
-def fix_referential_integrity(data, integrity_issues):
-    """Xử lý các vấn đề về tính toàn vẹn tham chiếu"""
-    data_clean = data.copy()
-    mr = data_clean['medical_records'].copy()
+def fix_referential_integrity(data, integrity_issues, inplace=False, out=None):
+    """Xử lý các vấn đề về tính toàn vẹn tham chiếu
     
-    # Xóa các dòng có foreign key không hợp lệ
-    if 'invalid_patient_ids' in integrity_issues:
-        invalid_indices = integrity_issues['invalid_patient_ids'].index
-        mr = mr.drop(invalid_indices)
-        print(f"Đã xóa {len(invalid_indices)} dòng có patient_id không hợp lệ")
-    
-    if 'invalid_doctor_ids' in integrity_issues:
-        invalid_indices = integrity_issues['invalid_doctor_ids'].index
-        mr = mr.drop(invalid_indices)
-        print(f"Đã xóa {len(invalid_indices)} dòng có doctor_id không hợp lệ")
+    Xóa tất cả các dòng có khóa ngoại không hợp lệ trong một lần theo mặt nạ kết hợp.
+    """
+    data_clean = data.copy()
+    mr = working_copy(data_clean['medical_records'], inplace)
     
-    if 'invalid_diagnosis_ids' in integrity_issues:
-        invalid_indices = integrity_issues['invalid_diagnosis_ids'].index
-        mr = mr.drop(invalid_indices)
-        print(f"Đã xóa {len(invalid_indices)} dòng có diagnosis_id không hợp lệ")
+    for fk_col in FOREIGN_KEYS:
+        count = integrity_issues.get(f'invalid_{fk_col}s', 0)
+        if count > 0:
+            print(f"Đã xóa {count} dòng có {fk_col} không hợp lệ", file=out)
     
-    if 'invalid_medication_ids' in integrity_issues:
-        invalid_indices = integrity_issues['invalid_medication_ids'].index
-        mr = mr.drop(invalid_indices)
-        print(f"Đã xóa {len(invalid_indices)} dòng có medication_id không hợp lệ")
+    invalid_mask = integrity_issues.get('invalid_mask')
+    if invalid_mask is not None and invalid_mask.any():
+        mr = drop_rows(mr, invalid_mask, inplace=True)
+        print(f"Tổng cộng đã xóa {int(invalid_mask.sum())} dòng", file=out)
     
     data_clean['medical_records'] = mr
     return data_clean
@@ -312,48 +1047,81 @@ def fix_referential_integrity(data, integrity_issues):
 # BƯỚC 6: CHUẨN HÓA ĐỊNH DẠNG DỮ LIỆU
 # ============================================================================
 
-def standardize_dates(data):
-    """Chuẩn hóa định dạng ngày tháng"""
-    data_clean = data.copy()
-    
-    # Bảng PATIENTS
-    if 'ngay_sinh' in data_clean['patients'].columns:
-        data_clean['patients']['ngay_sinh'] = pd.to_datetime(
-            data_clean['patients']['ngay_sinh'], 
-            errors='coerce',
-            format='%Y-%m-%d'
-        )
-    
-    if 'ngay_dang_ky' in data_clean['patients'].columns:
-        data_clean['patients']['ngay_dang_ky'] = pd.to_datetime(
-            data_clean['patients']['ngay_dang_ky'],
-            errors='coerce',
-            format='%Y-%m-%d'
-        )
-    
-    # Bảng DOCTORS
-    if 'ngay_sinh' in data_clean['doctors'].columns:
-        data_clean['doctors']['ngay_sinh'] = pd.to_datetime(
-            data_clean['doctors']['ngay_sinh'],
-            errors='coerce',
-            format='%Y-%m-%d'
-        )
+def parse_iso_dates(values):
+    """Parse các chuỗi ngày (khác nhau) dạng YYYY-MM-DD, trả về (datetime64, năm dạng float)
+    
+    Chuỗi đúng 10 ký tự YYYY-MM-DD được tách năm/tháng/ngày trực tiếp bằng phép tính trên
+    mã ký tự; các chuỗi còn lại (hoặc ngày không tồn tại) đi qua pd.to_datetime như trước.
+    """
+    values = pd.Index(np.asarray(values, dtype=object))
+    dates = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[us]')
+    years = np.full(len(values), np.nan)
+    
+    is_iso = np.asarray(values.map(lambda v: isinstance(v, str) and len(v) == 10), dtype=bool)
+    if is_iso.any():
+        chars = values[is_iso].to_numpy().astype('U10').view(np.uint32).reshape(-1, 10).astype(np.int64)
+        digits = chars - ord('0')
+        digit_pos = [0, 1, 2, 3, 5, 6, 8, 9]
+        well_formed = (((digits[:, digit_pos] >= 0) & (digits[:, digit_pos] <= 9)).all(axis=1)
+                       & (chars[:, 4] == ord('-')) & (chars[:, 7] == ord('-')))
+        y = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+        m = digits[:, 5] * 10 + digits[:, 6]
+        d = digits[:, 8] * 10 + digits[:, 9]
+        well_formed &= (y >= 1) & (m >= 1) & (m <= 12) & (d >= 1) & (d <= 31)
+        y, m, d = np.where(well_formed, y, 1970), np.where(well_formed, m, 1), np.where(well_formed, d, 1)
+        
+        months = (y - 1970) * 12 + (m - 1)
+        parsed = (months.astype('datetime64[M]').astype('datetime64[D]') + (d - 1)).astype('datetime64[us]')
+        # Ngày vượt quá số ngày của tháng (ví dụ 2021-02-30) sẽ tràn sang tháng sau
+        well_formed &= parsed.astype('datetime64[M]').astype(np.int64) == months
+        
+        iso_pos = np.flatnonzero(is_iso)
+        dates[iso_pos[well_formed]] = parsed[well_formed]
+        years[iso_pos[well_formed]] = y[well_formed]
+        is_iso[iso_pos[~well_formed]] = False
+    
+    rest = np.flatnonzero(~is_iso)
+    if len(rest) > 0:
+        fallback = pd.to_datetime(pd.Series(values[rest], dtype=object), errors='coerce', format='%Y-%m-%d')
+        dates[rest] = fallback.to_numpy(dtype='datetime64[us]')
+        years[rest] = fallback.dt.year.to_numpy(dtype='float64')
+    
+    return dates, years
+
+def parse_date_column(series):
+    """Chuyển một cột ngày sang datetime64, mỗi giá trị khác nhau chỉ parse một lần
+    
+    Trả về (cột datetime64, Series năm cùng index) - Series năm giống `.dt.year`
+    (float khi có ngày không hợp lệ) để các bước sau dùng lại mà không tách năm lần nữa.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series, series.dt.year
+    
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    unique_dates, unique_years = parse_iso_dates(uniques)
+    dates = pd.Series(np.append(unique_dates, np.datetime64('NaT'))[codes], index=series.index, name=series.name)
+    years = pd.Series(np.append(unique_years, np.nan)[codes], index=series.index, name=series.name)
+    if not years.isnull().any():
+        years = years.astype('int32')
+    return dates, years
+
+def standardize_dates(data, parsed_years=None):
+    """Chuẩn hóa định dạng ngày tháng
     
-    # Bảng MEDICAL_RECORDS
-    if 'ngay_kham' in data_clean['medical_records'].columns:
-        data_clean['medical_records']['ngay_kham'] = pd.to_datetime(
-            data_clean['medical_records']['ngay_kham'],
-            errors='coerce',
-            format='%Y-%m-%d'
-        )
+    parsed_years: dict nhận năm đã tách của từng cột ngày ({(tên bảng, cột): Series}),
+    dùng lại khi kiểm tra/sửa tuổi (xem birth_years)
+    """
+    data_clean = data.copy()
     
-    # Bảng MEDICATIONS
-    if 'han_su_dung' in data_clean['medications'].columns:
-        data_clean['medications']['han_su_dung'] = pd.to_datetime(
-            data_clean['medications']['han_su_dung'],
-            errors='coerce',
-            format='%Y-%m-%d'
-        )
+    for name, cols in DATE_COLUMNS.items():
+        if name not in data_clean:
+            continue
+        for col in cols:
+            if col in data_clean[name].columns:
+                dates, years = parse_date_column(data_clean[name][col])
+                data_clean[name][col] = dates
+                if parsed_years is not None:
+                    parsed_years[(name, col)] = years
     
     return data_clean
 
@@ -361,65 +1129,74 @@ def standardize_numeric(data):
     """Chuẩn hóa định dạng số"""
     data_clean = data.copy()
     
-    # Bảng PATIENTS
-    if 'tuoi' in data_clean['patients'].columns:
-        data_clean['patients']['tuoi'] = pd.to_numeric(
-            data_clean['patients']['tuoi'],
-            errors='coerce'
-        )
-    
-    # Bảng DOCTORS
-    if 'tuoi' in data_clean['doctors'].columns:
-        data_clean['doctors']['tuoi'] = pd.to_numeric(
-            data_clean['doctors']['tuoi'],
-            errors='coerce'
-        )
-    
-    if 'nam_kinh_nghiem' in data_clean['doctors'].columns:
-        data_clean['doctors']['nam_kinh_nghiem'] = pd.to_numeric(
-            data_clean['doctors']['nam_kinh_nghiem'],
-            errors='coerce'
-        )
-    
-    # Bảng MEDICAL_RECORDS
-    numeric_cols = ['chi_phi_kham', 'chi_phi_thuoc', 'tong_chi_phi', 'so_ngay_dung_thuoc']
-    for col in numeric_cols:
-        if col in data_clean['medical_records'].columns:
-            data_clean['medical_records'][col] = pd.to_numeric(
-                data_clean['medical_records'][col],
+    for name, cols in NUMERIC_COLUMNS.items():
+        if name not in data_clean:
+            continue
+        for col in cols:
+            if col not in data_clean[name].columns:
+                continue
+            if col == 'ty_le_hoi_phuc':
+                # Loại bỏ ký tự % và chuyển sang số
+                data_clean[name][col] = data_clean[name][col].astype(str).str.rstrip('%')
+            data_clean[name][col] = pd.to_numeric(
+                data_clean[name][col],
                 errors='coerce'
             )
     
-    # Bảng MEDICATIONS
-    if 'gia_ban' in data_clean['medications'].columns:
-        data_clean['medications']['gia_ban'] = pd.to_numeric(
-            data_clean['medications']['gia_ban'],
-            errors='coerce'
-        )
-    
-    # Bảng DIAGNOSES
-    if 'ty_le_hoi_phuc' in data_clean['diagnoses'].columns:
-        # Loại bỏ ký tự % và chuyển sang số
-        data_clean['diagnoses']['ty_le_hoi_phuc'] = data_clean['diagnoses']['ty_le_hoi_phuc'].astype(str).str.rstrip('%')
-        data_clean['diagnoses']['ty_le_hoi_phuc'] = pd.to_numeric(
-            data_clean['diagnoses']['ty_le_hoi_phuc'],
-            errors='coerce'
-        )
-    
     return data_clean
 
+def normalize_text(values):
+    """Bỏ khoảng trắng đầu/cuối và thay nhiều khoảng trắng bằng một khoảng trắng"""
+    return values.astype(str).str.strip().str.replace(r'\s+', ' ', regex=True)
+
+def normalize_string_column(series, max_ratio=1.0):
+    """Chuẩn hóa một cột chuỗi trên các giá trị phân biệt rồi ánh xạ ngược lại theo mã
+    
+    Cột được factorize (cột category dùng sẵn codes/categories), normalize_text chỉ
+    chạy trên các giá trị phân biệt (khi NORMALIZE_WHITESPACE bật), sau đó các giá trị
+    trùng nhau sau chuẩn hóa được gộp lại và mã của từng dòng được ánh xạ sang category
+    mới. Giá trị thiếu giữ nguyên.
+    Cột không phải category chỉ được giữ dạng category khi số giá trị phân biệt
+    không vượt quá max_ratio * số dòng, ngược lại trả về với kiểu ban đầu (object/str).
+    """
+    is_categorical = isinstance(series.dtype, pd.CategoricalDtype)
+    if is_categorical:
+        codes = series.cat.codes.to_numpy()
+        uniques = series.cat.categories
+    else:
+        codes, uniques = pd.factorize(series)
+    
+    labels = normalize_text(pd.Index(uniques)) if NORMALIZE_WHITESPACE else pd.Index(uniques)
+    new_codes, categories = pd.factorize(labels)
+    # Thêm -1 vào cuối để mã -1 (giá trị thiếu) ánh xạ về -1
+    remap = np.append(new_codes, -1)
+    normalized = pd.Series(
+        pd.Categorical.from_codes(remap[codes], categories=categories),
+        index=series.index,
+        name=series.name
+    )
+    
+    if not is_categorical and len(uniques) > max_ratio * len(series):
+        return normalized.astype(series.dtype)
+    return normalized
+
 def standardize_strings(data):
-    """Chuẩn hóa định dạng chuỗi"""
+    """Chuẩn hóa định dạng chuỗi
+    
+    Chi phí regex tỷ lệ với số giá trị phân biệt của mỗi cột thay vì số dòng.
+    Cột ít giá trị phân biệt (xem CATEGORY_MAX_RATIO) được giữ ở dạng category.
+    """
     data_clean = data.copy()
     
     for name, df in data_clean.items():
-        # Áp dụng cho tất cả các cột kiểu object (string)
-        string_cols = df.select_dtypes(include=['object']).columns
-        for col in string_cols:
-            if df[col].dtype == 'object':
-                data_clean[name][col] = df[col].astype(str).str.strip()
-                # Thay thế nhiều khoảng trắng bằng một khoảng trắng
-                data_clean[name][col] = data_clean[name][col].str.replace(r'\s+', ' ', regex=True)
+        for col in df.columns:
+            series = df[col]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                data_clean[name][col] = normalize_string_column(series)
+            elif pd.api.types.is_string_dtype(series.dtype):
+                # Cột mã ID luôn giữ kiểu chuỗi
+                max_ratio = -1 if col in ID_COLUMNS else CATEGORY_MAX_RATIO
+                data_clean[name][col] = normalize_string_column(series, max_ratio)
     
     return data_clean
 
@@ -427,58 +1204,41 @@ def standardize_strings(data):
 # BƯỚC 7: KIỂM TRA TÍNH NHẤT QUÁN DỮ LIỆU
 # ============================================================================
 
-def check_data_consistency(data):
-    """Kiểm tra tính nhất quán dữ liệu"""
-    print("\n" + "="*80)
-    print("KIỂM TRA TÍNH NHẤT QUÁN DỮ LIỆU")
-    print("="*80)
+def birth_years(name, df, parsed_years=None):
+    """Năm sinh của từng dòng: dùng lại năm đã tách ở standardize_dates nếu còn khớp các dòng"""
+    years = (parsed_years or {}).get((name, 'ngay_sinh'))
+    if years is None or not years.index.equals(df.index):
+        return df['ngay_sinh'].dt.year
+    return years
+
+def check_data_consistency(data, parsed_years=None, rule_results=None, out=None):
+    """Kiểm tra tính nhất quán dữ liệu theo các luật nhóm 'consistency' trong DATA_RULES
     
-    issues = []
+    parsed_years: năm đã tách ở standardize_dates (nếu có)
+    rule_results: kết quả evaluate_rules đã có; tự đánh giá nếu không có
+    Trả về danh sách (tên luật, các dòng vi phạm); các dòng được lấy theo bitmap vi phạm
+    của kết quả luật, không đánh giá lại điều kiện.
+    """
+    print("\n" + "="*80, file=out)
+    print("KIỂM TRA TÍNH NHẤT QUÁN DỮ LIỆU", file=out)
+    print("="*80, file=out)
     
-    # Kiểm tra tuổi và ngày sinh trong PATIENTS
-    patients = data['patients']
-    if 'ngay_sinh' in patients.columns and 'tuoi' in patients.columns:
-        current_year = datetime.now().year
-        calculated_age = current_year - patients['ngay_sinh'].dt.year
-        age_diff = abs(calculated_age - patients['tuoi'])
-        inconsistent_age = patients[age_diff > 1]  # Cho phép sai lệch 1 năm
-        
-        if len(inconsistent_age) > 0:
-            print(f"\n✗ PATIENTS: {len(inconsistent_age)} dòng có tuổi không khớp với ngày sinh")
-            issues.append(('patients_age', inconsistent_age))
-        else:
-            print(f"\n✓ PATIENTS: Tuổi và ngày sinh nhất quán")
-    
-    # Kiểm tra tuổi và ngày sinh trong DOCTORS
-    doctors = data['doctors']
-    if 'ngay_sinh' in doctors.columns and 'tuoi' in doctors.columns:
-        current_year = datetime.now().year
-        calculated_age = current_year - doctors['ngay_sinh'].dt.year
-        age_diff = abs(calculated_age - doctors['tuoi'])
-        inconsistent_age = doctors[age_diff > 1]
-        
-        if len(inconsistent_age) > 0:
-            print(f"✗ DOCTORS: {len(inconsistent_age)} dòng có tuổi không khớp với ngày sinh")
-            issues.append(('doctors_age', inconsistent_age))
-        else:
-            print(f"✓ DOCTORS: Tuổi và ngày sinh nhất quán")
-    
-    # Kiểm tra tổng chi phí trong MEDICAL_RECORDS
-    mr = data['medical_records']
-    if all(col in mr.columns for col in ['chi_phi_kham', 'chi_phi_thuoc', 'tong_chi_phi']):
-        calculated_total = mr['chi_phi_kham'] + mr['chi_phi_thuoc']
-        total_diff = abs(calculated_total - mr['tong_chi_phi'])
-        inconsistent_total = mr[total_diff > 1000]  # Cho phép sai lệch 1000 VNĐ
-        
-        if len(inconsistent_total) > 0:
-            print(f"✗ MEDICAL_RECORDS: {len(inconsistent_total)} dòng có tổng chi phí không khớp")
-            issues.append(('medical_records_total', inconsistent_total))
+    if rule_results is None:
+        rule_results = evaluate_rules(data, groups=['consistency'], parsed_years=parsed_years)
+    
+    issues = []
+    for i, (name, rule_name, result) in enumerate(iter_rule_results(rule_results, group='consistency')):
+        prefix = "\n" if i == 0 else ""
+        if result['violations'] > 0:
+            print(f"{prefix}✗ {name.upper()}: {result['violations']} dòng có {result['description']}", file=out)
+            df = data[name]
+            issues.append((rule_name, df[violation_mask(result, len(df))]))
         else:
-            print(f"✓ MEDICAL_RECORDS: Tổng chi phí nhất quán")
+            print(f"{prefix}✓ {name.upper()}: Không có dòng nào có {result['description']}", file=out)
     
     return issues
 
-def fix_consistency(data, consistency_issues):
+def fix_consistency(data, consistency_issues, parsed_years=None, out=None):
     """Sửa các vấn đề về tính nhất quán"""
     data_clean = data.copy()
     
@@ -487,18 +1247,18 @@ def fix_consistency(data, consistency_issues):
         patients = data_clean['patients']
         if 'ngay_sinh' in patients.columns and 'tuoi' in patients.columns:
             current_year = datetime.now().year
-            calculated_age = current_year - patients['ngay_sinh'].dt.year
+            calculated_age = current_year - birth_years('patients', patients, parsed_years)
             data_clean['patients']['tuoi'] = calculated_age
-            print("Đã cập nhật tuổi trong PATIENTS dựa trên ngày sinh")
+            print("Đã cập nhật tuổi trong PATIENTS dựa trên ngày sinh", file=out)
     
     # Sửa tuổi trong DOCTORS
     if 'doctors_age' in [issue[0] for issue in consistency_issues]:
         doctors = data_clean['doctors']
         if 'ngay_sinh' in doctors.columns and 'tuoi' in doctors.columns:
             current_year = datetime.now().year
-            calculated_age = current_year - doctors['ngay_sinh'].dt.year
+            calculated_age = current_year - birth_years('doctors', doctors, parsed_years)
             data_clean['doctors']['tuoi'] = calculated_age
-            print("Đã cập nhật tuổi trong DOCTORS dựa trên ngày sinh")
+            print("Đã cập nhật tuổi trong DOCTORS dựa trên ngày sinh", file=out)
     
     # Sửa tổng chi phí trong MEDICAL_RECORDS
     if 'medical_records_total' in [issue[0] for issue in consistency_issues]:
@@ -507,7 +1267,7 @@ def fix_consistency(data, consistency_issues):
             data_clean['medical_records']['tong_chi_phi'] = (
                 mr['chi_phi_kham'] + mr['chi_phi_thuoc']
             )
-            print("Đã cập nhật tổng chi phí trong MEDICAL_RECORDS")
+            print("Đã cập nhật tổng chi phí trong MEDICAL_RECORDS", file=out)
     
     return data_clean
 
@@ -515,50 +1275,169 @@ def fix_consistency(data, consistency_issues):
 # BƯỚC 8: PHÁT HIỆN OUTLIERS
 # ============================================================================
 
-def detect_outliers(data):
-    """Phát hiện dữ liệu ngoại lai"""
-    print("\n" + "="*80)
-    print("PHÁT HIỆN DỮ LIỆU NGOẠI LAI")
-    print("="*80)
+def new_quantile_sketch(epsilon=OUTLIER_SKETCH_EPSILON, seed=0):
+    """Tạo quantile sketch rỗng (KLL) có thể cập nhật theo chunk và gộp giữa các worker
+    
+    Dùng cho medical_records ở chế độ streaming và song song theo shard, khi không có
+    toàn bộ cột trong một tiến trình; bảng nằm trong bộ nhớ dùng quantile chính xác.
+    Sketch gồm nhiều tầng; mỗi phần tử ở tầng h đại diện cho 2^h giá trị. Tầng cao nhất
+    chứa tối đa `k` phần tử, mỗi tầng thấp hơn chứa 2/3 của tầng trên (tối thiểu 2, xem
+    level_capacity); tầng vượt sức chứa được sắp xếp và giữ lại một nửa (xen kẽ, điểm bắt
+    đầu ngẫu nhiên) đẩy lên tầng trên. Khi đó sketch giữ O(k) phần tử và sai số hạng
+    (tính theo tỉ lệ số giá trị) không quá `epsilon` với xác suất 99%, với k chọn theo công
+    thức thực nghiệm của KLL: epsilon = 2.296 / k^0.9723.
+    epsilon = 0 hoặc None thì không bao giờ nén (tính chính xác).
+    """
+    k = int(np.ceil((2.296 / epsilon) ** (1 / 0.9723))) if epsilon else None
+    return {'k': k, 'n': 0, 'levels': [np.empty(0)], 'rng': np.random.default_rng(seed)}
+
+def level_capacity(k, h, n_levels):
+    """Sức chứa của tầng h trong sketch có n_levels tầng: k * (2/3)^(số tầng phía trên), tối thiểu 2"""
+    return max(2, int(np.ceil(k * (2 / 3) ** (n_levels - 1 - h))))
+
+def compact_sketch(sketch):
+    """Nén các tầng vượt quá sức chứa (level_capacity) lên tầng trên, từ tầng thấp nhất
+    
+    Thêm tầng mới làm giảm sức chứa của các tầng dưới nên việc kiểm tra được lặp lại
+    cho đến khi mọi tầng nằm trong sức chứa.
+    """
+    k = sketch['k']
+    if k is None:
+        return sketch
+    
+    levels = sketch['levels']
+    h = 0
+    while h < len(levels):
+        if len(levels[h]) <= level_capacity(k, h, len(levels)):
+            h += 1
+            continue
+        items = np.sort(levels[h])
+        # Số phần tử lẻ: giữ lại phần tử lớn nhất ở tầng hiện tại
+        keep = items[-1:] if len(items) % 2 else items[:0]
+        items = items[:len(items) - len(keep)]
+        promoted = items[sketch['rng'].integers(2)::2]
+        levels[h] = keep
+        grown = h + 1 == len(levels)
+        if grown:
+            levels.append(np.empty(0))
+        levels[h + 1] = np.concatenate([levels[h + 1], promoted])
+        h = 0 if grown else h + 1
+    return sketch
+
+def sketch_update(sketch, values):
+    """Thêm một loạt giá trị (Series/ndarray) vào sketch, bỏ qua giá trị thiếu"""
+    values = pd.to_numeric(pd.Series(values), errors='coerce').dropna().to_numpy(dtype='float64')
+    if len(values) == 0:
+        return sketch
+    sketch['levels'][0] = np.concatenate([sketch['levels'][0], values])
+    sketch['n'] += len(values)
+    return compact_sketch(sketch)
+
+def sketch_merge(sketch, other):
+    """Gộp sketch `other` vào `sketch` (ví dụ sketch của các chunk hoặc các worker khác nhau)"""
+    for h, items in enumerate(other['levels']):
+        if h == len(sketch['levels']):
+            sketch['levels'].append(np.empty(0))
+        sketch['levels'][h] = np.concatenate([sketch['levels'][h], items])
+    sketch['n'] += other['n']
+    if sketch['k'] is None or (other['k'] is not None and other['k'] < sketch['k']):
+        sketch['k'] = other['k']
+    return compact_sketch(sketch)
+
+def sketch_items(sketch):
+    """Các giá trị đã sắp xếp và tổng trọng số tích lũy của sketch"""
+    values = np.concatenate(sketch['levels'])
+    weights = np.concatenate([np.full(len(items), 2**h, dtype='int64') for h, items in enumerate(sketch['levels'])])
+    order = np.argsort(values, kind='stable')
+    return values[order], np.cumsum(weights[order])
+
+def sketch_quantiles(sketch, qs):
+    """Ước lượng các quantile `qs` (nội suy tuyến tính như Series.quantile, chính xác khi chưa nén)"""
+    if sketch['n'] == 0:
+        return [np.nan for _ in qs]
+    
+    values, cum_weights = sketch_items(sketch)
+    result = []
+    for q in qs:
+        rank = q * (sketch['n'] - 1)
+        lo, hi = int(np.floor(rank)), int(np.ceil(rank))
+        v_lo = values[np.searchsorted(cum_weights, lo, side='right')]
+        v_hi = values[np.searchsorted(cum_weights, hi, side='right')]
+        result.append(v_lo + (v_hi - v_lo) * (rank - lo))
+    return result
+
+def sketch_count_outside(sketch, lower_bound, upper_bound):
+    """Ước lượng số giá trị nằm ngoài [lower_bound, upper_bound]"""
+    if sketch['n'] == 0:
+        return 0
+    values, cum_weights = sketch_items(sketch)
+    below = np.searchsorted(values, lower_bound, side='left')
+    above = np.searchsorted(values, upper_bound, side='right')
+    n_below = int(cum_weights[below - 1]) if below > 0 else 0
+    n_upto = int(cum_weights[above - 1]) if above > 0 else 0
+    return n_below + sketch['n'] - n_upto
+
+def iqr_bounds(sketch):
+    """Ngưỡng ngoại lai Q1 - 1.5*IQR và Q3 + 1.5*IQR từ sketch"""
+    Q1, Q3 = sketch_quantiles(sketch, [0.25, 0.75])
+    IQR = Q3 - Q1
+    return Q1 - 1.5 * IQR, Q3 + 1.5 * IQR
+
+def exact_iqr_bounds(series):
+    """Ngưỡng ngoại lai Q1 - 1.5*IQR và Q3 + 1.5*IQR từ quantile chính xác của cột (Series.quantile)"""
+    Q1, Q3 = series.quantile([0.25, 0.75])
+    IQR = Q3 - Q1
+    return Q1 - 1.5 * IQR, Q3 + 1.5 * IQR
+
+def detect_outliers(data, sketches=None, rule_results=None, out=None):
+    """Phát hiện dữ liệu ngoại lai
+    
+    Ngưỡng IQR của mỗi cột trong OUTLIER_COLUMNS (luật 'iqr' trong DATA_RULES) lấy từ
+    quantile chính xác của bảng trong `data`, hoặc từ sketch có sẵn qua `sketches`
+    ({tên bảng: {cột: sketch}}), ví dụ sketch medical_records gộp từ các chunk ở chế độ
+    streaming/các shard.
+    Trả về {khóa: các dòng ngoại lai}, các dòng được lấy theo bitmap vi phạm của luật. Bảng
+    không có trong `data` (chỉ có sketch) không có dòng để trả về: số giá trị ngoại lai được
+    ước lượng từ sketch và chỉ được in ra.
+    """
+    print("\n" + "="*80, file=out)
+    print("PHÁT HIỆN DỮ LIỆU NGOẠI LAI", file=out)
+    print("="*80, file=out)
     
     outliers_report = {}
-    
-    # Kiểm tra tuổi trong PATIENTS
-    patients = data['patients']
-    if 'tuoi' in patients.columns:
-        Q1 = patients['tuoi'].quantile(0.25)
-        Q3 = patients['tuoi'].quantile(0.75)
-        IQR = Q3 - Q1
-        lower_bound = Q1 - 1.5 * IQR
-        upper_bound = Q3 + 1.5 * IQR
-        
-        outliers = patients[(patients['tuoi'] < lower_bound) | (patients['tuoi'] > upper_bound)]
-        if len(outliers) > 0:
-            print(f"\nPATIENTS - Tuổi: {len(outliers)} giá trị ngoại lai")
-            print(f"  Phạm vi bình thường: {lower_bound:.1f} - {upper_bound:.1f}")
-            outliers_report['patients_age'] = outliers
-        else:
-            print(f"\nPATIENTS - Tuổi: Không có giá trị ngoại lai ✓")
-    
-    # Kiểm tra chi phí trong MEDICAL_RECORDS
-    mr = data['medical_records']
-    cost_cols = ['chi_phi_kham', 'chi_phi_thuoc', 'tong_chi_phi']
-    
-    for col in cost_cols:
-        if col in mr.columns:
-            Q1 = mr[col].quantile(0.25)
-            Q3 = mr[col].quantile(0.75)
-            IQR = Q3 - Q1
-            lower_bound = Q1 - 1.5 * IQR
-            upper_bound = Q3 + 1.5 * IQR
+    sketches = sketches or {}
+    if rule_results is None:
+        rule_results = evaluate_rules(data, groups=['outlier'], sketches=sketches)
+    
+    for name, columns in OUTLIER_COLUMNS.items():
+        table_rules = rule_results.get(name, {}).get('rules', {})
+        for col in columns:
+            result = table_rules.get(f'{col}_outlier')
+            outliers = None
+            if result is not None and name in data:
+                lower_bound, upper_bound = result['bounds']
+                n_outliers = result['violations']
+                outliers = data[name][violation_mask(result, len(data[name]))]
+            elif col in sketches.get(name, {}):
+                lower_bound, upper_bound = iqr_bounds(sketches[name][col])
+                n_outliers = sketch_count_outside(sketches[name][col], lower_bound, upper_bound)
+            else:
+                continue
+            
+            if name == 'patients':
+                label, key = 'PATIENTS - Tuổi', 'patients_age'
+                bounds = f"{lower_bound:.1f} - {upper_bound:.1f}"
+            else:
+                label, key = f"MEDICAL_RECORDS - {col}", f'mr_{col}'
+                bounds = f"{lower_bound:,.0f} - {upper_bound:,.0f} VNĐ"
             
-            outliers = mr[(mr[col] < lower_bound) | (mr[col] > upper_bound)]
-            if len(outliers) > 0:
-                print(f"\nMEDICAL_RECORDS - {col}: {len(outliers)} giá trị ngoại lai")
-                print(f"  Phạm vi bình thường: {lower_bound:,.0f} - {upper_bound:,.0f} VNĐ")
-                outliers_report[f'mr_{col}'] = outliers
+            if n_outliers > 0:
+                print(f"\n{label}: {n_outliers} giá trị ngoại lai", file=out)
+                print(f"  Phạm vi bình thường: {bounds}", file=out)
+                if outliers is not None:
+                    outliers_report[key] = outliers
             else:
-                print(f"\nMEDICAL_RECORDS - {col}: Không có giá trị ngoại lai ✓")
+                print(f"\n{label}: Không có giá trị ngoại lai ✓", file=out)
     
     return outliers_report
 
@@ -566,192 +1445,2363 @@ def detect_outliers(data):
 # BƯỚC 9: KIỂM TRA ĐỊNH DẠNG
 # ============================================================================
 
-def validate_emails(data):
-    """Kiểm tra định dạng email"""
-    print("\n" + "="*80)
-    print("KIỂM TRA ĐỊNH DẠNG EMAIL")
-    print("="*80)
-    
-    email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    
-    # Kiểm tra email trong PATIENTS
-    patients = data['patients']
-    if 'email' in patients.columns:
-        invalid_emails = patients[~patients['email'].str.match(email_pattern, na=False)]
-        if len(invalid_emails) > 0:
-            print(f"\nPATIENTS: {len(invalid_emails)} email không hợp lệ")
-        else:
-            print(f"\nPATIENTS: Tất cả email đều hợp lệ ✓")
-    
-    # Kiểm tra email trong DOCTORS
-    doctors = data['doctors']
-    if 'email' in doctors.columns:
-        invalid_emails = doctors[~doctors['email'].str.match(email_pattern, na=False)]
-        if len(invalid_emails) > 0:
-            print(f"DOCTORS: {len(invalid_emails)} email không hợp lệ")
-        else:
-            print(f"DOCTORS: Tất cả email đều hợp lệ ✓")
+# Số điện thoại Việt Nam: 10 số, bắt đầu bằng 0. Khi cột được đọc thành số nguyên thì
+# số 0 đầu bị mất, nên số hợp lệ là số nguyên có đúng 9 chữ số.
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+PHONE_PATTERN = re.compile(r'^0\d{9}$')
+PHONE_NUMERIC_RANGE = (10**8, 10**9)
 
-def validate_phone_numbers(data):
-    """Kiểm tra định dạng số điện thoại Việt Nam"""
-    print("\n" + "="*80)
-    print("KIỂM TRA ĐỊNH DẠNG SỐ ĐIỆN THOẠI")
-    print("="*80)
-    
-    # Số điện thoại Việt Nam: 10 số, bắt đầu bằng 0
-    phone_pattern = r'^0\d{9}$'
-    
-    # Kiểm tra trong PATIENTS
-    patients = data['patients']
-    if 'so_dien_thoai' in patients.columns:
-        phone_str = patients['so_dien_thoai'].astype(str)
-        invalid_phones = patients[~phone_str.str.match(phone_pattern, na=False)]
-        if len(invalid_phones) > 0:
-            print(f"\nPATIENTS: {len(invalid_phones)} số điện thoại không hợp lệ")
+def pattern_validity(values, pattern):
+    """Mảng bool: từng giá trị (khác nhau) có phải chuỗi khớp `pattern` không"""
+    return np.array([isinstance(v, str) and pattern.match(v) is not None for v in values], dtype=bool)
+
+def email_validity(values):
+    """Mảng bool: từng giá trị (khác nhau) có phải email hợp lệ không"""
+    return pattern_validity(values, EMAIL_PATTERN)
+
+def phone_validity(values):
+    """Mảng bool: từng giá trị (khác nhau) có phải số điện thoại hợp lệ không
+    
+    Giá trị số được kiểm tra bằng số học (số nguyên trong PHONE_NUMERIC_RANGE),
+    không chuyển sang chuỗi.
+    """
+    values = pd.Index(values)
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        numbers = values.to_numpy(dtype='float64', na_value=np.nan)
+        low, high = PHONE_NUMERIC_RANGE
+        return (numbers >= low) & (numbers < high) & (np.floor(numbers) == numbers)
+    return pattern_validity(values, PHONE_PATTERN)
+
+def contact_results(data, rule_results, col):
+    """Kết quả kiểm tra định dạng cột `col` theo từng bảng từ kết quả luật nhóm 'format'
+    
+    Trả về {tên bảng: số dòng đã kiểm tra, số dòng không hợp lệ và khóa của các dòng đó}.
+    """
+    results = {}
+    for name, rule_name, result in iter_rule_results(rule_results, group='format'):
+        if result['column'] != col:
+            continue
+        df = data[name]
+        invalid_mask = violation_mask(result, len(df))
+        key_col = KEY_COLUMNS.get(name)
+        keys = df[key_col] if key_col in df.columns else df.index.to_series()
+        results[name] = {
+            'checked': len(df),
+            'invalid': result['violations'],
+            'invalid_keys': decode_id_column(keys[invalid_mask]).tolist()
+        }
+    return results
+
+def print_contact_results(results, label, out=None):
+    """In kết quả kiểm tra định dạng theo từng bảng"""
+    for i, (name, result) in enumerate(results.items()):
+        prefix = "\n" if i == 0 else ""
+        if result['invalid'] > 0:
+            print(f"{prefix}{name.upper()}: {result['invalid']} {label} không hợp lệ", file=out)
         else:
-            print(f"\nPATIENTS: Tất cả số điện thoại đều hợp lệ ✓")
-    
-    # Kiểm tra trong DOCTORS
-    doctors = data['doctors']
-    if 'so_dien_thoai' in doctors.columns:
-        phone_str = doctors['so_dien_thoai'].astype(str)
-        invalid_phones = doctors[~phone_str.str.match(phone_pattern, na=False)]
-        if len(invalid_phones) > 0:
-            print(f"DOCTORS: {len(invalid_phones)} số điện thoại không hợp lệ")
+            print(f"{prefix}{name.upper()}: Tất cả {label} đều hợp lệ ✓", file=out)
+
+def validate_emails(data, rule_results=None, out=None):
+    """Kiểm tra định dạng email (rule_results: kết quả evaluate_rules đã có, nếu có)"""
+    print("\n" + "="*80, file=out)
+    print("KIỂM TRA ĐỊNH DẠNG EMAIL", file=out)
+    print("="*80, file=out)
+    
+    if rule_results is None:
+        rule_results = evaluate_rules(data, groups=['format'], columns=['email'])
+    results = contact_results(data, rule_results, 'email')
+    print_contact_results(results, 'email', out=out)
+    return results
+
+def validate_phone_numbers(data, rule_results=None, out=None):
+    """Kiểm tra định dạng số điện thoại Việt Nam (rule_results: kết quả evaluate_rules đã có, nếu có)"""
+    print("\n" + "="*80, file=out)
+    print("KIỂM TRA ĐỊNH DẠNG SỐ ĐIỆN THOẠI", file=out)
+    print("="*80, file=out)
+    
+    if rule_results is None:
+        rule_results = evaluate_rules(data, groups=['format'], columns=['so_dien_thoai'])
+    results = contact_results(data, rule_results, 'so_dien_thoai')
+    print_contact_results(results, 'số điện thoại', out=out)
+    return results
+
+# ============================================================================
+# LUẬT KIỂM TRA DỮ LIỆU (KHAI BÁO THEO BẢNG)
+# ============================================================================
+
+# Mỗi luật là một dict: 'name' (duy nhất trong bảng), 'group' (consistency, format, outlier,
+# range, integrity, uniqueness), 'type', 'column', 'description' và tham số theo loại:
+# - 'range': 'min' và/hoặc 'max'
+# - 'sum': |tổng các cột 'terms' - column| > 'tolerance' là vi phạm
+# - 'age': |năm hiện tại - năm của cột 'birth_date' - column| > 'tolerance' là vi phạm
+# - 'regex': giá trị không khớp 'pattern'; 'format': 'validity' trả về False (thiếu là vi phạm)
+# - 'foreign_key': giá trị không có trong khóa của bảng 'table'
+# - 'unique': giá trị trùng với một dòng trước đó
+# - 'iqr': giá trị nằm ngoài [Q1 - 1.5 IQR, Q3 + 1.5 IQR] (từ quantile sketch)
+# Với luật so sánh số, giá trị thiếu không tính là vi phạm.
+DATA_RULES = {
+    'patients': [
+        {'name': 'patients_age', 'group': 'consistency', 'type': 'age', 'column': 'tuoi',
+         'birth_date': 'ngay_sinh', 'tolerance': 1, 'description': 'tuổi không khớp với ngày sinh'},
+        {'name': 'tuoi_range', 'group': 'range', 'type': 'range', 'column': 'tuoi', 'min': 0, 'max': 120,
+         'description': 'tuổi ngoài khoảng 0-120'},
+        {'name': 'email_format', 'group': 'format', 'type': 'regex', 'column': 'email', 'pattern': EMAIL_PATTERN,
+         'description': 'email không hợp lệ'},
+        {'name': 'phone_format', 'group': 'format', 'type': 'format', 'column': 'so_dien_thoai',
+         'validity': phone_validity, 'description': 'số điện thoại không hợp lệ'},
+        {'name': 'patient_id_unique', 'group': 'uniqueness', 'type': 'unique', 'column': 'patient_id',
+         'description': 'patient_id trùng lặp'}
+    ],
+    'doctors': [
+        {'name': 'doctors_age', 'group': 'consistency', 'type': 'age', 'column': 'tuoi',
+         'birth_date': 'ngay_sinh', 'tolerance': 1, 'description': 'tuổi không khớp với ngày sinh'},
+        {'name': 'nam_kinh_nghiem_range', 'group': 'range', 'type': 'range', 'column': 'nam_kinh_nghiem', 'min': 0,
+         'description': 'số năm kinh nghiệm âm'},
+        {'name': 'email_format', 'group': 'format', 'type': 'regex', 'column': 'email', 'pattern': EMAIL_PATTERN,
+         'description': 'email không hợp lệ'},
+        {'name': 'phone_format', 'group': 'format', 'type': 'format', 'column': 'so_dien_thoai',
+         'validity': phone_validity, 'description': 'số điện thoại không hợp lệ'},
+        {'name': 'doctor_id_unique', 'group': 'uniqueness', 'type': 'unique', 'column': 'doctor_id',
+         'description': 'doctor_id trùng lặp'}
+    ],
+    'medical_records': [
+        {'name': 'medical_records_total', 'group': 'consistency', 'type': 'sum', 'column': 'tong_chi_phi',
+         'terms': ['chi_phi_kham', 'chi_phi_thuoc'], 'tolerance': 1000, 'description': 'tổng chi phí không khớp'},
+        *[{'name': f'{col}_range', 'group': 'range', 'type': 'range', 'column': col, 'min': 0,
+           'description': f'{col} âm'}
+          for col in ['chi_phi_kham', 'chi_phi_thuoc', 'tong_chi_phi', 'so_ngay_dung_thuoc']],
+        *[{'name': f'{fk_col}_exists', 'group': 'integrity', 'type': 'foreign_key', 'column': fk_col,
+           'table': table, 'description': f'{fk_col} không tồn tại trong {table.upper()}'}
+          for fk_col, table in FOREIGN_KEYS.items()],
+        {'name': 'record_id_unique', 'group': 'uniqueness', 'type': 'unique', 'column': 'record_id',
+         'description': 'record_id trùng lặp'}
+    ],
+    'medications': [
+        {'name': 'gia_ban_range', 'group': 'range', 'type': 'range', 'column': 'gia_ban', 'min': 0,
+         'description': 'giá bán âm'},
+        {'name': 'medication_id_unique', 'group': 'uniqueness', 'type': 'unique', 'column': 'medication_id',
+         'description': 'medication_id trùng lặp'}
+    ],
+    'diagnoses': [
+        {'name': 'ty_le_hoi_phuc_range', 'group': 'range', 'type': 'range', 'column': 'ty_le_hoi_phuc',
+         'min': 0, 'max': 100, 'description': 'tỷ lệ hồi phục ngoài khoảng 0-100'},
+        {'name': 'diagnosis_id_unique', 'group': 'uniqueness', 'type': 'unique', 'column': 'diagnosis_id',
+         'description': 'diagnosis_id trùng lặp'}
+    ]
+}
+
+# Luật ngoại lai IQR cho các cột trong OUTLIER_COLUMNS
+for _name, _columns in OUTLIER_COLUMNS.items():
+    DATA_RULES[_name] += [
+        {'name': f'{col}_outlier', 'group': 'outlier', 'type': 'iqr', 'column': col,
+         'description': f'{col} ngoại lai'}
+        for col in _columns
+    ]
+
+def rule_numeric(context, col):
+    """Cột dạng float64 (thiếu là NaN), chuyển một lần và dùng chung cho mọi luật của bảng"""
+    cache = context['numeric']
+    if col not in cache:
+        cache[col] = context['df'][col].to_numpy(dtype='float64', na_value=np.nan)
+    return cache[col]
+
+def rule_factorized(context, col):
+    """(mã, giá trị phân biệt) của một cột, factorize một lần cho mọi luật định dạng của bảng"""
+    cache = context['factorized']
+    if col not in cache:
+        cache[col] = pd.factorize(context['df'][col], use_na_sentinel=True)
+    return cache[col]
+
+def evaluate_range_rule(context, rule):
+    values = rule_numeric(context, rule['column'])
+    mask = np.zeros(len(values), dtype=bool)
+    if 'min' in rule:
+        mask |= values < rule['min']
+    if 'max' in rule:
+        mask |= values > rule['max']
+    return mask, {}
+
+def evaluate_sum_rule(context, rule):
+    total = sum(rule_numeric(context, col) for col in rule['terms'])
+    return np.abs(total - rule_numeric(context, rule['column'])) > rule['tolerance'], {}
+
+def evaluate_age_rule(context, rule):
+    years = birth_years(context['name'], context['df'], context['parsed_years'])
+    years = pd.Series(years).to_numpy(dtype='float64', na_value=np.nan)
+    calculated_age = datetime.now().year - years
+    return np.abs(calculated_age - rule_numeric(context, rule['column'])) > rule['tolerance'], {}
+
+def evaluate_format_rule(context, rule):
+    codes, uniques = rule_factorized(context, rule['column'])
+    if rule['type'] == 'regex':
+        valid = pattern_validity(uniques, rule['pattern'])
+    else:
+        valid = np.asarray(rule['validity'](uniques), dtype=bool)
+    # Giá trị thiếu (code -1) luôn không hợp lệ
+    return ~np.append(valid, False)[codes], {}
+
+def evaluate_foreign_key_rule(context, rule):
+    table = rule['table']
+    if table not in context['key_indexes']:
+        context['key_indexes'][table] = build_key_index(context['data'][table], KEY_COLUMNS[table])
+    return lookup_keys(context['key_indexes'][table], context['df'][rule['column']]) < 0, {}
+
+def evaluate_unique_rule(context, rule):
+    return context['df'][rule['column']].duplicated(keep='first').to_numpy(), {}
+
+def evaluate_iqr_rule(context, rule):
+    col = rule['column']
+    sketch = context['sketches'].get(col)
+    if sketch is None:
+        lower_bound, upper_bound = exact_iqr_bounds(context['df'][col])
+    else:
+        lower_bound, upper_bound = iqr_bounds(sketch)
+    values = rule_numeric(context, col)
+    return (values < lower_bound) | (values > upper_bound), {'bounds': [float(lower_bound), float(upper_bound)]}
+
+RULE_EVALUATORS = {
+    'range': evaluate_range_rule,
+    'sum': evaluate_sum_rule,
+    'age': evaluate_age_rule,
+    'regex': evaluate_format_rule,
+    'format': evaluate_format_rule,
+    'foreign_key': evaluate_foreign_key_rule,
+    'unique': evaluate_unique_rule,
+    'iqr': evaluate_iqr_rule
+}
+
+def rule_columns(rule):
+    """Các cột mà luật cần có trong bảng"""
+    return [rule['column']] + rule.get('terms', []) + ([rule['birth_date']] if 'birth_date' in rule else [])
+
+def compile_rules(rules, df_columns, data, groups=None, columns=None):
+    """Chọn các luật áp dụng được cho bảng và gắn hàm đánh giá, trả về [(luật, hàm)]
+    
+    Luật bị bỏ qua khi không thuộc `groups`/`columns`, bảng thiếu cột cần thiết hoặc
+    (với khóa ngoại) bảng được tham chiếu không có trong `data`.
+    """
+    compiled = []
+    for rule in rules:
+        if rule['type'] not in RULE_EVALUATORS:
+            raise ValueError(f"Loại luật không hỗ trợ: {rule['type']} (luật {rule['name']})")
+        if groups is not None and rule['group'] not in groups:
+            continue
+        if columns is not None and rule['column'] not in columns:
+            continue
+        if not all(col in df_columns for col in rule_columns(rule)):
+            continue
+        if rule['type'] == 'foreign_key' and rule['table'] not in data:
+            continue
+        compiled.append((rule, RULE_EVALUATORS[rule['type']]))
+    return compiled
+
+def evaluate_table_rules(name, df, compiled, data, parsed_years=None, sketches=None):
+    """Đánh giá các luật đã biên dịch của một bảng trong một lượt
+    
+    Các cột được chuyển sang số/factorize một lần và dùng chung giữa các luật. Mỗi luật
+    trả về số dòng vi phạm và bitmap vi phạm (np.packbits, 1 bit mỗi dòng, xem violation_mask)
+    thay vì bản sao các dòng vi phạm.
+    """
+    context = {
+        'name': name, 'df': df, 'data': data, 'parsed_years': parsed_years,
+        'sketches': sketches or {},
+        'numeric': {}, 'factorized': {}, 'key_indexes': {}
+    }
+    results = {}
+    for rule, evaluate in compiled:
+        mask, details = evaluate(context, rule)
+        results[rule['name']] = {
+            'type': rule['type'],
+            'group': rule['group'],
+            'column': rule['column'],
+            'description': rule['description'],
+            'violations': int(mask.sum()),
+            'bitmap': np.packbits(mask),
+            **details
+        }
+    return {'rows': len(df), 'rules': results}
+
+def evaluate_rules(data, groups=None, columns=None, rules=DATA_RULES, parsed_years=None, sketches=None):
+    """Đánh giá các luật trong `rules` (lọc theo nhóm/cột) trên mọi bảng có trong `data`
+    
+    sketches: {tên bảng: {cột: quantile sketch}} dùng cho luật 'iqr' thay vì quantile chính xác.
+    Trả về {tên bảng: {'rows': số dòng, 'rules': {tên luật: kết quả}}}.
+    """
+    rule_results = {}
+    for name, table_rules in rules.items():
+        df = data.get(name)
+        if df is None:
+            continue
+        compiled = compile_rules(table_rules, df.columns, data, groups, columns)
+        if compiled:
+            rule_results[name] = evaluate_table_rules(name, df, compiled, data, parsed_years,
+                                                      (sketches or {}).get(name))
+    return rule_results
+
+def iter_rule_results(rule_results, group=None):
+    """Duyệt (tên bảng, tên luật, kết quả) theo thứ tự khai báo, lọc theo nhóm nếu có"""
+    for name, table_results in rule_results.items():
+        for rule_name, result in table_results['rules'].items():
+            if group is None or result['group'] == group:
+                yield name, rule_name, result
+
+def merge_rule_results(rule_results, other):
+    """Gộp kết quả luật `other` vào `rule_results` (cùng bảng thì gộp theo luật)"""
+    for name, table_results in other.items():
+        if name in rule_results and rule_results[name]['rows'] == table_results['rows']:
+            rule_results[name]['rules'].update(table_results['rules'])
         else:
-            print(f"DOCTORS: Tất cả số điện thoại đều hợp lệ ✓")
+            rule_results[name] = table_results
+    return rule_results
+
+def violation_mask(result, n_rows):
+    """Mặt nạ bool các dòng vi phạm từ bitmap của một luật"""
+    return np.unpackbits(result['bitmap'], count=n_rows).astype(bool)
+
+def rule_summary(rule_results):
+    """Số dòng vi phạm theo bảng và luật (dùng cho báo cáo JSON)"""
+    return {
+        name: {rule_name: result['violations'] for rule_name, result in table_results['rules'].items()}
+        for name, table_results in rule_results.items()
+    }
 
 # ============================================================================
 # BƯỚC 10: TẠO BÁO CÁO
 # ============================================================================
 
-def generate_summary_report(data, missing_report, duplicate_report, integrity_issues, consistency_issues, outliers_report):
-    """Tạo báo cáo tổng hợp về chất lượng dữ liệu"""
-    
-    print("\n" + "="*80)
-    print("BÁO CÁO TỔNG HỢP CHẤT LƯỢNG DỮ LIỆU")
-    print("="*80)
+def generate_summary_report(data, missing_report, duplicate_report, integrity_issues, consistency_issues, outliers_report,
+                            table_reports=None, memory_log=None, profiles=None, rule_results=None,
+                            out=None):
+    """Tạo báo cáo tổng hợp về chất lượng dữ liệu
+    
+    profiles: profile đã tính của các bảng trong `data`; tự tính (một lần mỗi bảng) nếu không có
+    table_reports: báo cáo đã tính sẵn cho các bảng không nằm trong `data`
+    (ví dụ medical_records ở chế độ streaming)
+    memory_log: nhật ký bộ nhớ theo từng bước (xem record_memory)
+    rule_results: kết quả evaluate_rules; số dòng vi phạm từng luật được ghi vào report['rules']
+    """
+    
+    print("\n" + "="*80, file=out)
+    print("BÁO CÁO TỔNG HỢP CHẤT LƯỢNG DỮ LIỆU", file=out)
+    print("="*80, file=out)
     
     report = {
         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'tables': {}
     }
     
+    if profiles is None:
+        profiles = profile_tables(data)
+    
     for name, df in data.items():
+        table_profile = profiles[name]
+        missing_count = missing_counts(table_profile)
         table_report = {
             'total_rows': len(df),
             'total_columns': len(df.columns),
-            'missing_values': int(df.isnull().sum().sum()),
-            'duplicate_rows': int(df.duplicated().sum())
+            'missing_values': int(missing_count.sum()),
+            'duplicate_rows': table_profile['duplicate_rows']
         }
         
         # Thêm thông tin cụ thể về missing values
-        missing_cols = df.columns[df.isnull().any()].tolist()
-        if missing_cols:
-            table_report['columns_with_missing'] = {
-                col: int(df[col].isnull().sum()) 
-                for col in missing_cols
-            }
+        missing_cols = missing_count[missing_count > 0]
+        if len(missing_cols) > 0:
+            table_report['columns_with_missing'] = {col: int(n) for col, n in missing_cols.items()}
+        
+        table_report['column_profile'] = table_profile['columns']
+        report['tables'][name] = table_report
         
+        print(f"\n{name.upper()}:", file=out)
+        print(f"  - Tổng số dòng: {table_report['total_rows']:,}", file=out)
+        print(f"  - Tổng số cột: {table_report['total_columns']}", file=out)
+        print(f"  - Tổng giá trị thiếu: {table_report['missing_values']}", file=out)
+        print(f"  - Dòng trùng lặp: {table_report['duplicate_rows']}", file=out)
+    
+    for name, table_report in (table_reports or {}).items():
         report['tables'][name] = table_report
         
-        print(f"\n{name.upper()}:")
-        print(f"  - Tổng số dòng: {table_report['total_rows']:,}")
-        print(f"  - Tổng số cột: {table_report['total_columns']}")
-        print(f"  - Tổng giá trị thiếu: {table_report['missing_values']}")
-        print(f"  - Dòng trùng lặp: {table_report['duplicate_rows']}")
+        print(f"\n{name.upper()}:", file=out)
+        print(f"  - Tổng số dòng: {table_report['total_rows']:,}", file=out)
+        print(f"  - Tổng số cột: {table_report['total_columns']}", file=out)
+        print(f"  - Tổng giá trị thiếu: {table_report['missing_values']}", file=out)
+        print(f"  - Dòng trùng lặp: {table_report['duplicate_rows']}", file=out)
+    
+    if rule_results:
+        report['rules'] = rule_summary(rule_results)
+        violated = [(name, rule_name, result) for name, rule_name, result in iter_rule_results(rule_results)
+                    if result['violations'] > 0]
+        print(f"\nLUẬT KIỂM TRA: {len(violated)} luật có dòng vi phạm", file=out)
+        for name, rule_name, result in violated:
+            print(f"  ✗ {name.upper()}.{rule_name}: {result['violations']} dòng ({result['description']})", file=out)
+    
+    if memory_log:
+        report['memory'] = memory_log
     
     # Lưu báo cáo ra file
-    with open('data_quality_report.json', 'w', encoding='utf-8') as f:
-        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    save_report(report)
     
-    print(f"\n✓ Đã lưu báo cáo vào file: data_quality_report.json")
+    print(f"\n✓ Đã lưu báo cáo vào file: {REPORT_FILE}", file=out)
     
     return report
 
+def save_report(report, report_file=REPORT_FILE):
+    """Ghi báo cáo chất lượng dữ liệu ra file JSON"""
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+
 # ============================================================================
 # BƯỚC 11: LƯU DỮ LIỆU
 # ============================================================================
 
-def save_cleaned_data(data, output_dir='cleaned_data/'):
-    """Lưu dữ liệu đã được làm sạch"""
-    # Tạo thư mục output nếu chưa có
-    os.makedirs(output_dir, exist_ok=True)
-    
-    print("\n" + "="*80)
-    print("LƯU DỮ LIỆU ĐÃ LÀM SẠCH")
-    print("="*80)
-    
-    for name, df in data.items():
-        output_file = os.path.join(output_dir, f"{name}_cleaned.csv")
-        df.to_csv(output_file, index=False, encoding='utf-8-sig')
-        print(f"✓ Đã lưu {output_file}: {len(df):,} dòng")
-    
-    print(f"\n✓ Hoàn tất! Tất cả dữ liệu đã được lưu vào thư mục: {output_dir}")
+def resolve_output_format(output_format, out=None):
+    """Kiểm tra định dạng lưu, quay về CSV nếu định dạng cột cần pyarrow mà chưa cài"""
+    if output_format not in OUTPUT_EXTENSIONS:
+        raise ValueError(f"Định dạng không hỗ trợ: {output_format} (chọn một trong {list(OUTPUT_EXTENSIONS)})")
+    if output_format != 'csv' and not HAS_PYARROW:
+        print(f"⚠ Chưa cài pyarrow, lưu dạng CSV thay cho {output_format}", file=out)
+        return 'csv'
+    return output_format
 
-# ============================================================================
-# HÀM CHÍNH - CHẠY TẤT CẢ CÁC BƯỚC
-# ============================================================================
+def cleaned_table_path(name, output_dir='cleaned_data/', output_format='csv'):
+    """Đường dẫn file của một bảng đã làm sạch"""
+    return os.path.join(output_dir, f"{name}_cleaned{OUTPUT_EXTENSIONS[output_format]}")
 
-def main():
-    """Hàm chính thực hiện toàn bộ quy trình preprocessing"""
+def cleaned_table_parts(path):
+    """File chính và các file phần ghi nối (<tên>.part-NNNNNN<đuôi>) của một bảng, theo thứ tự ghi"""
+    root, extension = os.path.splitext(path)
+    return [path] + sorted(glob.glob(f"{glob.escape(root)}.part-*{extension}"))
+
+def new_table_part_path(path):
+    """Đường dẫn file phần tiếp theo để ghi nối vào bảng Parquet/Arrow có file chính `path`"""
+    root, extension = os.path.splitext(path)
+    return f"{root}.part-{len(cleaned_table_parts(path)):06d}{extension}"
+
+def read_table_schema(path, output_format):
+    """Schema pyarrow của file Parquet/Arrow (chỉ đọc metadata)"""
+    if output_format == 'parquet':
+        return pq.read_schema(path)
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_stream(source).schema
+
+def write_chunks(chunks, path, output_format='csv', schema=None):
+    """Ghi nối tiếp các DataFrame (cùng cột) vào một file CSV, Parquet hoặc Arrow IPC
+    
+    Với Parquet/Arrow, schema lấy từ chunk đầu tiên (hoặc `schema` nếu có), các chunk được
+    ép theo schema đó. Arrow được ghi dạng IPC stream vì dạng này cho phép mỗi chunk có
+    dictionary (categories) riêng. Các file phần ghi nối của bảng cũ cùng đường dẫn bị xóa.
+    """
+    if output_format == 'csv':
+        # Ghi với encoding UTF-8-BOM (để Excel đọc được tiếng Việt)
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(f, index=False, header=(i == 0))
+        return
+    
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                schema = schema or table.schema
+                if output_format == 'parquet':
+                    writer = pq.ParquetWriter(path, schema, compression=COLUMNAR_COMPRESSION)
+                else:
+                    options = pa.ipc.IpcWriteOptions(compression=COLUMNAR_COMPRESSION)
+                    writer = pa.ipc.new_stream(path, schema, options=options)
+            writer.write_table(table.cast(schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    
+    for part in cleaned_table_parts(path)[1:]:
+        os.remove(part)
+
+def find_cleaned_table(name, output_dir='cleaned_data/'):
+    """File mới nhất của một bảng đã làm sạch trong các định dạng CSV/Parquet/Arrow
+    
+    Trả về (định dạng, đường dẫn file); (None, None) nếu không tìm thấy file.
+    """
+    candidates = [
+        (os.path.getmtime(path), output_format, path)
+        for output_format in OUTPUT_EXTENSIONS
+        for path in [cleaned_table_path(name, output_dir, output_format)]
+        if os.path.exists(path) and (output_format == 'csv' or HAS_PYARROW)
+    ]
+    if not candidates:
+        return None, None
+    
+    _, output_format, path = max(candidates)
+    return output_format, path
+
+def cleaned_table_columns(name, output_dir='cleaned_data/'):
+    """Danh sách cột của một bảng đã làm sạch (chỉ đọc header/schema), None nếu không tìm thấy file"""
+    output_format, path = find_cleaned_table(name, output_dir)
+    if path is None:
+        return None
+    if output_format == 'csv':
+        return list(pd.read_csv(path, encoding='utf-8-sig', nrows=0).columns)
+    return read_table_schema(path, output_format).names
+
+def filter_conditions(filters):
+    """Chuyển bộ lọc {cột: điều kiện} thành danh sách (cột, phép so sánh, giá trị) (kết hợp AND)
+    
+    Điều kiện là một giá trị (bằng), list/set (thuộc tập giá trị) hoặc tuple (min, max)
+    (khoảng đóng, None là không giới hạn). Danh sách có cùng dạng với tham số `filters`
+    của pyarrow/pd.read_parquet.
+    """
+    conditions = []
+    for col, condition in (filters or {}).items():
+        if isinstance(condition, tuple):
+            low, high = condition
+            if low is not None:
+                conditions.append((col, '>=', low))
+            if high is not None:
+                conditions.append((col, '<=', high))
+        elif isinstance(condition, (list, set, frozenset)):
+            conditions.append((col, 'in', list(condition)))
+        else:
+            conditions.append((col, '==', condition))
+    return conditions
+
+def convert_condition_value(value, to_date):
+    """Giá trị điều kiện dạng Timestamp (cột ngày) hoặc giữ nguyên"""
+    if not to_date:
+        return value
+    if isinstance(value, list):
+        return [pd.Timestamp(v) for v in value]
+    return pd.Timestamp(value)
+
+def parquet_conditions(conditions, schema, date_columns=()):
+    """Điều kiện lọc cho pd.read_parquet: giá trị của cột timestamp được chuyển sang Timestamp,
+    cột ngày lưu dạng chuỗi được so sánh theo chuỗi YYYY-MM-DD"""
+    converted = []
+    for col, op, value in conditions:
+        field_type = schema.field(col).type
+        if pa.types.is_timestamp(field_type) or pa.types.is_date(field_type):
+            value = convert_condition_value(value, True)
+        elif col in date_columns:
+            value = convert_condition_value(value, True)
+            value = [v.strftime('%Y-%m-%d') for v in value] if isinstance(value, list) else value.strftime('%Y-%m-%d')
+        converted.append((col, op, value))
+    return converted
+
+def filter_mask(df, conditions, date_columns=()):
+    """Mặt nạ các dòng thỏa mãn mọi điều kiện (giá trị thiếu không thỏa mãn điều kiện nào)
+    
+    Cột ngày (trong `date_columns` hoặc kiểu datetime) được so sánh theo Timestamp.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for col, op, value in conditions:
+        series = df[col]
+        is_date = pd.api.types.is_datetime64_any_dtype(series.dtype)
+        if col in date_columns and not is_date:
+            series = pd.to_datetime(series, errors='coerce')
+            is_date = True
+        value = convert_condition_value(value, is_date)
+        if op == 'in':
+            matched = series.isin(value)
+        elif op == '==':
+            matched = series == value
+        elif op == '>=':
+            matched = series >= value
+        else:
+            matched = series <= value
+        mask &= pd.Series(matched).fillna(False).to_numpy(dtype=bool)
+    return mask
+
+def read_cleaned_table(name, output_dir='cleaned_data/', columns=None, filters=None, chunksize=CHUNK_SIZE):
+    """Đọc một bảng đã làm sạch (file mới nhất trong các định dạng CSV/Parquet/Arrow)
+    
+    Với Parquet/Arrow, các file phần ghi nối (xem cleaned_table_parts) được đọc tiếp sau file chính.
+    columns: chỉ đọc các cột này (cột không có trong file được bỏ qua). Với Parquet/Arrow
+    chỉ các cột được chọn được giải mã và kiểu dữ liệu được giữ nguyên.
+    filters: chỉ giữ các dòng thỏa mãn bộ lọc (xem filter_conditions), áp dụng ngay khi
+    đọc: Parquet bỏ qua các row group không thỏa mãn, CSV được lọc theo từng đoạn
+    `chunksize` dòng nên không giữ toàn bộ bảng trong bộ nhớ.
+    Cột mã ID được đổi sang khóa thay thế sau khi lọc (xem encode_id_columns).
+    Trả về (DataFrame, đường dẫn file); (None, None) nếu không tìm thấy file.
+    """
+    output_format, path = find_cleaned_table(name, output_dir)
+    if path is None:
+        return None, None
+    
+    conditions = filter_conditions(filters)
+    date_columns = DATE_COLUMNS.get(name, [])
+    filter_columns = [col for col, _, _ in conditions]
+    read_columns = None if columns is None else list(columns) + [col for col in filter_columns if col not in columns]
+    if conditions:
+        available = cleaned_table_columns(name, output_dir)
+        unknown = [col for col in filter_columns if col not in available]
+        if unknown:
+            raise ValueError(f"Cột lọc không có trong {name}: {unknown}")
+    
+    def select(df):
+        return encode_id_columns(df if columns is None else df[[col for col in df.columns if col in columns]])
+    
+    if output_format == 'csv':
+        usecols = None if read_columns is None else (lambda col: col in read_columns)
+        if not conditions:
+            return select(pd.read_csv(path, encoding='utf-8-sig', usecols=usecols)), path
+        chunks = [
+            chunk[filter_mask(chunk, conditions, date_columns)]
+            for chunk in pd.read_csv(path, encoding='utf-8-sig', usecols=usecols, chunksize=chunksize)
+        ]
+        return select(pd.concat(chunks, ignore_index=True)), path
+    
+    if output_format == 'parquet':
+        schema = pq.read_schema(path)
+        selected = [col for col in schema.names if read_columns is None or col in read_columns]
+        df = pd.read_parquet(cleaned_table_parts(path), columns=selected,
+                             filters=parquet_conditions(conditions, schema, date_columns) or None)
+        return select(df.reset_index(drop=True)), path
+    
+    tables = []
+    for part in cleaned_table_parts(path):
+        with pa.memory_map(part) as source:
+            tables.append(pa.ipc.open_stream(source).read_all())
+    table = pa.concat_tables(tables)
+    selected = [col for col in table.column_names if read_columns is None or col in read_columns]
+    df = table.select(selected).to_pandas()
+    if conditions:
+        df = df[filter_mask(df, conditions, date_columns)].reset_index(drop=True)
+    return select(df), path
+
+def save_cleaned_data(data, output_dir='cleaned_data/', output_format=OUTPUT_FORMAT, out=None):
+    """Lưu dữ liệu đã được làm sạch (CSV, Parquet zstd hoặc Arrow IPC), khóa thay thế được ghi dạng chuỗi"""
+    output_format = resolve_output_format(output_format, out=out)
+    
+    # Tạo thư mục output nếu chưa có
+    os.makedirs(output_dir, exist_ok=True)
+    
+    print("\n" + "="*80, file=out)
+    print("LƯU DỮ LIỆU ĐÃ LÀM SẠCH", file=out)
+    print("="*80, file=out)
+    
+    for name, df in data.items():
+        output_file = cleaned_table_path(name, output_dir, output_format)
+        write_chunks(with_column_store([decode_id_columns(df)], name, output_dir), output_file, output_format)
+        print(f"✓ Đã lưu {output_file}: {len(df):,} dòng", file=out)
     
+    print(f"\n✓ Hoàn tất! Tất cả dữ liệu đã được lưu vào thư mục: {output_dir}", file=out)
+
+# ============================================================================
+# KHO CỘT (.npy + MANIFEST) CHO CÁC TIẾN TRÌNH ĐỌC
+# ============================================================================
+
+# Header .npy có độ dài cố định để có thể ghi nối dữ liệu rồi cập nhật số dòng trong header
+NPY_HEADER_SIZE = 128
+COLUMN_STORE_MANIFEST = 'manifest.json'
+
+def column_store_path(output_dir='cleaned_data/'):
+    """Thư mục kho cột của một thư mục output"""
+    return os.path.join(output_dir, COLUMN_STORE_DIR)
+
+def read_column_store_manifest(output_dir='cleaned_data/'):
+    """Đọc manifest của kho cột ({'tables': {...}} nếu chưa có)"""
+    path = os.path.join(column_store_path(output_dir), COLUMN_STORE_MANIFEST)
+    if not os.path.exists(path):
+        return {'tables': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def write_column_store_manifest(manifest, output_dir='cleaned_data/'):
+    """Ghi manifest của kho cột (ghi ra file tạm rồi đổi tên, không bao giờ để lại manifest ghi dở)"""
+    manifest['updated'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    path = os.path.join(column_store_path(output_dir), COLUMN_STORE_MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+def write_npy_header(f, dtype, n_rows):
+    """Ghi header .npy (phiên bản 1.0) của mảng 1 chiều `n_rows` phần tử, dài đúng NPY_HEADER_SIZE byte"""
+    prefix = np.lib.format.magic(1, 0)
+    header_len = NPY_HEADER_SIZE - len(prefix) - 2
+    header = repr({'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': (n_rows,)})
+    f.seek(0)
+    f.write(prefix + header_len.to_bytes(2, 'little') + header.ljust(header_len - 1).encode('latin1') + b'\n')
+
+def column_kind(series):
+    """Loại cột trong kho cột: 'category', 'datetime', 'numeric' hoặc None (cột chuỗi, không lưu)"""
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return 'category'
+    if isinstance(dtype, np.dtype) and dtype.kind == 'M':
+        return 'datetime'
+    if pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+        return 'numeric'
+    return None
+
+def open_column_store(name, output_dir='cleaned_data/', append=False):
+    """Mở bộ ghi kho cột cho một bảng
+    
+    append=True: ghi tiếp sau các dòng đã có trong kho (cột và kiểu theo manifest);
+    ngược lại bảng được ghi mới vào thư mục tạm và chỉ thay bảng cũ khi đóng
+    (close_column_store), cột được xác định từ chunk đầu tiên.
+    """
+    store_dir = column_store_path(output_dir)
+    manifest = read_column_store_manifest(output_dir)
+    store = {'output_dir': output_dir, 'dir': store_dir, 'name': name, 'rows': 0, 'columns': {}, 'files': {},
+             'sizes': {}, 'staging': None}
+    
+    entry = manifest['tables'].get(name)
+    if append and entry is not None:
+        store['rows'] = entry['rows']
+        for col, column in entry['columns'].items():
+            store['columns'][col] = dict(column)
+            if column['kind'] == 'category':
+                store['columns'][col]['categories'] = pd.Index(column['categories'])
+        return store
+    
+    store['staging'] = store['dir'] = os.path.join(store_dir, f'.{name}.tmp')
+    shutil.rmtree(store['staging'], ignore_errors=True)
+    os.makedirs(os.path.join(store['staging'], name))
+    return store
+
+def column_store_file(store, relative_path, n_rows_before=0):
+    """File .npy (đang mở) của một cột; file mới được ghi trước phần header cố định
+    
+    Kích thước ban đầu của file (None nếu file mới) được ghi lại để hủy phần đã ghi nối khi lỗi.
+    """
+    f = store['files'].get(relative_path)
+    if f is None:
+        path = os.path.join(store['dir'], relative_path)
+        if n_rows_before > 0 and os.path.exists(path):
+            f = open(path, 'r+b')
+            store['sizes'][relative_path] = f.seek(0, os.SEEK_END)
+        else:
+            f = open(path, 'wb')
+            f.write(b'\0' * NPY_HEADER_SIZE)
+            store['sizes'][relative_path] = None
+        store['files'][relative_path] = f
+    return f
+
+def define_column_store_columns(store, chunk):
+    """Xác định các cột được lưu và kiểu trên đĩa từ chunk đầu tiên"""
+    for col in chunk.columns:
+        kind = column_kind(chunk[col])
+        if kind is None:
+            continue
+        column = {'kind': kind, 'file': f"{store['name']}/{col}.npy"}
+        if kind == 'category':
+            column['dtype'] = 'int32'
+            column['categories'] = pd.Index(chunk[col].cat.categories[:0])
+        elif kind == 'datetime':
+            column['dtype'] = chunk[col].dtype.str
+        else:
+            dtype = chunk[col].dtype
+            column['dtype'] = np.dtype(getattr(dtype, 'numpy_dtype', dtype)).str
+        store['columns'][col] = column
+
+def column_store_append(store, chunk):
+    """Ghi nối một chunk (cùng cột với các chunk trước) vào kho cột
+    
+    Cột category: mã int32 theo danh sách category chung của cả bảng (category mới của
+    chunk được thêm vào cuối danh sách), -1 là giá trị thiếu. Cột số nullable: giá trị
+    (thiếu ghi thành 0) kèm file mặt nạ thiếu, tạo khi gặp giá trị thiếu đầu tiên.
+    Cột ngày: datetime64, thiếu là NaT.
+    """
+    if store['rows'] == 0 and not store['columns']:
+        define_column_store_columns(store, chunk)
+    
+    for col, column in store['columns'].items():
+        series = chunk[col]
+        mask = None
+        if column['kind'] == 'category':
+            if not isinstance(series.dtype, pd.CategoricalDtype):
+                series = series.astype('category')
+            categories = series.cat.categories
+            new_categories = categories[~categories.isin(column['categories'])]
+            if len(new_categories) > 0:
+                column['categories'] = column['categories'].append(new_categories)
+            # Thêm -1 vào cuối để mã -1 (giá trị thiếu) ánh xạ về -1
+            remap = np.append(column['categories'].get_indexer(categories), -1).astype('int32')
+            values = remap[series.cat.codes.to_numpy()]
+        elif column['kind'] == 'datetime':
+            values = series.to_numpy().astype(column['dtype'], copy=False)
+        elif isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+            mask = series.isna().to_numpy()
+            values = series.to_numpy(dtype=column['dtype'], na_value=0)
+        else:
+            values = series.to_numpy().astype(column['dtype'], copy=False)
+        
+        np.ascontiguousarray(values).tofile(column_store_file(store, column['file'], store['rows']))
+        
+        if mask is not None and ('mask' in column or mask.any()):
+            if 'mask' not in column:
+                column['mask'] = f"{store['name']}/{col}.mask.npy"
+                column_store_file(store, column['mask']).write(np.zeros(store['rows'], dtype=bool).tobytes())
+            mask.tofile(column_store_file(store, column['mask'], store['rows']))
+    
+    store['rows'] += len(chunk)
+
+def close_column_store(store):
+    """Cập nhật header các file .npy theo số dòng, thay bảng cũ (nếu ghi mới) và ghi bảng vào manifest"""
+    entry = {'rows': store['rows'], 'columns': {}}
+    for col, column in store['columns'].items():
+        for key, dtype in [('file', column['dtype']), ('mask', 'bool')]:
+            if key in column:
+                f = column_store_file(store, column[key], store['rows'])
+                write_npy_header(f, dtype, store['rows'])
+                f.close()
+        entry['columns'][col] = dict(column)
+        if column['kind'] == 'category':
+            entry['columns'][col]['categories'] = [to_json_value(v) for v in column['categories']]
+    store['files'] = {}
+    
+    if store['staging'] is not None:
+        table_dir = os.path.join(column_store_path(store['output_dir']), store['name'])
+        shutil.rmtree(table_dir, ignore_errors=True)
+        os.replace(os.path.join(store['staging'], store['name']), table_dir)
+        os.rmdir(store['staging'])
+    
+    manifest = read_column_store_manifest(store['output_dir'])
+    manifest['tables'][store['name']] = entry
+    write_column_store_manifest(manifest, store['output_dir'])
+
+def abort_column_store(store):
+    """Hủy các thay đổi chưa đóng: xóa thư mục tạm, hoặc cắt các file ghi nối về kích thước ban đầu
+    
+    Manifest chưa được ghi nên kho cột giữ nguyên như trước khi mở.
+    """
+    for f in store['files'].values():
+        f.close()
+    store['files'] = {}
+    if store['staging'] is not None:
+        shutil.rmtree(store['staging'], ignore_errors=True)
+        return
+    for relative_path, size in store['sizes'].items():
+        path = os.path.join(store['dir'], relative_path)
+        if size is None:
+            os.remove(path)
+        else:
+            os.truncate(path, size)
+
+def with_column_store(chunks, name, output_dir='cleaned_data/', append=False):
+    """Ghi các chunk vào kho cột trong lúc chuyển tiếp chúng cho bộ ghi file (nếu bật WRITE_COLUMN_STORE)
+    
+    Nếu có lỗi (hoặc bên đọc dừng sớm) trước khi hết chunk, phần đã ghi bị hủy.
+    """
+    if not WRITE_COLUMN_STORE:
+        yield from chunks
+        return
+    store = open_column_store(name, output_dir, append=append)
+    completed = False
+    try:
+        for chunk in chunks:
+            column_store_append(store, chunk)
+            yield chunk
+        close_column_store(store)
+        completed = True
+    finally:
+        if not completed:
+            abort_column_store(store)
+
+def load_column_store(name, output_dir='cleaned_data/', columns=None):
+    """Đọc các cột của một bảng từ kho cột, dữ liệu nằm trên mmap (không parse, không sao chép)
+    
+    Cột category được dựng lại từ mã và danh sách category trong manifest, cột số nullable
+    từ mảng giá trị và mặt nạ thiếu. Trả về {tên cột: Series}; {} nếu bảng chưa có trong kho.
+    """
+    entry = read_column_store_manifest(output_dir)['tables'].get(name)
+    if entry is None:
+        return {}
+    
+    store_dir = column_store_path(output_dir)
+    result = {}
+    for col, column in entry['columns'].items():
+        if columns is not None and col not in columns:
+            continue
+        values = np.load(os.path.join(store_dir, column['file']), mmap_mode='r')
+        if column['kind'] == 'category':
+            array = pd.Categorical.from_codes(values, categories=column['categories'])
+        elif 'mask' in column:
+            mask = np.load(os.path.join(store_dir, column['mask']), mmap_mode='r')
+            array_types = {'b': pd.arrays.BooleanArray, 'f': pd.arrays.FloatingArray}
+            array = array_types.get(values.dtype.kind, pd.arrays.IntegerArray)(values, mask)
+        else:
+            array = values
+        result[col] = pd.Series(array, name=col, copy=False)
+    return result
+
+# ============================================================================
+# THEO DÕI BỘ NHỚ
+# ============================================================================
+
+def start_memory_accounting():
+    """Bắt đầu theo dõi bộ nhớ (tracemalloc), trả về nhật ký bộ nhớ rỗng"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    return []
+
+def record_memory(memory_log, step, data):
+    """Ghi lại bộ nhớ của các bảng đang giữ và bộ nhớ đỉnh của bước vừa chạy"""
+    if memory_log is None:
+        return
+    
+    tables_mb = {
+        name: round(df.memory_usage(deep=True).sum() / 1024**2, 2)
+        for name, df in data.items()
+    }
+    current, peak = tracemalloc.get_traced_memory()
+    memory_log.append({
+        'step': step,
+        'tables_mb': tables_mb,
+        'data_mb': round(sum(tables_mb.values()), 2),
+        'traced_current_mb': round(current / 1024**2, 2),
+        'traced_peak_mb': round(peak / 1024**2, 2)
+    })
+    tracemalloc.reset_peak()
+
+def print_memory_report(memory_log):
+    """In bảng bộ nhớ theo từng bước"""
+    if not memory_log:
+        return
+    
+    print("\n" + "="*80)
+    print("BÁO CÁO BỘ NHỚ THEO TỪNG BƯỚC")
     print("="*80)
-    print("BẮT ĐẦU QUY TRÌNH PREPROCESSING DỮ LIỆU Y TẾ")
+    memory_df = pd.DataFrame([
+        {
+            'Bước': entry['step'],
+            'Dữ liệu (MB)': entry['data_mb'],
+            'Đang cấp phát (MB)': entry['traced_current_mb'],
+            'Đỉnh trong bước (MB)': entry['traced_peak_mb']
+        }
+        for entry in memory_log
+    ])
+    print(memory_df.to_string(index=False))
+
+# ============================================================================
+# ĐO HIỆU NĂNG TỪNG BƯỚC
+# ============================================================================
+
+def count_rows(data):
+    """Tổng số dòng của các bảng đang giữ"""
+    return sum(len(df) for df in data.values()) if data else 0
+
+def peak_rss_mb():
+    """Bộ nhớ RSS đỉnh của tiến trình (MB), None nếu hệ điều hành không hỗ trợ"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return round(peak / 1024**2 if sys.platform == 'darwin' else peak / 1024, 2)
+
+@contextlib.contextmanager
+def profiled_step(profile_log, step, rows_in=0):
+    """Đo thời gian, CPU và bộ nhớ đỉnh của khối lệnh bên trong rồi ghi vào profile_log
+    
+    Trả về dict để khối lệnh đặt số dòng ra (rows['rows_out'], mặc định bằng số dòng vào) và số
+    dòng vào khi chỉ biết sau khi chạy (rows['rows_in'], ví dụ bảng được đọc theo chunk).
+    Bộ nhớ đỉnh tracemalloc chỉ có khi đang theo dõi bộ nhớ (memory_report=True).
+    """
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    rows = {'rows_in': rows_in, 'rows_out': rows_in}
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    
+    yield rows
+    
+    profile_log.append({
+        'step': step,
+        'wall_s': round(time.perf_counter() - wall_start, 4),
+        'cpu_s': round(time.process_time() - cpu_start, 4),
+        'rows_in': rows['rows_in'],
+        'rows_out': rows['rows_out'],
+        'peak_rss_mb': peak_rss_mb(),
+        'traced_peak_mb': round(tracemalloc.get_traced_memory()[1] / 1024**2, 2) if tracing else None
+    })
+
+def run_profiled_step(profile_log, step, fn, data, *args, **kwargs):
+    """Chạy fn(data, ...) và ghi thời gian, CPU, số dòng vào/ra và bộ nhớ đỉnh vào profile_log"""
+    with profiled_step(profile_log, step, count_rows(data)) as rows:
+        result = fn(data, *args, **kwargs)
+        if isinstance(result, dict):
+            rows['rows_out'] = count_rows(result)
+    return result
+
+def print_profile_report(profile_log):
+    """In bảng thời gian và bộ nhớ theo từng bước
+    
+    Bước con (tên dạng 'bước/phần', ví dụ từng shard) được in nhưng không cộng vào tổng thời gian.
+    """
+    if not profile_log:
+        return
+    
+    print("\n" + "="*80)
+    print("THỜI GIAN VÀ BỘ NHỚ THEO TỪNG BƯỚC")
+    print("="*80)
+    profile_df = pd.DataFrame([
+        {
+            'Bước': entry['step'],
+            'Thời gian (s)': entry['wall_s'],
+            'CPU (s)': entry['cpu_s'],
+            'Dòng vào': entry['rows_in'],
+            'Dòng ra': entry['rows_out'],
+            'RSS đỉnh (MB)': entry['peak_rss_mb']
+        }
+        for entry in profile_log
+    ])
+    print(profile_df.to_string(index=False))
+    top_level = ~profile_df['Bước'].str.contains('/', regex=False)
+    print(f"\nTổng thời gian: {profile_df.loc[top_level, 'Thời gian (s)'].sum():.2f}s")
+
+def save_profile(profile_log, report, trace_file=PROFILE_TRACE_FILE, report_file=REPORT_FILE):
+    """Ghi kết quả đo vào báo cáo chất lượng dữ liệu và (nếu có) nối thêm vào trace JSON-lines"""
+    if report is not None:
+        report['profile'] = profile_log
+        save_report(report, report_file)
+    
+    if trace_file:
+        run_id = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with open(trace_file, 'a', encoding='utf-8') as f:
+            for entry in profile_log:
+                f.write(json.dumps({'run': run_id, **entry}, ensure_ascii=False) + '\n')
+        print(f"✓ Đã ghi trace hiệu năng vào file: {trace_file}")
+
+# ============================================================================
+# CHẾ ĐỘ STREAMING - XỬ LÝ MEDICAL_RECORDS THEO CHUNK
+# ============================================================================
+
+def iter_medical_records(chunksize=CHUNK_SIZE, id_formats=None):
+    """Đọc medical_records.csv theo từng chunk `chunksize` dòng
+    
+    id_formats: dạng mã của khóa các bảng được tham chiếu (xem reference_id_formats)
+    """
+    filepath = DATA_DIR + FILES['medical_records']
+    return read_table('medical_records', filepath, id_formats=id_formats, chunksize=chunksize)
+
+def new_stream_stats():
+    """Khởi tạo bộ đếm thống kê cho medical_records ở chế độ streaming"""
+    return {
+        'rows_in': 0,
+        'rows_out': 0,
+        'total_columns': 0,
+        'missing_before': pd.Series(dtype='int64'),
+        'missing_after': pd.Series(dtype='int64'),
+        'duplicate_keys': 0,
+        'duplicate_rows': 0,
+        'duplicate_rows_after': 0,
+        'invalid_foreign_keys': {fk_col: 0 for fk_col in FOREIGN_KEYS},
+        'inconsistent_total': 0,
+        'outlier_sketches': {col: new_quantile_sketch() for col in OUTLIER_COLUMNS['medical_records']},
+        # Thời gian/bộ nhớ các phần của bước làm sạch (từng shard, từng câu lệnh DuckDB), xem profiled_step
+        'profile': []
+    }
+
+def process_medical_records_chunk(chunk, key_indexes, seen_record_ids, stats):
+    """Làm sạch một chunk medical_records
+    
+    Thực hiện lần lượt: xử lý dữ liệu thiếu, xóa trùng lặp (theo record_id đã gặp ở
+    các chunk trước), kiểm tra khóa ngoại trên chỉ mục khóa của các bảng dimension
+    (dựng một lần cho cả quy trình), chuẩn hóa định dạng
+    và sửa tổng chi phí. `seen_record_ids` (tập khóa, xem new_key_set; nếu không có cột
+    record_id thì giữ hash các dòng đã ghi) và `stats` được cập nhật tại chỗ.
+    """
+    stats['rows_in'] += len(chunk)
+    stats['total_columns'] = len(chunk.columns)
+    stats['missing_before'] = stats['missing_before'].add(chunk.isnull().sum(), fill_value=0)
+    
+    # Bước 3: Dữ liệu thiếu (chunk vừa đọc thuộc riêng hàm này nên xử lý in-place)
+    chunk = handle_missing_medical_records(chunk, inplace=True)
+    
+    # Bước 4: Trùng lặp theo khóa chính (kể cả với các chunk trước) và trùng lặp toàn dòng
+    key_col = KEY_COLUMNS['medical_records']
+    if key_col in chunk.columns:
+        keys = chunk[key_col]
+        dup_mask = keys.duplicated(keep='first').to_numpy() | key_set_contains(seen_record_ids, keys)
+        stats['duplicate_keys'] += int(dup_mask.sum())
+        chunk = chunk[~dup_mask]
+        key_set_add(seen_record_ids, chunk[key_col])
+    
+    _, row_first = duplicate_row_masks(chunk)
+    stats['duplicate_rows'] += int(row_first.sum())
+    chunk = chunk[~row_first]
+    
+    # Bước 5: Tính toàn vẹn tham chiếu
+    invalid_counts, invalid_mask = validate_foreign_keys(chunk, key_indexes)
+    for fk_col, count in invalid_counts.items():
+        stats['invalid_foreign_keys'][fk_col] += count
+    chunk = chunk[~invalid_mask]
+    
+    # Bước 6: Chuẩn hóa định dạng
+    chunk_data = {'medical_records': chunk}
+    chunk_data = standardize_dates(chunk_data)
+    chunk_data = standardize_numeric(chunk_data)
+    chunk_data = standardize_strings(chunk_data)
+    chunk = chunk_data['medical_records']
+    
+    # Bước 7: Tổng chi phí = chi phí khám + chi phí thuốc
+    if all(col in chunk.columns for col in ['chi_phi_kham', 'chi_phi_thuoc', 'tong_chi_phi']):
+        calculated_total = chunk['chi_phi_kham'] + chunk['chi_phi_thuoc']
+        inconsistent = int((abs(calculated_total - chunk['tong_chi_phi']) > 1000).sum())
+        if inconsistent > 0:
+            stats['inconsistent_total'] += inconsistent
+            chunk['tong_chi_phi'] = calculated_total
+    
+    # Bước 8: Cập nhật quantile sketch của các cột chi phí
+    for col, sketch in stats['outlier_sketches'].items():
+        if col in chunk.columns:
+            sketch_update(sketch, chunk[col])
+    
+    if key_col not in chunk.columns:
+        count_duplicate_rows_after(chunk, seen_record_ids, stats)
+    stats['rows_out'] += len(chunk)
+    stats['missing_after'] = stats['missing_after'].add(chunk.isnull().sum(), fill_value=0)
+    
+    return chunk
+
+def count_duplicate_rows_after(chunk, row_set, stats):
+    """Đếm các dòng đã làm sạch trùng toàn bộ với một dòng đã ghi trước đó (cho báo cáo)
+    
+    Như profile_table, dòng trùng được tính trên dữ liệu sau chuẩn hóa. Chỉ cần khi
+    medical_records không có cột khóa chính: nếu có thì record_id đã duy nhất trên toàn bộ
+    kết quả nên không còn dòng trùng toàn bộ. Các dòng đã ghi được giữ bằng hash 64-bit
+    trong tập khóa `row_set` (xem new_key_set).
+    """
+    row_hash = pd.util.hash_pandas_object(decode_id_columns(chunk), index=False).to_numpy()
+    row_hash = pd.Series(row_hash.view(np.int64))
+    duplicated = row_hash.duplicated().to_numpy() | key_set_contains(row_set, row_hash)
+    stats['duplicate_rows_after'] += int(duplicated.sum())
+    key_set_add(row_set, row_hash[~duplicated])
+
+def stream_medical_records(dims, output_dir='cleaned_data/', chunksize=CHUNK_SIZE, output_format=OUTPUT_FORMAT):
+    """Đưa medical_records.csv qua pipeline theo từng chunk và ghi nối tiếp ra file cleaned
+    
+    Bộ nhớ đỉnh chỉ phụ thuộc vào `chunksize` và kích thước các bảng dimension,
+    cộng với tập record_id đã gặp (dùng để xóa trùng lặp giữa các chunk, 4-8 byte mỗi
+    khóa khi record_id đổi được sang khóa thay thế, xem new_key_set).
+    """
+    output_format = resolve_output_format(output_format)
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = cleaned_table_path('medical_records', output_dir, output_format)
+    
+    stats = new_stream_stats()
+    seen_record_ids = new_key_set()
+    key_indexes = build_key_indexes(dims)
+    
+    def cleaned_chunks():
+        for i, chunk in enumerate(iter_medical_records(chunksize, reference_id_formats(dims))):
+            chunk = process_medical_records_chunk(chunk, key_indexes, seen_record_ids, stats)
+            yield decode_id_columns(chunk)
+            print(f"  ✓ Chunk {i + 1}: đã đọc {stats['rows_in']:,} dòng, đã ghi {stats['rows_out']:,} dòng")
+    
+    write_chunks(with_column_store(cleaned_chunks(), 'medical_records', output_dir), output_file, output_format)
+    
+    print(f"✓ Đã lưu {output_file}: {stats['rows_out']:,} dòng")
+    return stats
+
+def print_stream_stats(stats):
+    """In kết quả kiểm tra của medical_records ở chế độ streaming"""
+    report_missing_counts('medical_records', stats['missing_before'].astype('int64'), stats['rows_in'])
+    
+    if stats['duplicate_keys'] > 0:
+        print(f"medical_records: Đã xóa {stats['duplicate_keys']} dòng trùng lặp")
+    if stats['duplicate_rows'] > 0:
+        print(f"medical_records: Đã xóa {stats['duplicate_rows']} dòng hoàn toàn trùng lặp")
+    
+    for fk_col, count in stats['invalid_foreign_keys'].items():
+        if count > 0:
+            print(f"✗ MEDICAL_RECORDS: Đã xóa {count} dòng có {fk_col} không hợp lệ")
+        else:
+            print(f"✓ MEDICAL_RECORDS: Tất cả {fk_col} đều hợp lệ")
+    
+    if stats['inconsistent_total'] > 0:
+        print(f"✗ MEDICAL_RECORDS: Đã cập nhật {stats['inconsistent_total']} dòng có tổng chi phí không khớp")
+    else:
+        print(f"✓ MEDICAL_RECORDS: Tổng chi phí nhất quán")
+
+def stream_table_report(stats):
+    """Tạo phần báo cáo của medical_records từ thống kê streaming"""
+    missing_after = stats['missing_after'].astype('int64')
+    table_report = {
+        'total_rows': stats['rows_out'],
+        'total_columns': stats['total_columns'],
+        'missing_values': int(missing_after.sum()),
+        'duplicate_rows': stats['duplicate_rows_after']
+    }
+    
+    missing_cols = missing_after[missing_after > 0]
+    if len(missing_cols) > 0:
+        table_report['columns_with_missing'] = {col: int(n) for col, n in missing_cols.items()}
+    
+    return table_report
+
+def clean_dimension_tables(dims, inplace=INPLACE_MODE):
+    """Bước 3-4 cho các bảng dimension: xử lý dữ liệu thiếu và xóa trùng lặp"""
+    print("\n>>> BƯỚC 3: KIỂM TRA DỮ LIỆU THIẾU")
+    missing_report = check_missing_values(dims)
+    dims = handle_all_missing_values(dims, inplace=inplace)
+    
+    print("\n>>> BƯỚC 4: KIỂM TRA DỮ LIỆU TRÙNG LẶP")
+    duplicate_cache = {}
+    duplicate_report = check_duplicates(dims, cache=duplicate_cache)
+    dims = remove_duplicates(dims, inplace=inplace, cache=duplicate_cache)
+    
+    return dims, missing_report, duplicate_report
+
+def standardize_dimension_tables(dims):
+    """Bước 6-7 cho các bảng dimension: chuẩn hóa định dạng và sửa tính nhất quán"""
+    print("\n>>> BƯỚC 6: CHUẨN HÓA ĐỊNH DẠNG DỮ LIỆU")
+    parsed_years = {}
+    dims = standardize_dates(dims, parsed_years=parsed_years)
+    dims = standardize_numeric(dims)
+    dims = standardize_strings(dims)
+    
+    print("\n>>> BƯỚC 7: KIỂM TRA TÍNH NHẤT QUÁN DỮ LIỆU")
+    consistency_issues = check_data_consistency(dims, parsed_years=parsed_years)
+    if consistency_issues:
+        dims = fix_consistency(dims, consistency_issues, parsed_years=parsed_years)
+    
+    return dims, consistency_issues
+
+def run_streaming_pipeline(chunksize=CHUNK_SIZE, output_dir='cleaned_data/', inplace=INPLACE_MODE,
+                           output_format=OUTPUT_FORMAT, engine='pandas', profile_trace=PROFILE_TRACE_FILE):
+    """Quy trình preprocessing ở chế độ streaming
+    
+    Các bảng dimension đi qua đầy đủ các bước như main(); medical_records được đọc,
+    làm sạch và ghi ra theo từng chunk nên không bao giờ nằm trọn trong bộ nhớ.
+    engine: cách làm sạch medical_records (xem MEDICAL_RECORDS_ENGINES)
+    Thời gian và bộ nhớ từng bước (kể cả các phần của engine) được in và ghi như main().
+    """
+    engine = resolve_engine(engine)
+    profile_log = []
+    
+    print("="*80)
+    path = "STREAMING" if engine == 'pandas' else "XỬ LÝ MEDICAL_RECORDS THEO LUỒNG BẰNG DUCKDB"
+    print(f"BẮT ĐẦU QUY TRÌNH PREPROCESSING ({path}, CHUNK = {chunksize:,} DÒNG)")
+    print("="*80)
+    
+    # Bước 2: Đọc các bảng dimension
+    print("\n>>> BƯỚC 2: ĐỌC DỮ LIỆU (CÁC BẢNG DIMENSION)")
+    with profiled_step(profile_log, 'load') as rows:
+        dims = load_data(tables=[name for name in FILES if name != 'medical_records'])
+        rows['rows_out'] = count_rows(dims)
+    
+    # Bước 3-4: Dữ liệu thiếu và trùng lặp của các bảng dimension
+    with profiled_step(profile_log, 'clean_dimensions', count_rows(dims)) as rows:
+        dims, missing_report, duplicate_report = clean_dimension_tables(dims, inplace=inplace)
+        rows['rows_out'] = count_rows(dims)
+    
+    # Bước 3-7 cho medical_records theo từng chunk
+    print("\n>>> BƯỚC 3-7: XỬ LÝ MEDICAL_RECORDS THEO CHUNK")
+    clean_medical_records = MEDICAL_RECORDS_ENGINES[engine]
+    with profiled_step(profile_log, 'medical_records') as rows:
+        stats = clean_medical_records(dims, output_dir=output_dir, chunksize=chunksize, output_format=output_format)
+        rows.update(rows_in=stats['rows_in'], rows_out=stats['rows_out'])
+    profile_log += stats['profile']
+    print_stream_stats(stats)
+    
+    # Bước 6-7: Chuẩn hóa và kiểm tra nhất quán các bảng dimension
+    with profiled_step(profile_log, 'standardize', count_rows(dims)):
+        dims, consistency_issues = standardize_dimension_tables(dims)
+    
+    # Bước 8-9: Outliers (chi phí medical_records dùng sketch gộp từ các chunk) và định dạng
+    print("\n>>> BƯỚC 8: PHÁT HIỆN DỮ LIỆU NGOẠI LAI")
+    with profiled_step(profile_log, 'outliers', count_rows(dims)):
+        outliers_report = detect_outliers(dims, sketches={'medical_records': stats['outlier_sketches']})
+    
+    print("\n>>> BƯỚC 9: KIỂM TRA ĐỊNH DẠNG")
+    with profiled_step(profile_log, 'validation', count_rows(dims)):
+        validate_emails(dims)
+        validate_phone_numbers(dims)
+    
+    # Bước 10: Báo cáo
+    print("\n>>> BƯỚC 10: TẠO BÁO CÁO TỔNG HỢP")
+    integrity_issues = {f'invalid_{fk_col}s': n for fk_col, n in stats['invalid_foreign_keys'].items() if n > 0}
+    with profiled_step(profile_log, 'report', count_rows(dims)):
+        report = generate_summary_report(
+            dims, missing_report, duplicate_report,
+            integrity_issues, consistency_issues, outliers_report,
+            table_reports={'medical_records': stream_table_report(stats)}
+        )
+    
+    # Bước 11: Lưu các bảng dimension (medical_records đã được ghi theo chunk)
+    print("\n>>> BƯỚC 11: LƯU DỮ LIỆU ĐÃ PREPROCESSING")
+    run_profiled_step(profile_log, 'save', save_cleaned_data, dims, output_dir=output_dir,
+                      output_format=output_format)
+    print_profile_report(profile_log)
+    save_profile(profile_log, report, trace_file=profile_trace)
+    
+    print("\n" + "="*80)
+    print("HOÀN TẤT QUY TRÌNH PREPROCESSING (STREAMING)!")
+    print("="*80)
+    
+    return dims
+
+# ============================================================================
+# ENGINE DUCKDB - LÀM SẠCH MEDICAL_RECORDS NGOÀI BỘ NHỚ
+# ============================================================================
+
+# Chuỗi được coi là giá trị thiếu khi đọc CSV (giống mặc định của pandas.read_csv)
+CSV_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                 '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+# Giá trị điền cho dữ liệu thiếu của medical_records (như handle_missing_medical_records)
+MEDICAL_RECORDS_FILL_VALUES = {
+    'ghi_chu': '',
+    'ket_qua_xet_nghiem': 'Chưa có kết quả'
+}
+
+def quote_identifier(name):
+    """Tên cột trong dấu nháy kép để dùng trong câu lệnh SQL"""
+    return '"' + name.replace('"', '""') + '"'
+
+def quote_literal(value):
+    """Chuỗi hằng trong dấu nháy đơn để dùng trong câu lệnh SQL"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def duckdb_connect(temp_dir=ENGINE_TEMP_DIR, threads=ENGINE_THREADS, memory_limit=ENGINE_MEMORY_LIMIT):
+    """Mở database DuckDB tạm trên đĩa trong `temp_dir`, trả về (kết nối, đường dẫn database)
+    
+    Các bảng trung gian nằm trong file database, phép sort/hash join vượt `memory_limit`
+    được tràn ra `temp_dir`, nên kích thước dữ liệu chỉ bị giới hạn bởi dung lượng đĩa.
+    """
+    os.makedirs(temp_dir, exist_ok=True)
+    database = os.path.join(temp_dir, 'medical_records.duckdb')
+    remove_duckdb_database(database)
+    conn = duckdb.connect(database, config={
+        'threads': threads,
+        'memory_limit': memory_limit,
+        'temp_directory': os.path.join(temp_dir, 'spill')
+    })
+    return conn, database
+
+def remove_duckdb_database(database):
+    """Xóa file database DuckDB tạm (và file WAL nếu có)"""
+    for path in [database, database + '.wal']:
+        if os.path.exists(path):
+            os.remove(path)
+
+def duckdb_numeric_types(conn, relation, columns):
+    """Kiểu SQL để đọc các cột số medical_records: kiểu mà read_csv của pandas tự suy luận
+    
+    BIGINT nếu mọi giá trị (khác NULL) của cột khai báo số nguyên là số nguyên trong phạm vi
+    int64, DOUBLE nếu không. Kiểu khai báo trong TABLE_SCHEMAS được ép trên từng batch như
+    read_table, nên giá trị vượt phạm vi hoặc không nguyên giữ kiểu rộng hơn thay vì thành NULL.
+    """
+    schema = TABLE_SCHEMAS['medical_records']
+    types = {col: 'DOUBLE' for col in columns if col in NUMERIC_COLUMNS['medical_records']}
+    integer_cols = [col for col in types if col in schema and pd.api.types.is_integer_dtype(schema[col])]
+    if not integer_cols:
+        return types
+    
+    non_integers = conn.execute("SELECT " + ", ".join(
+        f"count(*) FILTER (WHERE {name} IS NOT NULL AND NOT coalesce("
+        f"regexp_full_match({name}, '\\s*[+-]?\\d+\\s*') AND TRY_CAST({name} AS BIGINT) IS NOT NULL, false))"
+        for name in map(quote_identifier, integer_cols)
+    ) + f" FROM {relation}").fetchone()
+    for col, count in zip(integer_cols, non_integers):
+        if count == 0:
+            types[col] = 'BIGINT'
+    return types
+
+def duckdb_standardize_expression(col, numeric_types):
+    """Biểu thức SQL chuẩn hóa một cột medical_records (như bước 6 của pandas)"""
+    name = quote_identifier(col)
+    if col in DATE_COLUMNS['medical_records']:
+        return f"try_strptime({name}, '%Y-%m-%d')::DATE AS {name}"
+    if col in numeric_types:
+        return f"TRY_CAST({name} AS {numeric_types[col]}) AS {name}"
+    if not NORMALIZE_WHITESPACE:
+        return name
+    # Gộp nhiều khoảng trắng thành một rồi bỏ khoảng trắng đầu/cuối (như normalize_text)
+    return f"regexp_replace(regexp_replace({name}, '\\s+', ' ', 'g'), '^ | $', '', 'g') AS {name}"
+
+def duckdb_clean_medical_records(dims, output_dir='cleaned_data/', chunksize=CHUNK_SIZE, output_format=OUTPUT_FORMAT):
+    """Làm sạch medical_records.csv bằng DuckDB và ghi ra file cleaned theo từng batch
+    
+    Cùng các bước và thống kê như stream_medical_records nhưng trên toàn bảng: điền dữ liệu
+    thiếu, giữ lần xuất hiện đầu tiên của mỗi record_id (theo thứ tự dòng trong file), bỏ
+    các dòng có khóa ngoại không có trong bảng dimension, chuẩn hóa ngày/số/chuỗi và sửa
+    tổng chi phí (cả cột, như fix_consistency). Kết quả được đọc về pandas theo batch
+    khoảng `chunksize` dòng để ghi file và cập nhật quantile sketch. Thời gian, số dòng và
+    bộ nhớ của từng phần (nạp, loại trùng, khóa ngoại, chuẩn hóa, nhất quán, ghi) được ghi
+    vào stats['profile'].
+    """
+    output_format = resolve_output_format(output_format)
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = cleaned_table_path('medical_records', output_dir, output_format)
+    
+    stats = new_stream_stats()
+    profile_log = stats['profile']
+    conn, database = duckdb_connect()
+    try:
+        # Bước 2: Nạp file CSV (mọi cột dạng VARCHAR, rowid giữ thứ tự dòng trong file)
+        with profiled_step(profile_log, 'medical_records/duckdb_load') as rows:
+            conn.execute(
+                "CREATE TABLE raw AS SELECT * FROM read_csv(?, header = true, all_varchar = true, nullstr = ?)",
+                [DATA_DIR + FILES['medical_records'], CSV_NA_VALUES]
+            )
+            columns = [row[0] for row in conn.execute("DESCRIBE raw").fetchall()]
+            quoted = {col: quote_identifier(col) for col in columns}
+            
+            counts = conn.execute(
+                "SELECT count(*), " + ", ".join(f"count(*) - count({quoted[col]})" for col in columns) + " FROM raw"
+            ).fetchone()
+            stats['rows_in'] = rows['rows_in'] = rows['rows_out'] = counts[0]
+            stats['total_columns'] = len(columns)
+            stats['missing_before'] = pd.Series(counts[1:], index=columns, dtype='int64')
+        
+        # Bước 3-4: Điền dữ liệu thiếu rồi giữ dòng đầu tiên của mỗi record_id (nếu không có
+        # cột khóa thì của mỗi nhóm dòng trùng toàn bộ; khi đã loại trùng theo khóa thì không
+        # còn dòng trùng toàn bộ)
+        with profiled_step(profile_log, 'medical_records/duckdb_deduplicate', stats['rows_in']) as rows:
+            filled = ", ".join(
+                f"coalesce({quoted[col]}, {quote_literal(MEDICAL_RECORDS_FILL_VALUES[col])}) AS {quoted[col]}"
+                if FILL_MISSING_DEFAULTS and col in MEDICAL_RECORDS_FILL_VALUES else quoted[col]
+                for col in columns
+            )
+            key_col = KEY_COLUMNS['medical_records']
+            partition = [quoted[key_col]] if key_col in columns else list(quoted.values())
+            conn.execute(
+                f"CREATE TABLE deduplicated AS SELECT * FROM (SELECT rowid AS _row, {filled} FROM raw) "
+                f"QUALIFY row_number() OVER (PARTITION BY {', '.join(partition)} ORDER BY _row) = 1"
+            )
+            n_deduplicated = rows['rows_out'] = conn.execute("SELECT count(*) FROM deduplicated").fetchone()[0]
+            stats['duplicate_keys' if key_col in columns else 'duplicate_rows'] = stats['rows_in'] - n_deduplicated
+            conn.execute("DROP TABLE raw")
+        
+        # Bước 5: Đánh dấu khóa ngoại không tồn tại trong bảng dimension (anti-join với bảng khóa)
+        with profiled_step(profile_log, 'medical_records/duckdb_foreign_keys', n_deduplicated):
+            checks = {}
+            for fk_col, table in FOREIGN_KEYS.items():
+                if fk_col not in columns or table not in dims:
+                    continue
+                # raw giữ mã ID dạng chuỗi nên khóa thay thế của bảng dimension được đổi lại thành chuỗi
+                keys = pd.DataFrame({'key': decode_id_column(dims[table][KEY_COLUMNS[table]]).astype(object)})
+                conn.register('dimension_keys', keys)
+                conn.execute(f"CREATE TABLE keys_{table} AS SELECT DISTINCT CAST(key AS VARCHAR) AS key FROM dimension_keys")
+                conn.unregister('dimension_keys')
+                checks[fk_col] = f"coalesce({quoted[fk_col]} IN (SELECT key FROM keys_{table}), false)"
+            
+            flags = ", ".join(f"{check} AS {quote_identifier('_valid_' + fk_col)}" for fk_col, check in checks.items())
+            conn.execute(f"CREATE VIEW checked AS SELECT *{', ' + flags if flags else ''} FROM deduplicated")
+            if checks:
+                invalid = conn.execute(
+                    "SELECT " + ", ".join(f"count(*) FILTER (WHERE NOT {quote_identifier('_valid_' + fk_col)})"
+                                          for fk_col in checks) + " FROM checked"
+                ).fetchone()
+                for fk_col, count in zip(checks, invalid):
+                    stats['invalid_foreign_keys'][fk_col] = count
+        
+        # Bước 6: Chuẩn hóa định dạng trên các dòng hợp lệ
+        with profiled_step(profile_log, 'medical_records/duckdb_standardize', n_deduplicated) as rows:
+            valid = " AND ".join(quote_identifier('_valid_' + fk_col) for fk_col in checks) or "true"
+            numeric_types = duckdb_numeric_types(conn, f"checked WHERE {valid}", columns)
+            standardized = ", ".join(duckdb_standardize_expression(col, numeric_types) for col in columns)
+            conn.execute(f"CREATE TABLE standardized AS SELECT _row, {standardized} FROM checked WHERE {valid}")
+            n_standardized = rows['rows_out'] = conn.execute("SELECT count(*) FROM standardized").fetchone()[0]
+        
+        # Bước 7: Tổng chi phí = chi phí khám + chi phí thuốc
+        replace = ""
+        cost_cols = ['chi_phi_kham', 'chi_phi_thuoc', 'tong_chi_phi']
+        if all(col in columns for col in cost_cols):
+            with profiled_step(profile_log, 'medical_records/duckdb_consistency', n_standardized):
+                calculated = f"({quoted['chi_phi_kham']}::BIGINT + {quoted['chi_phi_thuoc']})"
+                stats['inconsistent_total'] = conn.execute(
+                    f"SELECT count(*) FROM standardized WHERE abs({calculated} - {quoted['tong_chi_phi']}) > 1000"
+                ).fetchone()[0]
+                if stats['inconsistent_total'] > 0:
+                    replace = f" REPLACE ({calculated} AS {quoted['tong_chi_phi']})"
+        
+        # Đọc kết quả theo thứ tự dòng ban đầu, từng batch
+        result = conn.execute(f"SELECT * EXCLUDE (_row){replace} FROM standardized ORDER BY _row")
+        vectors_per_batch = max(1, chunksize // duckdb.__standard_vector_size__)
+        schema = TABLE_SCHEMAS['medical_records']
+        row_set = new_key_set()
+        
+        def cleaned_batches():
+            while True:
+                batch = result.fetch_df_chunk(vectors_per_batch)
+                if len(batch) == 0:
+                    break
+                # Kiểu cột như sau standardize_strings: cột khai báo trong schema theo schema (giữ
+                # kiểu read_csv tự suy luận nếu không ép được, như read_table), cột chuỗi khác
+                # (trừ mã ID) thành category nếu ít giá trị phân biệt
+                for col in batch.columns:
+                    if col in schema:
+                        try:
+                            batch[col] = batch[col].astype(schema[col])
+                        except (ValueError, TypeError, OverflowError):
+                            # read_csv đọc cột số nguyên có giá trị thiếu thành float64
+                            if pd.api.types.is_integer_dtype(batch[col].dtype):
+                                batch[col] = batch[col].astype('float64' if batch[col].hasnans else 'int64')
+                            print(f"  ⚠ medical_records.{col}: Giữ kiểu {batch[col].dtype}")
+                    elif (col not in ID_COLUMNS and pd.api.types.is_string_dtype(batch[col].dtype)
+                          and batch[col].nunique() <= CATEGORY_MAX_RATIO * len(batch)):
+                        batch[col] = batch[col].astype('category')
+                for col, sketch in stats['outlier_sketches'].items():
+                    if col in batch.columns:
+                        sketch_update(sketch, batch[col])
+                if key_col not in columns:
+                    count_duplicate_rows_after(batch, row_set, stats)
+                stats['rows_out'] += len(batch)
+                stats['missing_after'] = stats['missing_after'].add(batch.isnull().sum(), fill_value=0)
+                yield batch
+        
+        with profiled_step(profile_log, 'medical_records/duckdb_write', n_standardized) as rows:
+            write_chunks(with_column_store(cleaned_batches(), 'medical_records', output_dir), output_file, output_format)
+            rows['rows_out'] = stats['rows_out']
+    finally:
+        conn.close()
+        remove_duckdb_database(database)
+    
+    print(f"✓ Đã lưu {output_file}: {stats['rows_out']:,} dòng")
+    return stats
+
+# Engine làm sạch medical_records: nhận (dims, output_dir, chunksize, output_format),
+# ghi file cleaned và trả về thống kê dạng new_stream_stats()
+MEDICAL_RECORDS_ENGINES = {
+    'pandas': stream_medical_records,
+    'duckdb': duckdb_clean_medical_records
+}
+
+def resolve_engine(engine):
+    """Kiểm tra engine, quay về pandas nếu chọn duckdb mà chưa cài"""
+    if engine not in MEDICAL_RECORDS_ENGINES:
+        raise ValueError(f"Engine không hỗ trợ: {engine} (chọn một trong {list(MEDICAL_RECORDS_ENGINES)})")
+    if engine == 'duckdb' and not HAS_DUCKDB:
+        print("⚠ Chưa cài duckdb, dùng engine pandas")
+        return 'pandas'
+    return engine
+
+# ============================================================================
+# CHẾ ĐỘ SONG SONG - XỬ LÝ MEDICAL_RECORDS THEO SHARD
+# ============================================================================
+
+def shard_by_key(df, key_col, n_shards):
+    """Chia bảng thành `n_shards` phần theo hash của `key_col` (cùng khóa luôn cùng shard)"""
+    shard_ids = pd.util.hash_pandas_object(df[key_col], index=False).to_numpy() % n_shards
+    return [df[shard_ids == i] for i in range(n_shards)]
+
+def clean_medical_records_shard(shard, key_indexes, step='medical_records/shard'):
+    """Làm sạch một shard medical_records trong tiến trình con, trả về (shard đã làm sạch, thống kê)
+    
+    Thời gian và RSS đỉnh của tiến trình con được ghi vào stats['profile'] với tên `step`.
+    """
+    stats = new_stream_stats()
+    with profiled_step(stats['profile'], step, len(shard)) as rows:
+        shard = process_medical_records_chunk(shard, key_indexes, new_key_set(), stats)
+        rows['rows_out'] = len(shard)
+    return shard, stats
+
+def merge_stream_stats(total, stats):
+    """Gộp thống kê của một shard/chunk vào `total`"""
+    for key in ['rows_in', 'rows_out', 'duplicate_keys', 'duplicate_rows', 'duplicate_rows_after', 'inconsistent_total']:
+        total[key] += stats[key]
+    total['total_columns'] = max(total['total_columns'], stats['total_columns'])
+    for key in ['missing_before', 'missing_after']:
+        total[key] = total[key].add(stats[key], fill_value=0)
+    for fk_col, count in stats['invalid_foreign_keys'].items():
+        total['invalid_foreign_keys'][fk_col] += count
+    for col, sketch in stats['outlier_sketches'].items():
+        sketch_merge(total['outlier_sketches'][col], sketch)
+    total['profile'] += stats['profile']
+    return total
+
+def clean_medical_records_sharded(mr, dims, workers=SHARD_WORKERS):
+    """Làm sạch medical_records song song theo shard patient_id
+    
+    Trùng lặp record_id có thể nằm ở hai shard khác nhau nên được xóa trước khi chia;
+    mỗi shard sau đó đi qua process_medical_records_chunk trong một tiến trình riêng.
+    Kết quả được ghép lại theo thứ tự dòng ban đầu.
+    """
+    stats = new_stream_stats()
+    
+    key_col = KEY_COLUMNS['medical_records']
+    if key_col in mr.columns:
+        dup_mask = mr[key_col].duplicated(keep='first').to_numpy()
+        stats['duplicate_keys'] += int(dup_mask.sum())
+        stats['rows_in'] += int(dup_mask.sum())
+        stats['missing_before'] = mr[dup_mask].isnull().sum()
+        mr = mr[~dup_mask]
+    
+    shards = shard_by_key(mr, 'patient_id', workers)
+    key_indexes = build_key_indexes(dims)
+    
+    steps = [f'medical_records/shard_{i + 1}' for i in range(len(shards))]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(clean_medical_records_shard, shards, [key_indexes] * len(shards), steps))
+    
+    for i, (_, shard_stats) in enumerate(results):
+        merge_stream_stats(stats, shard_stats)
+        entry = shard_stats['profile'][-1]
+        print(f"  ✓ Shard {i + 1}/{len(results)}: {shard_stats['rows_in']:,} dòng vào, {shard_stats['rows_out']:,} dòng ra "
+              f"({entry['wall_s']:.2f}s, RSS đỉnh {entry['peak_rss_mb']} MB)")
+    
+    cleaned = pd.concat([shard for shard, _ in results]).sort_index()
+    # Mỗi shard tự tạo category khi chuẩn hóa chuỗi; gộp lại thành một bộ category chung
+    for col in cleaned.columns:
+        if all(isinstance(shard[col].dtype, pd.CategoricalDtype) for shard, _ in results):
+            cleaned[col] = cleaned[col].astype('category')
+    
+    return cleaned, stats
+
+def run_sharded_pipeline(workers=SHARD_WORKERS, output_dir='cleaned_data/', inplace=INPLACE_MODE,
+                         output_format=OUTPUT_FORMAT, profile_trace=PROFILE_TRACE_FILE):
+    """Quy trình preprocessing với medical_records được làm sạch song song trên `workers` tiến trình
+    
+    Các bảng dimension đi qua các bước như chế độ streaming; medical_records được chia
+    theo patient_id và mỗi shard thực hiện xử lý thiếu, trùng lặp, toàn vẹn tham chiếu,
+    chuẩn hóa, tính nhất quán và quantile sketch cho outliers. Báo cáo các shard được gộp lại.
+    Thời gian và bộ nhớ từng bước (kể cả từng shard) được in và ghi như main().
+    """
+    profile_log = []
+    
+    print("="*80)
+    print(f"BẮT ĐẦU QUY TRÌNH PREPROCESSING (SONG SONG, {workers} TIẾN TRÌNH)")
     print("="*80)
     
     # Bước 2: Đọc dữ liệu
+    print("\n>>> BƯỚC 2: ĐỌC DỮ LIỆU")
+    with profiled_step(profile_log, 'load') as rows:
+        data = load_data()
+        rows['rows_out'] = count_rows(data)
+    mr = data.pop('medical_records')
+    
+    # Bước 3-4: Dữ liệu thiếu và trùng lặp của các bảng dimension
+    with profiled_step(profile_log, 'clean_dimensions', count_rows(data)) as rows:
+        dims, missing_report, duplicate_report = clean_dimension_tables(data, inplace=inplace)
+        rows['rows_out'] = count_rows(dims)
+    
+    # Bước 3-7 cho medical_records theo shard
+    print("\n>>> BƯỚC 3-7: XỬ LÝ MEDICAL_RECORDS SONG SONG")
+    with profiled_step(profile_log, 'medical_records', len(mr)) as rows:
+        mr, stats = clean_medical_records_sharded(mr, dims, workers=workers)
+        rows['rows_out'] = len(mr)
+    profile_log += stats['profile']
+    print_stream_stats(stats)
+    
+    # Bước 6-7: Chuẩn hóa và kiểm tra nhất quán các bảng dimension
+    with profiled_step(profile_log, 'standardize', count_rows(dims)):
+        dims, consistency_issues = standardize_dimension_tables(dims)
+    data = {**dims, 'medical_records': mr}
+    data = {name: data[name] for name in FILES if name in data}
+    
+    # Bước 8-9: Outliers (ngưỡng chi phí từ sketch gộp của các shard) và định dạng
+    print("\n>>> BƯỚC 8: PHÁT HIỆN DỮ LIỆU NGOẠI LAI")
+    with profiled_step(profile_log, 'outliers', count_rows(data)):
+        outliers_report = detect_outliers(data, sketches={'medical_records': stats['outlier_sketches']})
+    
+    print("\n>>> BƯỚC 9: KIỂM TRA ĐỊNH DẠNG")
+    with profiled_step(profile_log, 'validation', count_rows(data)):
+        validate_emails(data)
+        validate_phone_numbers(data)
+    
+    # Bước 10: Báo cáo
+    print("\n>>> BƯỚC 10: TẠO BÁO CÁO TỔNG HỢP")
+    integrity_issues = {f'invalid_{fk_col}s': n for fk_col, n in stats['invalid_foreign_keys'].items() if n > 0}
+    with profiled_step(profile_log, 'report', count_rows(data)):
+        report = generate_summary_report(
+            data, missing_report, duplicate_report,
+            integrity_issues, consistency_issues, outliers_report
+        )
+    
+    # Bước 11: Lưu dữ liệu
+    print("\n>>> BƯỚC 11: LƯU DỮ LIỆU ĐÃ PREPROCESSING")
+    run_profiled_step(profile_log, 'save', save_cleaned_data, data, output_dir=output_dir,
+                      output_format=output_format)
+    print_profile_report(profile_log)
+    save_profile(profile_log, report, trace_file=profile_trace)
+    
+    print("\n" + "="*80)
+    print("HOÀN TẤT QUY TRÌNH PREPROCESSING (SONG SONG)!")
+    print("="*80)
+    
+    return data
+
+# ============================================================================
+# CÁC BƯỚC CỦA QUY TRÌNH
+# ============================================================================
+
+# Mỗi bước nhận (data, reports, options) và trả về data; các báo cáo trung gian được
+# ghi vào `reports`, `options` chứa cấu hình của lần chạy (inplace, memory_log) và
+# dữ liệu trung gian không cần lưu checkpoint (parsed_years)
+
+def step_load(data, reports, options):
     print("\n>>> BƯỚC 2: ĐỌC DỮ LIỆU")
     data = load_data()
     basic_info(data)
-    
-    # Bước 3: Kiểm tra dữ liệu thiếu
+    return data
+
+def step_missing(data, reports, options):
     print("\n>>> BƯỚC 3: KIỂM TRA DỮ LIỆU THIẾU")
-    missing_report = check_missing_values(data)
-    data = handle_all_missing_values(data)
-    
-    # Bước 4: Kiểm tra trùng lặp
+    reports['missing_report'] = check_missing_values(data)
+    return handle_all_missing_values(data, inplace=options['inplace'])
+
+def step_duplicates(data, reports, options):
     print("\n>>> BƯỚC 4: KIỂM TRA DỮ LIỆU TRÙNG LẶP")
-    duplicate_report = check_duplicates(data)
-    data = remove_duplicates(data)
-    
-    # Bước 5: Kiểm tra tính toàn vẹn tham chiếu
+    # Thông tin trùng lặp (hash từng dòng, mặt nạ) được tính một lần và dùng chung
+    duplicate_cache = {}
+    reports['duplicate_report'] = check_duplicates(data, cache=duplicate_cache)
+    return remove_duplicates(data, inplace=options['inplace'], cache=duplicate_cache)
+
+def step_integrity(data, reports, options):
     print("\n>>> BƯỚC 5: KIỂM TRA TÍNH TOÀN VẸN THAM CHIẾU")
     integrity_issues = check_referential_integrity(data)
+    reports['integrity_issues'] = integrity_issues
     if integrity_issues:
-        data = fix_referential_integrity(data, integrity_issues)
-    
-    # Bước 6: Chuẩn hóa định dạng
+        data = fix_referential_integrity(data, integrity_issues, inplace=options['inplace'])
+    return data
+
+def step_standardize(data, reports, options):
     print("\n>>> BƯỚC 6: CHUẨN HÓA ĐỊNH DẠNG DỮ LIỆU")
-    data = standardize_dates(data)
+    data = standardize_dates(data, parsed_years=options['parsed_years'])
     data = standardize_numeric(data)
-    data = standardize_strings(data)
-    
-    # Bước 7: Kiểm tra tính nhất quán
+    return standardize_strings(data)
+
+def step_consistency(data, reports, options):
     print("\n>>> BƯỚC 7: KIỂM TRA TÍNH NHẤT QUÁN DỮ LIỆU")
-    consistency_issues = check_data_consistency(data)
+    consistency_issues = check_data_consistency(data, parsed_years=options['parsed_years'])
+    reports['consistency_issues'] = consistency_issues
     if consistency_issues:
-        data = fix_consistency(data, consistency_issues)
-    
-    # Bước 8: Phát hiện outliers
+        data = fix_consistency(data, consistency_issues, parsed_years=options['parsed_years'])
+    return data
+
+def step_outliers(data, reports, options):
     print("\n>>> BƯỚC 8: PHÁT HIỆN DỮ LIỆU NGOẠI LAI")
-    outliers_report = detect_outliers(data)
-    
-    # Bước 9: Kiểm tra định dạng
+    # Dữ liệu không thay đổi sau bước 7 nên mọi luật được đánh giá một lượt mỗi bảng trên dữ
+    # liệu đã làm sạch; bước 9 và báo cáo (bước 10) dùng lại bitmap vi phạm
+    reports['rule_results'] = evaluate_rules(data, parsed_years=options['parsed_years'])
+    reports['outliers_report'] = detect_outliers(data, rule_results=reports['rule_results'])
+    return data
+
+def step_validation(data, reports, options):
     print("\n>>> BƯỚC 9: KIỂM TRA ĐỊNH DẠNG")
-    validate_emails(data)
-    validate_phone_numbers(data)
-    
-    # Bước 10: Tạo báo cáo
+    rule_results = reports.get('rule_results') or evaluate_rules(data, groups=['format'])
+    reports['contact_issues'] = {
+        'email': validate_emails(data, rule_results=rule_results),
+        'so_dien_thoai': validate_phone_numbers(data, rule_results=rule_results)
+    }
+    return data
+
+def step_report(data, reports, options):
     print("\n>>> BƯỚC 10: TẠO BÁO CÁO TỔNG HỢP")
-    summary_report = generate_summary_report(
-        data, missing_report, duplicate_report, 
-        integrity_issues, consistency_issues, outliers_report
+    # Kết quả luật trên dữ liệu đã làm sạch từ bước 8
+    rule_results = reports.get('rule_results') or evaluate_rules(data, parsed_years=options['parsed_years'])
+    reports['summary_report'] = generate_summary_report(
+        data, reports['missing_report'], reports['duplicate_report'],
+        reports['integrity_issues'], reports['consistency_issues'], reports['outliers_report'],
+        memory_log=options['memory_log'], rule_results=rule_results
     )
+    return data
+
+# Các hàm của bộ luật kiểm tra dữ liệu, dùng chung cho các bước đánh giá luật
+RULE_ENGINE_FUNCTIONS = [evaluate_rules, evaluate_table_rules, compile_rules, rule_columns, iter_rule_results,
+                         merge_rule_results, violation_mask, rule_numeric, rule_factorized,
+                         *RULE_EVALUATORS.values()]
+
+# (tên bước, hàm thực hiện, các hàm mà bước sử dụng, bước có thay đổi dữ liệu hay không).
+# Mã nguồn của các hàm này là một phần fingerprint checkpoint của bước.
+PIPELINE_STEPS = [
+    ('load', step_load, [load_data, read_table, basic_info, encode_id_columns, encode_id_column, id_key_format,
+                         id_key_codes, id_key_bytes, id_key_formats, set_id_key_formats], True),
+    ('missing', step_missing, [check_missing_values, report_missing_counts, profile_tables, profile_table,
+                               profile_column, missing_counts, to_json_value, handle_all_missing_values,
+                               handle_missing_patients, handle_missing_medical_records,
+                               handle_missing_diagnoses, fill_missing, working_copy, decode_id_column,
+                               is_surrogate_key], True),
+    ('duplicates', step_duplicates, [check_duplicates, remove_duplicates, compute_duplicate_info,
+                                     duplicate_row_masks, get_duplicate_info, drop_rows, working_copy], True),
+    ('integrity', step_integrity, [check_referential_integrity, fix_referential_integrity, build_key_index,
+                                   build_key_indexes, lookup_keys, validate_foreign_keys, working_copy,
+                                   drop_rows, key_values], True),
+    ('standardize', step_standardize, [standardize_dates, parse_date_column, parse_iso_dates, standardize_numeric,
+                                       standardize_strings, normalize_string_column, normalize_text], True),
+    ('consistency', step_consistency, [check_data_consistency, fix_consistency, birth_years, *RULE_ENGINE_FUNCTIONS],
+     True),
+    ('outliers', step_outliers, [detect_outliers, exact_iqr_bounds, birth_years, *RULE_ENGINE_FUNCTIONS], False),
+    ('validation', step_validation, [validate_emails, validate_phone_numbers, contact_results, pattern_validity,
+                                     email_validity, phone_validity, print_contact_results,
+                                     *RULE_ENGINE_FUNCTIONS], False),
+    ('report', step_report, [generate_summary_report, duplicate_row_masks, profile_tables, profile_table,
+                             profile_column, missing_counts, to_json_value, save_report, rule_summary,
+                             *RULE_ENGINE_FUNCTIONS], False)
+]
+
+# ============================================================================
+# CHECKPOINT THEO NỘI DUNG
+# ============================================================================
+
+def file_fingerprint(filepath):
+    """Hash nội dung một file (blake2b), 'missing' nếu file không tồn tại"""
+    if not os.path.exists(filepath):
+        return 'missing'
+    
+    h = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def referenced_constants(fn):
+    """Các hằng cấu hình của module (tên viết hoa) mà mã nguồn của hàm đọc tới
+    
+    Gồm cả tên dùng trong hàm lồng/comprehension/lambda bên trong hàm.
+    """
+    names = set()
+    codes = [fn.__code__]
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(const for const in code.co_consts if isinstance(const, types.CodeType))
+    module = globals()
+    return {name: module[name] for name in sorted(names) if name.isupper() and name in module}
+
+def fingerprint_value(value):
+    """Dạng JSON của giá trị không tự chuyển sang JSON được (dùng làm `default` của json.dumps)
+    
+    Hàm (ví dụ hàm kiểm tra trong DATA_RULES) được đại diện bởi mã nguồn, giá trị mặc định
+    của tham số và các hằng cấu hình nó đọc tới; regex bởi pattern và flags.
+    """
+    if isinstance(value, re.Pattern):
+        return {'pattern': value.pattern, 'flags': value.flags}
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    if isinstance(value, types.FunctionType):
+        return function_fingerprint(value)
+    return repr(value)
+
+def function_fingerprint(fn):
+    """Mã nguồn, giá trị mặc định của tham số và các hằng cấu hình mà hàm đọc tới"""
+    return {
+        'source': inspect.getsource(fn),
+        'defaults': [fn.__defaults__, fn.__kwdefaults__],
+        'constants': referenced_constants(fn)
+    }
+
+def step_fingerprints(steps=PIPELINE_STEPS):
+    """Khóa checkpoint của từng bước
+    
+    Khóa của bước đầu tiên gồm nội dung các file đầu vào, phiên bản các thư viện và năm hiện
+    tại (dùng khi tính tuổi); khóa của mỗi bước sau gồm khóa bước trước cộng mã nguồn các hàm
+    của bước đó, giá trị mặc định của tham số và giá trị mọi hằng cấu hình mà các hàm này đọc
+    tới (DATA_RULES, OUTLIER_COLUMNS, EMAIL_PATTERN, ...). Sửa mã hoặc cấu hình của một
+    bước chỉ làm mất hiệu lực checkpoint từ bước đó trở đi.
+    """
+    config = json.dumps({
+        'files': FILES,
+        'data_dir': DATA_DIR,
+        'year': datetime.now().year,
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'pyarrow': pa.__version__ if HAS_PYARROW else None
+    }, sort_keys=True)
+    
+    h = hashlib.blake2b(config.encode('utf-8'), digest_size=16)
+    for name, filename in FILES.items():
+        h.update(f"{name}:{file_fingerprint(DATA_DIR + filename)}".encode('utf-8'))
+    
+    keys = []
+    previous = h.hexdigest()
+    for name, step_fn, dependencies, _ in steps:
+        h = hashlib.blake2b(previous.encode('utf-8'), digest_size=16)
+        h.update(name.encode('utf-8'))
+        for fn in [step_fn] + dependencies:
+            h.update(json.dumps(function_fingerprint(fn), sort_keys=True, default=fingerprint_value).encode('utf-8'))
+        previous = h.hexdigest()
+        keys.append(previous)
+    return keys
+
+def checkpoint_path(index, name, key, checkpoint_dir=CHECKPOINT_DIR):
+    """Thư mục checkpoint của một bước"""
+    return os.path.join(checkpoint_dir, f"{index:02d}_{name}_{key}")
+
+def write_checkpoint_table(df, path):
+    """Ghi một bảng của checkpoint, trả về tên file
+    
+    Bảng được ghi dạng Arrow IPC (không nén, đọc lại qua memory map, giữ kiểu category/ngày/
+    số nullable và attrs); bảng có cột object (có thể lẫn kiểu, Arrow không giữ nguyên được)
+    hoặc khi chưa cài pyarrow thì ghi bằng pickle.
+    """
+    if HAS_PYARROW and not (df.dtypes == object).any():
+        table = pa.Table.from_pandas(df)
+        with pa.OSFile(path + '.arrow', 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        return os.path.basename(path) + '.arrow'
+    
+    with open(path + '.pkl', 'wb') as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return os.path.basename(path) + '.pkl'
+
+def read_checkpoint_table(path):
+    """Đọc một bảng của checkpoint (xem write_checkpoint_table)"""
+    if path.endswith('.arrow'):
+        with pa.memory_map(path) as source:
+            df = pa.ipc.open_file(source).read_all().to_pandas()
+        # attrs qua Arrow giữ dạng mã là list, đổi lại thành tuple
+        return set_id_key_formats(df, id_key_formats(df))
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def save_checkpoint(index, name, key, data, reports, checkpoint_dir=CHECKPOINT_DIR):
+    """Lưu kết quả của một bước và xóa các checkpoint cũ của bước đó
+    
+    Mỗi bảng là một file (xem write_checkpoint_table), báo cáo được pickle vào checkpoint.pkl.
+    data=None: bước không thay đổi dữ liệu, chỉ lưu báo cáo. Thư mục được ghi dưới tên tạm
+    rồi đổi tên nên checkpoint chỉ xuất hiện khi đã ghi xong.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = checkpoint_path(index, name, key, checkpoint_dir)
+    
+    for old_path in glob.glob(os.path.join(checkpoint_dir, f"{index:02d}_{name}_*")):
+        if old_path != path:
+            shutil.rmtree(old_path) if os.path.isdir(old_path) else os.remove(old_path)
+    
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    tables = None
+    if data is not None:
+        tables = {table: write_checkpoint_table(df, os.path.join(tmp_path, table)) for table, df in data.items()}
+    with open(os.path.join(tmp_path, 'checkpoint.pkl'), 'wb') as f:
+        pickle.dump({'tables': tables, 'reports': reports}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+def load_checkpoint(index, name, key, checkpoint_dir=CHECKPOINT_DIR):
+    """Đọc báo cáo và danh sách file bảng ('tables', None nếu bước không lưu dữ liệu) của checkpoint"""
+    with open(os.path.join(checkpoint_path(index, name, key, checkpoint_dir), 'checkpoint.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+def load_checkpoint_data(index, name, key, tables, checkpoint_dir=CHECKPOINT_DIR):
+    """Đọc các bảng của checkpoint"""
+    path = checkpoint_path(index, name, key, checkpoint_dir)
+    return {table: read_checkpoint_table(os.path.join(path, filename)) for table, filename in tables.items()}
+
+def find_resume_point(keys, steps=PIPELINE_STEPS, checkpoint_dir=CHECKPOINT_DIR):
+    """Tìm checkpoint hợp lệ cuối cùng
+    
+    Trả về (số bước đã hoàn thành, data, reports); (0, None, {}) nếu phải chạy từ đầu.
+    Với các bước không thay đổi dữ liệu, data được lấy từ checkpoint gần nhất có data.
+    """
+    done = 0
+    while done < len(steps) and os.path.isdir(checkpoint_path(done, steps[done][0], keys[done], checkpoint_dir)):
+        done += 1
+    
+    while done > 0:
+        try:
+            reports = load_checkpoint(done - 1, steps[done - 1][0], keys[done - 1], checkpoint_dir)['reports']
+            for i in range(done - 1, -1, -1):
+                tables = load_checkpoint(i, steps[i][0], keys[i], checkpoint_dir)['tables']
+                if tables is not None:
+                    return done, load_checkpoint_data(i, steps[i][0], keys[i], tables, checkpoint_dir), reports
+        except (OSError, ValueError, KeyError, pickle.UnpicklingError, EOFError) as e:
+            print(f"⚠ Checkpoint bước {steps[done - 1][0]} bị lỗi ({e}), bỏ qua")
+        done -= 1
+    
+    return 0, None, {}
+
+# ============================================================================
+# CHẠY THEO ĐỒ THỊ PHỤ THUỘC (DAG) - CÁC NHÁNH ĐỘC LẬP CHẠY ĐỒNG THỜI
+# ============================================================================
+
+# Mỗi tác vụ khai báo các đầu vào và đầu ra (tên bảng như 'patients', hoặc báo cáo như
+# 'missing_report/patients'). Tác vụ chờ tác vụ gần nhất trước nó tạo ra mỗi đầu vào, và
+# tác vụ ghi đè một đầu ra chờ các tác vụ trước đó còn đọc giá trị cũ, nên kết quả giống
+# hệt khi chạy tuần tự theo thứ tự khai báo. Hàm của tác vụ nhận ({đầu vào: giá trị}, options)
+# và trả về {đầu ra: giá trị}; output của tác vụ được ghi vào options['out'] (các hàm in kết quả
+# nhận tham số out, mặc định là stdout).
+
+TIMELINE_WIDTH = 50
+
+def pipeline_task(name, fn, inputs=(), outputs=()):
+    """Khai báo một tác vụ của đồ thị"""
+    return {'name': name, 'fn': fn, 'inputs': list(inputs), 'outputs': list(outputs)}
+
+def task_load(name, inputs, options):
+    data = load_data(tables=[name], workers=1, out=options['out'])
+    basic_info(data, out=options['out'])
+    return data
+
+def task_missing(name, inputs, options):
+    data = {name: inputs[name]}
+    return {
+        f'missing_report/{name}': check_missing_values(data, out=options['out']),
+        **handle_all_missing_values(data, inplace=options['inplace'])
+    }
+
+def task_duplicates(name, inputs, options):
+    data = {name: inputs[name]}
+    duplicate_cache = {}
+    return {
+        f'duplicate_report/{name}': check_duplicates(data, cache=duplicate_cache, out=options['out']),
+        **remove_duplicates(data, inplace=options['inplace'], cache=duplicate_cache, out=options['out'])
+    }
+
+def task_key_index(name, inputs, options):
+    return {f'keys/{name}': build_key_index(inputs[name], KEY_COLUMNS[name])}
+
+def task_integrity(inputs, options):
+    data = {'medical_records': inputs['medical_records']}
+    key_indexes = {
+        table: inputs[f'keys/{table}']
+        for table in FOREIGN_KEYS.values()
+        if f'keys/{table}' in inputs
+    }
+    integrity_issues = check_referential_integrity(data, key_indexes=key_indexes, out=options['out'])
+    if integrity_issues:
+        data = fix_referential_integrity(data, integrity_issues, inplace=options['inplace'], out=options['out'])
+    return {'integrity_issues': integrity_issues, **data}
+
+def task_standardize(name, inputs, options):
+    data = standardize_dates({name: inputs[name]}, parsed_years=options['parsed_years'])
+    data = standardize_numeric(data)
+    return standardize_strings(data)
+
+def task_consistency(name, inputs, options):
+    data = {name: inputs[name]}
+    consistency_issues = check_data_consistency(data, parsed_years=options['parsed_years'], out=options['out'])
+    if consistency_issues:
+        data = fix_consistency(data, consistency_issues, parsed_years=options['parsed_years'], out=options['out'])
+    return {f'consistency_issues/{name}': consistency_issues, **data}
+
+def task_outliers(inputs, options):
+    rule_results = evaluate_rules(inputs, groups=['outlier'])
+    return {
+        'outliers_report': detect_outliers(inputs, rule_results=rule_results, out=options['out']),
+        'rule_results/outlier': rule_results
+    }
+
+def task_validation(inputs, options):
+    rule_results = evaluate_rules(inputs, groups=['format'])
+    return {
+        'contact_issues': {
+            'email': validate_emails(inputs, rule_results=rule_results, out=options['out']),
+            'so_dien_thoai': validate_phone_numbers(inputs, rule_results=rule_results, out=options['out'])
+        },
+        'rule_results/format': rule_results
+    }
+
+def task_rules(inputs, options):
+    rule_results = evaluate_rules(inputs, groups=['consistency', 'range', 'integrity', 'uniqueness'],
+                                  parsed_years=options['parsed_years'])
+    return {'rule_results/checks': rule_results}
+
+def task_report(inputs, options):
+    data = {name: inputs[name] for name in FILES}
+    
+    def merged(prefix):
+        # Báo cáo theo bảng, theo thứ tự khai báo đầu vào (thứ tự các bảng trong FILES)
+        return [value for key, value in inputs.items() if key.startswith(prefix + '/')]
+    
+    missing_report, duplicate_report, consistency_issues, rule_results = {}, {}, [], {}
+    for report in merged('missing_report'):
+        missing_report.update(report)
+    for report in merged('duplicate_report'):
+        duplicate_report.update(report)
+    for issues in merged('consistency_issues'):
+        consistency_issues += issues
+    for results in merged('rule_results'):
+        merge_rule_results(rule_results, results)
+    
+    return {'summary_report': generate_summary_report(
+        data, missing_report, duplicate_report,
+        inputs['integrity_issues'], consistency_issues, inputs['outliers_report'],
+        rule_results=rule_results, out=options['out']
+    )}
+
+def task_save(inputs, options):
+    save_cleaned_data({name: inputs[name] for name in FILES}, output_dir=options['output_dir'],
+                      output_format=options['output_format'], out=options['out'])
+    return {}
+
+def build_task_graph():
+    """Đồ thị tác vụ của quy trình preprocessing, chia theo bảng
+    
+    Đọc, xử lý thiếu, trùng lặp, chuẩn hóa và nhất quán của mỗi bảng là một nhánh riêng;
+    các bảng dimension chỉ gặp medical_records ở bước toàn vẹn tham chiếu (qua chỉ mục khóa),
+    nên được chuẩn hóa đồng thời với bước đó. Outliers, kiểm tra định dạng và các luật còn lại
+    (trên dữ liệu đã làm sạch, cho báo cáo) độc lập nhau.
+    """
+    key_tables = [name for name in FILES if name in FOREIGN_KEYS.values()]
+    rule_tables = {
+        group: [name for name in FILES if any(rule['group'] == group for rule in DATA_RULES.get(name, []))]
+        for group in ['consistency', 'format']
+    }
+    
+    tasks = []
+    for name in FILES:
+        tasks += [
+            pipeline_task(f'load/{name}', functools.partial(task_load, name), outputs=[name]),
+            pipeline_task(f'missing/{name}', functools.partial(task_missing, name),
+                          [name], [name, f'missing_report/{name}']),
+            pipeline_task(f'duplicates/{name}', functools.partial(task_duplicates, name),
+                          [name], [name, f'duplicate_report/{name}'])
+        ]
+        if name in key_tables:
+            tasks.append(pipeline_task(f'keys/{name}', functools.partial(task_key_index, name),
+                                       [name], [f'keys/{name}']))
+    
+    tasks.append(pipeline_task('integrity', task_integrity, ['medical_records'] + [f'keys/{t}' for t in key_tables],
+                               ['medical_records', 'integrity_issues']))
+    
+    for name in FILES:
+        tasks.append(pipeline_task(f'standardize/{name}', functools.partial(task_standardize, name), [name], [name]))
+        if name in rule_tables['consistency']:
+            tasks.append(pipeline_task(f'consistency/{name}', functools.partial(task_consistency, name),
+                                       [name], [name, f'consistency_issues/{name}']))
+    
+    tasks += [
+        pipeline_task('outliers', task_outliers, list(OUTLIER_COLUMNS), ['outliers_report', 'rule_results/outlier']),
+        pipeline_task('validation', task_validation, rule_tables['format'], ['contact_issues', 'rule_results/format']),
+        pipeline_task('rules', task_rules, list(FILES), ['rule_results/checks'])
+    ]
+    
+    reports = [output for task in tasks for output in task['outputs'] if '/' in output and 'keys/' not in output]
+    tasks += [
+        pipeline_task('report', task_report, list(FILES) + reports + ['integrity_issues', 'outliers_report'],
+                      ['summary_report']),
+        pipeline_task('save', task_save, list(FILES))
+    ]
+    return tasks
+
+def task_dependencies(tasks):
+    """Các tác vụ mà mỗi tác vụ phải chờ, suy ra từ đầu vào/đầu ra khai báo
+    
+    Phụ thuộc luôn trỏ về tác vụ khai báo trước nên thứ tự khai báo là một thứ tự topo.
+    """
+    dependencies = {}
+    last_writer = {}
+    readers = {}
+    for task in tasks:
+        if task['name'] in dependencies:
+            raise ValueError(f"Tác vụ bị khai báo trùng tên: {task['name']}")
+        waits = set()
+        for artifact in task['inputs']:
+            if artifact not in last_writer:
+                raise ValueError(f"Tác vụ {task['name']} cần '{artifact}' nhưng chưa có tác vụ nào tạo ra")
+            waits.add(last_writer[artifact])
+        for artifact in task['outputs']:
+            if artifact in last_writer:
+                waits.add(last_writer[artifact])
+            waits.update(readers.get(artifact, []))
+        waits.discard(task['name'])
+        dependencies[task['name']] = sorted(waits)
+        
+        for artifact in task['inputs']:
+            readers.setdefault(artifact, []).append(task['name'])
+        for artifact in task['outputs']:
+            last_writer[artifact] = task['name']
+            readers[artifact] = []
+    return dependencies
+
+def run_task_graph(tasks, options, workers=4):
+    """Chạy các tác vụ trên thread pool `workers` luồng, tác vụ chạy ngay khi các phụ thuộc xong
+    
+    Mỗi tác vụ nhận options có thêm options['out'], một io.StringIO riêng để ghi output; output
+    được in thành một khối khi tác vụ kết thúc nên không bị xen lẫn giữa các luồng.
+    Trả về (giá trị các đầu ra, timeline, {tác vụ: output}), timeline gồm thời điểm bắt đầu/kết
+    thúc (giây, tính từ lúc bắt đầu), CPU và luồng của từng tác vụ.
+    """
+    dependencies = task_dependencies(tasks)
+    by_name = {task['name']: task for task in tasks}
+    order = {task['name']: i for i, task in enumerate(tasks)}
+    waiting = {name: set(waits) for name, waits in dependencies.items()}
+    dependents = {name: [] for name in by_name}
+    for name, waits in dependencies.items():
+        for dependency in waits:
+            dependents[dependency].append(name)
+    
+    state = {}
+    timeline = []
+    task_outputs = {}
+    graph_start = time.perf_counter()
+    
+    def run(task, inputs):
+        out = io.StringIO()
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        outputs = task['fn'](inputs, {**options, 'out': out}) or {}
+        return outputs, {
+            'step': task['name'],
+            'worker': threading.current_thread().name,
+            'start_s': round(start - graph_start, 4),
+            'end_s': round(time.perf_counter() - graph_start, 4),
+            'cpu_s': round(time.thread_time() - cpu_start, 4)
+        }, out.getvalue()
+    
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dag') as executor:
+        ready = [name for name in by_name if not waiting[name]]
+        running = {}
+        while ready or running:
+            for name in ready:
+                task = by_name[name]
+                running[executor.submit(run, task, {a: state[a] for a in task['inputs']})] = name
+            ready = []
+            
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in sorted(finished, key=lambda f: order[running[f]]):
+                name = running.pop(future)
+                outputs, entry, task_outputs[name] = future.result()
+                missing = [a for a in by_name[name]['outputs'] if a not in outputs]
+                if missing:
+                    raise ValueError(f"Tác vụ {name} không tạo ra: {missing}")
+                state.update(outputs)
+                entry['wall_s'] = round(entry['end_s'] - entry['start_s'], 4)
+                timeline.append(entry)
+                print(f"\n>>> [{name}] {entry['wall_s']:.2f}s ({entry['worker']})\n{task_outputs[name]}", end='')
+                
+                for dependent in dependents[name]:
+                    waiting[dependent].discard(name)
+                    if not waiting[dependent]:
+                        ready.append(dependent)
+            ready.sort(key=order.get)
+    
+    return state, timeline, task_outputs
+
+def critical_path(timeline, dependencies):
+    """Đường găng: chuỗi tác vụ phụ thuộc nhau có tổng thời gian lớn nhất, trả về (giây, [tác vụ])"""
+    durations = {entry['step']: entry['wall_s'] for entry in timeline}
+    finish = {}
+    previous = {}
+    for name, waits in dependencies.items():
+        before = max(waits, key=lambda dep: finish[dep], default=None)
+        finish[name] = durations.get(name, 0.0) + (finish[before] if before else 0.0)
+        previous[name] = before
+    
+    if not finish:
+        return 0.0, []
+    name = max(finish, key=finish.get)
+    length = finish[name]
+    path = []
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+    return round(length, 4), path[::-1]
+
+def summarize_timeline(timeline, dependencies, workers):
+    """Tóm tắt timeline: thời gian thực, tổng thời gian các tác vụ và đường găng"""
+    length, path = critical_path(timeline, dependencies)
+    return {
+        'workers': workers,
+        'wall_s': max((entry['end_s'] for entry in timeline), default=0.0),
+        'sum_s': round(sum(entry['wall_s'] for entry in timeline), 4),
+        'critical_path_s': length,
+        'critical_path': path
+    }
+
+def print_timeline(timeline, summary, width=TIMELINE_WIDTH):
+    """In timeline của các tác vụ (kèm biểu đồ Gantt dạng ký tự) và đường găng"""
+    print("\n" + "="*80)
+    print(f"TIMELINE THỰC THI ({summary['workers']} LUỒNG)")
+    print("="*80)
+    
+    scale = width / max(summary['wall_s'], 1e-9)
+    timeline_df = pd.DataFrame([
+        {
+            'Tác vụ': entry['step'],
+            'Luồng': entry['worker'],
+            'Bắt đầu (s)': entry['start_s'],
+            'Thời gian (s)': entry['wall_s'],
+            'Biểu đồ': (' ' * int(entry['start_s'] * scale)
+                        + '█' * max(1, int(entry['end_s'] * scale) - int(entry['start_s'] * scale))).ljust(width)
+        }
+        for entry in sorted(timeline, key=lambda e: e['start_s'])
+    ])
+    print(timeline_df.to_string(index=False))
+    
+    print(f"\nThời gian thực: {summary['wall_s']:.2f}s")
+    print(f"Tổng thời gian các tác vụ: {summary['sum_s']:.2f}s")
+    print(f"Đường găng: {summary['critical_path_s']:.2f}s ({' → '.join(summary['critical_path'])})")
+
+def run_dag_pipeline(workers=4, output_dir='cleaned_data/', inplace=INPLACE_MODE, output_format=OUTPUT_FORMAT,
+                     profile_trace=PROFILE_TRACE_FILE):
+    """Quy trình preprocessing chạy theo đồ thị phụ thuộc giữa các bảng (xem build_task_graph)
+    
+    Các nhánh độc lập chạy đồng thời trên `workers` luồng nên thời gian thực tiến gần
+    thời gian của đường găng thay vì tổng thời gian các bước. Kết quả giống chế độ tuần tự.
+    Timeline được in ra và ghi vào mục 'timeline'/'profile' của báo cáo chất lượng dữ liệu.
+    """
+    print("="*80)
+    print(f"BẮT ĐẦU QUY TRÌNH PREPROCESSING (ĐỒ THỊ PHỤ THUỘC, {workers} LUỒNG)")
+    print("="*80)
+    
+    tasks = build_task_graph()
+    options = {'inplace': inplace, 'parsed_years': {}, 'output_dir': output_dir, 'output_format': output_format}
+    state, timeline, _ = run_task_graph(tasks, options, workers=workers)
+    
+    summary = summarize_timeline(timeline, task_dependencies(tasks), workers)
+    print_timeline(timeline, summary)
+    report = state.get('summary_report')
+    if report is not None:
+        report['timeline'] = summary
+    save_profile(timeline, report, trace_file=profile_trace)
+    
+    print("\n" + "="*80)
+    print("HOÀN TẤT QUY TRÌNH PREPROCESSING (ĐỒ THỊ PHỤ THUỘC)!")
+    print("="*80)
+    
+    return {name: state[name] for name in FILES if name in state}
+
+# ============================================================================
+# HÀM CHÍNH - CHẠY TẤT CẢ CÁC BƯỚC
+# ============================================================================
+
+def main(streaming=STREAMING_MODE, chunksize=CHUNK_SIZE, inplace=INPLACE_MODE, memory_report=MEMORY_REPORT,
+         checkpoints=USE_CHECKPOINTS, output_format=OUTPUT_FORMAT, profile_trace=PROFILE_TRACE_FILE,
+         workers=SHARD_WORKERS, engine=ENGINE, dag_workers=DAG_WORKERS):
+    """Hàm chính thực hiện toàn bộ quy trình preprocessing
+    
+    streaming=True: xử lý medical_records theo chunk (xem run_streaming_pipeline)
+    workers > 1: làm sạch medical_records song song theo shard patient_id (xem run_sharded_pipeline)
+    engine='duckdb': xử lý medical_records theo luồng bằng DuckDB - làm sạch medical_records ngoài
+    bộ nhớ bằng DuckDB trong quy trình streaming
+    dag_workers > 0: chạy các bước theo đồ thị phụ thuộc giữa các bảng, các nhánh độc lập chạy
+    đồng thời trên dag_workers luồng (xem run_dag_pipeline)
+    inplace=True: các bước làm sạch sửa trực tiếp trên bảng, không tạo bản sao
+    memory_report=True: ghi lại bộ nhớ sau từng bước vào báo cáo
+    checkpoints=True: lưu kết quả từng bước và chạy tiếp từ checkpoint hợp lệ cuối cùng
+    output_format: định dạng lưu dữ liệu đã làm sạch ('csv', 'parquet', 'arrow')
+    profile_trace: file JSON-lines để nối thêm thời gian/bộ nhớ từng bước (thời gian luôn
+    được ghi vào báo cáo chất lượng dữ liệu)
+    """
+    if streaming or engine != 'pandas':
+        return run_streaming_pipeline(chunksize=chunksize, inplace=inplace, output_format=output_format,
+                                      engine=engine, profile_trace=profile_trace)
+    if workers > 1:
+        return run_sharded_pipeline(workers=workers, inplace=inplace, output_format=output_format,
+                                    profile_trace=profile_trace)
+    if dag_workers > 0:
+        if checkpoints or memory_report:
+            print("⚠ Chế độ đồ thị phụ thuộc không hỗ trợ checkpoint và báo cáo bộ nhớ theo bước, bỏ qua")
+        return run_dag_pipeline(workers=dag_workers, inplace=inplace, output_format=output_format,
+                                profile_trace=profile_trace)
+    
+    memory_log = start_memory_accounting() if memory_report else None
+    profile_log = []
+    options = {'inplace': inplace, 'memory_log': memory_log, 'parsed_years': {}}
+    
+    print("="*80)
+    print("BẮT ĐẦU QUY TRÌNH PREPROCESSING DỮ LIỆU Y TẾ")
+    print("="*80)
+    
+    data, reports, done = None, {}, 0
+    if checkpoints:
+        keys = step_fingerprints()
+        done, data, reports = find_resume_point(keys)
+        if done > 0:
+            print(f"\n✓ Dùng lại checkpoint đến bước '{PIPELINE_STEPS[done - 1][0]}' ({done}/{len(PIPELINE_STEPS)} bước)")
+    
+    for index, (name, step_fn, _, modifies_data) in enumerate(PIPELINE_STEPS):
+        if index < done:
+            continue
+        data = run_profiled_step(profile_log, name, step_fn, data, reports, options)
+        record_memory(memory_log, name, data)
+        if checkpoints:
+            save_checkpoint(index, name, keys[index], data if modifies_data else None, reports)
     
     # Bước 11: Lưu dữ liệu
     print("\n>>> BƯỚC 11: LƯU DỮ LIỆU ĐÃ PREPROCESSING")
-    save_cleaned_data(data)
+    run_profiled_step(profile_log, 'save', save_cleaned_data, data, output_format=output_format)
+    print_memory_report(memory_log)
+    print_profile_report(profile_log)
+    save_profile(profile_log, reports.get('summary_report'), trace_file=profile_trace)
     
     print("\n" + "="*80)
     print("HOÀN TẤT QUY TRÌNH PREPROCESSING!")
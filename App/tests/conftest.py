@@ -0,0 +1,20 @@
+"""Cấu hình chung cho các test: thêm thư mục App vào sys.path và thư mục làm việc tạm có dữ liệu mẫu"""
+
+import os
+import shutil
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(APP_DIR, 'tests', 'fixtures')
+
+sys.path.insert(0, APP_DIR)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Thư mục làm việc tạm chứa bản sao data/ của bộ dữ liệu mẫu (tests/fixtures/data)"""
+    shutil.copytree(os.path.join(FIXTURES_DIR, 'data'), tmp_path / 'data')
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,102 @@
+"""Nạp bổ sung hồ sơ khám: loại record_id đã có trong kho, ghi file phần mới cho Parquet/Arrow, chỉ mục khóa"""
+
+import os
+
+import pandas as pd
+import pytest
+
+import append_medical_records as append
+import export_query_result
+import preprocessing_healthcare_data as prep
+
+NEW_IDS = ['HS9000001', 'HS9000002', 'HS9000003']
+
+
+def prepare_store(output_format='csv'):
+    prep.main(output_format=output_format)
+    export_query_result.main()
+    return prep.find_cleaned_table('medical_records', 'cleaned_data/')[1]
+
+
+def write_delta(path='delta.csv'):
+    """5 hồ sơ đã có trong kho, 3 hồ sơ mới và một dòng lặp lại của hồ sơ mới đầu tiên"""
+    records = prep.decode_id_columns(prep.read_cleaned_table('medical_records', 'cleaned_data/')[0].head(8))
+    records['record_id'] = list(records['record_id'][:5]) + NEW_IDS
+    delta = pd.concat([records, records.iloc[[5]]], ignore_index=True)
+    delta.to_csv(path, index=False, encoding='utf-8-sig')
+    return path
+
+
+def result_lines():
+    with open('result.csv', encoding='utf-8-sig') as f:
+        return f.read().splitlines()
+
+
+def store_ids():
+    records, _ = prep.read_cleaned_table('medical_records', 'cleaned_data/', columns=['record_id'])
+    return prep.decode_id_columns(records)['record_id'].tolist()
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'parquet', 'arrow'])
+def test_append_adds_only_new_records(workdir, output_format):
+    store_path = prepare_store(output_format)
+    ids_before = store_ids()
+    result_before = result_lines()
+    delta = write_delta()
+    with open(store_path, 'rb') as f:
+        store_bytes = f.read()
+    
+    stats = append.append_medical_records(delta)
+    
+    assert stats['duplicate_keys'] == 6
+    assert stats['rows_out'] == 3
+    assert store_ids() == ids_before + NEW_IDS
+    assert len(result_lines()) == len(result_before) + 3
+    assert result_lines()[:len(result_before)] == result_before
+    if output_format != 'csv':
+        # File chính không bị ghi lại, các dòng mới nằm trong một file phần
+        with open(store_path, 'rb') as f:
+            assert f.read() == store_bytes
+        assert len(prep.cleaned_table_parts(store_path)) == 2
+    
+    # Nạp lại cùng file: mọi record_id đã có trong kho (chỉ mục đọc từ đĩa)
+    stats = append.append_medical_records(delta)
+    assert stats['duplicate_keys'] == 9
+    assert stats['rows_out'] == 0
+    assert store_ids() == ids_before + NEW_IDS
+
+
+def test_rewriting_the_table_drops_old_parts(workdir):
+    store_path = prepare_store('parquet')
+    append.append_medical_records(write_delta())
+    assert len(prep.cleaned_table_parts(store_path)) == 2
+    
+    prep.main(output_format='parquet')
+    assert prep.cleaned_table_parts(store_path) == [store_path]
+    assert not set(NEW_IDS) & set(store_ids())
+
+
+def test_key_index_is_rebuilt_when_the_store_changes_in_place(workdir, capsys):
+    store_path = prepare_store('csv')
+    append.save_key_index(append.load_key_index(store_path), store_path)
+    append.load_key_index(store_path)
+    assert 'Đã đọc chỉ mục' in capsys.readouterr().out
+    
+    # Đổi record_id của dòng cuối: cùng kích thước, giữ nguyên thời điểm sửa
+    stat = os.stat(store_path)
+    with open(store_path, 'rb') as f:
+        content = f.read()
+    last_id = content.rstrip(b'\r\n').rsplit(b'\n', 1)[1].split(b',', 1)[0]
+    changed_id = b'HS' + b'9' * (len(last_id) - 2)
+    position = content.rindex(last_id)
+    with open(store_path, 'r+b') as f:
+        f.seek(position)
+        f.write(changed_id)
+    os.utime(store_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.path.getsize(store_path) == stat.st_size
+    
+    key_index = append.load_key_index(store_path)
+    assert 'dựng lại chỉ mục' in capsys.readouterr().out
+    ids = pd.Series([last_id.decode(), changed_id.decode()], name='record_id', dtype='str')
+    assert prep.key_set_contains(key_index, prep.encode_id_columns(ids.to_frame())['record_id']).tolist() == \
+        [False, True]
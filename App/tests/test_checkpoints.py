@@ -0,0 +1,84 @@
+"""Checkpoint theo nội dung: khóa đổi khi đầu vào/mã nguồn/hằng cấu hình đổi, bảng lưu dạng Arrow IPC"""
+
+import os
+
+import pandas as pd
+
+import preprocessing_healthcare_data as prep
+from test_golden_output import CLEANED_FILES, GOLDEN_DIR, read_bytes
+
+STEP_NAMES = [name for name, _, _, _ in prep.PIPELINE_STEPS]
+
+
+def first_changed_step(before, after):
+    changed = [name for name, old, new in zip(STEP_NAMES, before, after) if old != new]
+    # Khóa mỗi bước gồm khóa bước trước nên mọi bước sau bước đầu tiên bị đổi cũng đổi
+    assert changed == STEP_NAMES[STEP_NAMES.index(changed[0]):] if changed else True
+    return changed[0] if changed else None
+
+
+def test_constants_invalidate_from_the_step_that_reads_them(monkeypatch):
+    keys = prep.step_fingerprints()
+    assert prep.step_fingerprints() == keys
+    
+    with monkeypatch.context() as m:
+        # phone_validity đọc PHONE_PATTERN và nằm trong DATA_RULES, bảng luật mà bước consistency dùng
+        m.setattr(prep, 'PHONE_PATTERN', prep.re.compile(r'^\+84\d{9}$'))
+        assert first_changed_step(keys, prep.step_fingerprints()) == 'consistency'
+    with monkeypatch.context() as m:
+        m.setitem(prep.DATA_RULES['medical_records'][0], 'tolerance', 500)
+        assert first_changed_step(keys, prep.step_fingerprints()) == 'consistency'
+    with monkeypatch.context() as m:
+        m.setitem(prep.OUTLIER_COLUMNS, 'patients', [])
+        assert first_changed_step(keys, prep.step_fingerprints()) == 'outliers'
+    with monkeypatch.context() as m:
+        m.setattr(prep.profile_table, '__defaults__', (prep.PROFILE_TOP_K + 5,))
+        assert first_changed_step(keys, prep.step_fingerprints()) == 'missing'
+    with monkeypatch.context() as m:
+        m.setattr(prep, 'NORMALIZE_WHITESPACE', True)
+        assert first_changed_step(keys, prep.step_fingerprints()) == 'standardize'
+    
+    assert prep.step_fingerprints() == keys
+
+
+def test_input_change_invalidates_every_step(workdir):
+    keys = prep.step_fingerprints()
+    with open(os.path.join('data', prep.FILES['doctors']), 'a', encoding='utf-8') as f:
+        f.write('\n')
+    assert first_changed_step(keys, prep.step_fingerprints()) == STEP_NAMES[0]
+
+
+def test_checkpoint_round_trip_keeps_dtypes_and_id_formats(workdir):
+    data = prep.standardize_strings(prep.standardize_dates(prep.load_data()))
+    data['medical_records'] = data['medical_records'].iloc[::3]
+    prep.save_checkpoint(0, 'load', 'k', data, {'note': 1}, checkpoint_dir='ckpt')
+    
+    checkpoint = prep.load_checkpoint(0, 'load', 'k', checkpoint_dir='ckpt')
+    assert checkpoint['reports'] == {'note': 1}
+    assert all(filename.endswith('.arrow') for filename in checkpoint['tables'].values())
+    
+    loaded = prep.load_checkpoint_data(0, 'load', 'k', checkpoint['tables'], checkpoint_dir='ckpt')
+    for name, df in data.items():
+        pd.testing.assert_frame_equal(loaded[name], df)
+        assert prep.id_key_formats(loaded[name]) == prep.id_key_formats(df)
+
+
+def test_resume_from_checkpoints_matches_golden(workdir, capsys):
+    prep.main(checkpoints=True)
+    capsys.readouterr()
+    
+    prep.main(checkpoints=True)
+    assert f"({len(STEP_NAMES)}/{len(STEP_NAMES)} bước)" in capsys.readouterr().out
+    for filename in CLEANED_FILES:
+        assert read_bytes(workdir / 'cleaned_data' / filename) == read_bytes(os.path.join(GOLDEN_DIR, filename)), filename
+
+
+def test_broken_checkpoint_falls_back_to_an_earlier_step(workdir):
+    prep.main(checkpoints=True)
+    keys = prep.step_fingerprints()
+    last = len(STEP_NAMES) - 1
+    os.remove(os.path.join(prep.checkpoint_path(last, STEP_NAMES[last], keys[last]), 'checkpoint.pkl'))
+    
+    done, data, _ = prep.find_resume_point(keys)
+    assert done == last
+    assert set(data) == set(prep.FILES)
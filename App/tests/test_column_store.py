@@ -0,0 +1,97 @@
+"""Kho cột (.npy + manifest.json): mặc định tắt, ghi mới/ghi nối không để lại dữ liệu dở khi có lỗi"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import preprocessing_healthcare_data as prep
+
+
+def chunks_of(n_chunks, start=0, fail_after=None):
+    for i in range(start, start + n_chunks):
+        if i == fail_after:
+            raise RuntimeError('lỗi giữa chừng')
+        yield pd.DataFrame({
+            'tuoi': pd.Series([i, None], dtype='Int32'),
+            'nhom': pd.Categorical([f'n{i}', 'chung']),
+            'ngay': pd.to_datetime(['2024-01-01', None]),
+            'chi_phi': np.array([1.5 * i, 2.0])
+        })
+
+
+def write(output_dir, chunks, append=False):
+    for _ in prep.with_column_store(chunks, 'bang', str(output_dir), append=append):
+        pass
+
+
+def store_snapshot(output_dir):
+    store_dir = prep.column_store_path(str(output_dir))
+    files = {}
+    for root, _, names in os.walk(store_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, store_dir)] = f.read()
+    return files
+
+
+@pytest.fixture
+def column_store(monkeypatch):
+    monkeypatch.setattr(prep, 'WRITE_COLUMN_STORE', True)
+
+
+def test_column_store_is_off_by_default(workdir):
+    assert prep.WRITE_COLUMN_STORE is False
+    prep.main()
+    assert not os.path.exists(prep.column_store_path('cleaned_data/'))
+
+
+def test_write_and_append_round_trip(tmp_path, column_store):
+    write(tmp_path, chunks_of(2))
+    write(tmp_path, chunks_of(2, start=2), append=True)
+    
+    expected = pd.concat(list(chunks_of(4)), ignore_index=True)
+    loaded = prep.load_column_store('bang', str(tmp_path))
+    assert loaded['tuoi'].tolist() == expected['tuoi'].tolist()
+    assert loaded['nhom'].astype(str).tolist() == expected['nhom'].astype(str).tolist()
+    assert loaded['ngay'].tolist() == expected['ngay'].tolist()
+    assert loaded['chi_phi'].tolist() == expected['chi_phi'].tolist()
+    assert not any(name.startswith('.') for name in os.listdir(prep.column_store_path(str(tmp_path))))
+
+
+def test_failed_rewrite_keeps_the_previous_table(tmp_path, column_store):
+    write(tmp_path, chunks_of(2))
+    before = store_snapshot(tmp_path)
+    
+    with pytest.raises(RuntimeError):
+        write(tmp_path, chunks_of(3, fail_after=2))
+    assert store_snapshot(tmp_path) == before
+
+
+def test_failed_append_is_rolled_back(tmp_path, column_store):
+    write(tmp_path, chunks_of(2))
+    before = store_snapshot(tmp_path)
+    
+    # Chunk 2 tạo thêm giá trị thiếu của cột chi phí (file mặt nạ mới) trước khi lỗi
+    def chunks():
+        chunk = next(chunks_of(1, start=2))
+        chunk['chi_phi'] = pd.array([None, 1.0], dtype='Float64')
+        yield chunk
+        raise RuntimeError('lỗi giữa chừng')
+    
+    with pytest.raises(RuntimeError):
+        write(tmp_path, chunks(), append=True)
+    assert store_snapshot(tmp_path) == before
+    assert prep.load_column_store('bang', str(tmp_path))['tuoi'].isna().tolist() == [False, True, False, True]
+
+
+def test_consumer_stopping_early_leaves_no_files(tmp_path, column_store):
+    stream = prep.with_column_store(chunks_of(3), 'bang', str(tmp_path))
+    next(stream)
+    stream.close()
+    
+    store_dir = prep.column_store_path(str(tmp_path))
+    assert os.listdir(store_dir) == []
+    assert prep.read_column_store_manifest(str(tmp_path)) == {'tables': {}}
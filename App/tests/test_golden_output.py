@@ -0,0 +1,83 @@
+"""Kết quả làm sạch và result.csv của mọi chế độ chạy phải giống hệt kết quả của phiên bản gốc
+
+tests/fixtures/golden được tạo bằng preprocessing_healthcare_data.py và export_query_result.py
+phiên bản gốc (trước các tối ưu) trên tests/fixtures/data.
+"""
+
+import os
+
+import pytest
+
+import export_query_result
+import preprocessing_healthcare_data as prep
+from conftest import FIXTURES_DIR
+
+GOLDEN_DIR = os.path.join(FIXTURES_DIR, 'golden')
+CLEANED_FILES = [f'{name}_cleaned.csv' for name in prep.FILES]
+
+MODES = {
+    'sequential': {},
+    'streaming': {'streaming': True, 'chunksize': 100},
+    'sharded': {'workers': 2},
+    'dag': {'dag_workers': 3},
+    'inplace': {'inplace': True},
+    'duckdb': {'engine': 'duckdb', 'chunksize': 100},
+}
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('mode', list(MODES))
+def test_outputs_match_golden(workdir, mode):
+    if mode == 'duckdb' and not prep.HAS_DUCKDB:
+        pytest.skip('duckdb chưa được cài')
+    prep.main(**MODES[mode])
+    export_query_result.main()
+    
+    for filename in CLEANED_FILES:
+        assert read_bytes(workdir / 'cleaned_data' / filename) == read_bytes(os.path.join(GOLDEN_DIR, filename)), filename
+    assert read_bytes(workdir / 'result.csv') == read_bytes(os.path.join(GOLDEN_DIR, 'result.csv'))
+
+
+def test_fill_missing_defaults_changes_output(workdir, monkeypatch):
+    """Bật FILL_MISSING_DEFAULTS điền các cột mô tả, khác với kết quả gốc"""
+    monkeypatch.setattr(prep, 'FILL_MISSING_DEFAULTS', True)
+    data = prep.main()
+    
+    assert not data['patients']['tien_su_benh'].isnull().any()
+    assert not data['medical_records']['ket_qua_xet_nghiem'].isnull().any()
+    assert read_bytes(workdir / 'cleaned_data' / 'patients_cleaned.csv') != \
+        read_bytes(os.path.join(GOLDEN_DIR, 'patients_cleaned.csv'))
+
+
+def test_normalize_whitespace_changes_output(workdir, monkeypatch):
+    """Bật NORMALIZE_WHITESPACE gộp khoảng trắng thừa, khác với kết quả gốc"""
+    monkeypatch.setattr(prep, 'NORMALIZE_WHITESPACE', True)
+    data = prep.main()
+    
+    names = data['patients']['ho_ten'].astype(str)
+    assert not names.str.contains('  ').any()
+    assert (names == names.str.strip()).all()
+    assert read_bytes(workdir / 'cleaned_data' / 'patients_cleaned.csv') != \
+        read_bytes(os.path.join(GOLDEN_DIR, 'patients_cleaned.csv'))
+
+
+def test_duckdb_keeps_wider_types_when_the_cast_is_unsafe(workdir):
+    """Như read_table: chi phí vượt phạm vi hoặc không nguyên giữ kiểu rộng hơn thay vì thành NULL"""
+    if not prep.HAS_DUCKDB:
+        pytest.skip('duckdb chưa được cài')
+    path = workdir / 'data' / prep.FILES['medical_records']
+    lines = path.read_text(encoding='utf-8-sig').splitlines()
+    header = lines[0].split(',')
+    rows = [line.split(',') for line in lines[1:]]
+    rows[0][header.index('chi_phi_thuoc')] = '12.5'
+    path.write_text('\n'.join([lines[0]] + [','.join(row) for row in rows]) + '\n', encoding='utf-8-sig')
+    
+    prep.main(engine='duckdb', chunksize=100_000)
+    duckdb_output = read_bytes(workdir / 'cleaned_data' / 'medical_records_cleaned.csv')
+    prep.main(streaming=True, chunksize=100_000)
+    assert duckdb_output == read_bytes(workdir / 'cleaned_data' / 'medical_records_cleaned.csv')
+    assert b'12.5' in duckdb_output and b'99999999999' in duckdb_output
@@ -0,0 +1,60 @@
+"""Đo thời gian, số dòng và bộ nhớ từng bước ở các chế độ streaming, song song và DuckDB"""
+
+import json
+
+import pytest
+
+import preprocessing_healthcare_data as prep
+
+DIMENSION_STEPS = ['load', 'clean_dimensions', 'medical_records']
+FINAL_STEPS = ['standardize', 'outliers', 'validation', 'report', 'save']
+DUCKDB_STEPS = ['medical_records/duckdb_load', 'medical_records/duckdb_deduplicate',
+                'medical_records/duckdb_foreign_keys', 'medical_records/duckdb_standardize',
+                'medical_records/duckdb_consistency', 'medical_records/duckdb_write']
+
+
+def run_profile(**kwargs):
+    prep.main(profile_trace='trace.jsonl', **kwargs)
+    with open(prep.REPORT_FILE, encoding='utf-8') as f:
+        profile = json.load(f)['profile']
+    with open('trace.jsonl', encoding='utf-8') as f:
+        trace = [json.loads(line) for line in f]
+    assert [entry['step'] for entry in trace] == [entry['step'] for entry in profile]
+    for entry in profile:
+        assert entry['wall_s'] >= 0 and entry['cpu_s'] >= 0
+        assert 'peak_rss_mb' in entry and 'traced_peak_mb' in entry
+    return profile
+
+
+@pytest.mark.parametrize('kwargs, sub_steps', [
+    ({'streaming': True, 'chunksize': 500}, []),
+    ({'workers': 2}, ['medical_records/shard_1', 'medical_records/shard_2']),
+    ({'engine': 'duckdb'}, DUCKDB_STEPS)
+], ids=['streaming', 'sharded', 'duckdb'])
+def test_pipelines_report_step_profile(workdir, kwargs, sub_steps):
+    profile = run_profile(**kwargs)
+    
+    assert [entry['step'] for entry in profile] == DIMENSION_STEPS + sub_steps + FINAL_STEPS
+    entries = {entry['step']: entry for entry in profile}
+    records = entries['medical_records']
+    cleaned, _ = prep.read_cleaned_table('medical_records', 'cleaned_data/', columns=['record_id'])
+    assert records['rows_in'] > records['rows_out'] == len(cleaned)
+    
+    if sub_steps:
+        # Các phần con cộng lại đúng số dòng của bước medical_records
+        shards = [entries[step] for step in sub_steps if 'shard' in step]
+        if shards:
+            assert sum(entry['rows_out'] for entry in shards) == records['rows_out']
+        else:
+            assert entries[DUCKDB_STEPS[0]]['rows_out'] == records['rows_in']
+            assert entries[DUCKDB_STEPS[-1]]['rows_out'] == records['rows_out']
+
+
+def test_sub_steps_are_not_added_to_the_total(capsys):
+    prep.print_profile_report([
+        {'step': 'load', 'wall_s': 1.0, 'cpu_s': 1.0, 'rows_in': 0, 'rows_out': 5, 'peak_rss_mb': None},
+        {'step': 'medical_records', 'wall_s': 2.0, 'cpu_s': 2.0, 'rows_in': 5, 'rows_out': 4, 'peak_rss_mb': None},
+        {'step': 'medical_records/shard_1', 'wall_s': 1.5, 'cpu_s': 1.5, 'rows_in': 5, 'rows_out': 4,
+         'peak_rss_mb': None}
+    ])
+    assert 'Tổng thời gian: 3.00s' in capsys.readouterr().out
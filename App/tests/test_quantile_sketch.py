@@ -0,0 +1,78 @@
+"""Quantile sketch (KLL) dùng cho ngoại lai ở chế độ streaming/shard và quantile chính xác cho bảng trong bộ nhớ"""
+
+import numpy as np
+import pandas as pd
+
+import preprocessing_healthcare_data as prep
+
+EPSILON = 0.01
+QUANTILES = [0.25, 0.5, 0.75]
+
+
+def rank_errors(sketch, values, qs):
+    """Sai số hạng (theo tỉ lệ số giá trị) của các quantile ước lượng từ sketch"""
+    ordered = np.sort(values)
+    estimates = prep.sketch_quantiles(sketch, qs)
+    return np.abs(np.searchsorted(ordered, estimates) / len(values) - np.asarray(qs))
+
+
+def sketch_of(values, n_batches=1, seed=0):
+    sketch = prep.new_quantile_sketch(EPSILON, seed=seed)
+    for batch in np.array_split(values, n_batches):
+        prep.sketch_update(sketch, batch)
+    return sketch
+
+
+def test_exact_until_compaction():
+    values = np.random.default_rng(0).normal(size=200)
+    sketch = sketch_of(values)
+    assert sketch['n'] == 200
+    assert np.allclose(prep.sketch_quantiles(sketch, QUANTILES), pd.Series(values).quantile(QUANTILES))
+
+
+def test_level_capacities_shrink_geometrically():
+    sketch = sketch_of(np.random.default_rng(1).lognormal(10, 1, 200_000), n_batches=50)
+    k, levels = sketch['k'], sketch['levels']
+    
+    assert [prep.level_capacity(k, h, 4) for h in range(4)] == [int(np.ceil(k * (2 / 3) ** d)) for d in (3, 2, 1, 0)]
+    assert prep.level_capacity(k, 0, 40) == 2
+    assert all(len(items) <= prep.level_capacity(k, h, len(levels)) for h, items in enumerate(levels))
+    # Sức chứa tổng là cấp số nhân công bội 2/3 nên sketch giữ O(k) phần tử
+    assert sum(len(items) for items in levels) <= 3 * k + 2 * len(levels)
+    assert sum(len(items) * 2**h for h, items in enumerate(levels)) == sketch['n']
+
+
+def test_rank_error_within_epsilon():
+    values = np.random.default_rng(2).lognormal(10, 1, 200_000)
+    for seed in range(5):
+        sketch = sketch_of(np.random.default_rng(seed).permutation(values), n_batches=20, seed=seed)
+        assert rank_errors(sketch, values, QUANTILES).max() <= EPSILON
+        assert rank_errors(sketch, values, np.linspace(0.01, 0.99, 99)).max() <= 1.5 * EPSILON
+
+
+def test_merged_shards_keep_the_error_bound():
+    values = np.random.default_rng(3).exponential(1000, 200_000)
+    merged = prep.new_quantile_sketch(EPSILON)
+    for i, shard in enumerate(np.array_split(values, 8)):
+        prep.sketch_merge(merged, sketch_of(shard, n_batches=3, seed=i))
+    
+    assert merged['n'] == len(values)
+    assert all(len(items) <= prep.level_capacity(merged['k'], h, len(merged['levels']))
+               for h, items in enumerate(merged['levels']))
+    assert rank_errors(merged, values, QUANTILES).max() <= EPSILON
+    
+    lower, upper = prep.iqr_bounds(merged)
+    outside = int(((values < lower) | (values > upper)).sum())
+    assert abs(prep.sketch_count_outside(merged, lower, upper) - outside) <= 2 * EPSILON * len(values)
+
+
+def test_in_memory_tables_use_exact_quantiles():
+    ages = pd.Series(np.random.default_rng(4).integers(0, 100, 50_000), dtype='Int32')
+    ages.iloc[:50] = 150
+    data = {'patients': pd.DataFrame({'tuoi': ages})}
+    
+    rule_results = prep.evaluate_rules(data, groups=['outlier'])
+    result = rule_results['patients']['rules']['tuoi_outlier']
+    Q1, Q3 = ages.quantile(0.25), ages.quantile(0.75)
+    assert result['bounds'] == [Q1 - 1.5 * (Q3 - Q1), Q3 + 1.5 * (Q3 - Q1)]
+    assert result['violations'] == int(((ages < result['bounds'][0]) | (ages > result['bounds'][1])).sum())
@@ -0,0 +1,77 @@
+"""query_records: bộ lọc đẩy xuống khi đọc CSV/Parquet/Arrow cho cùng kết quả như lọc sau khi join"""
+
+import pandas as pd
+import pytest
+
+import append_medical_records as append
+import export_query_result as query
+import preprocessing_healthcare_data as prep
+from test_append_records import NEW_IDS, write_delta
+
+COLUMNS = ['patient_id', 'thanh_pho', 'loai_kham', 'ngay_kham', 'chan_doan']
+CITIES = ['Hà Nội', 'Đà Nẵng', 'Hải Phòng']
+FILTERS = {'thanh_pho': CITIES, 'ngay_kham': ('2022-01-01', '2023-12-31')}
+
+
+def filter_result(df):
+    """Lọc kết quả đầy đủ bằng pandas (tham chiếu cho bộ lọc đẩy xuống)"""
+    visit_dates = pd.to_datetime(df['ngay_kham'], errors='coerce')
+    mask = df['thanh_pho'].isin(CITIES) & visit_dates.between(pd.Timestamp('2022-01-01'), pd.Timestamp('2023-12-31'))
+    return df[mask.to_numpy(dtype=bool)].reset_index(drop=True)
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'parquet', 'arrow'])
+def test_filters_match_filtering_the_joined_result(workdir, output_format):
+    prep.main(output_format=output_format)
+    full = query.query_records(columns=COLUMNS, rename=False)
+    
+    filtered = query.query_records(columns=COLUMNS, rename=False, filters=FILTERS)
+    assert 0 < len(filtered) < len(full)
+    pd.testing.assert_frame_equal(filtered, filter_result(full))
+    
+    # Bộ lọc patient_id áp dụng cho cả hai bảng, tên cột sau khi đổi cũng dùng được
+    patient_id = full['patient_id'].iloc[0]
+    by_patient = query.query_records(columns=COLUMNS, filters={'id': patient_id})
+    assert len(by_patient) == (full['patient_id'] == patient_id).sum()
+    assert set(by_patient['id']) == {patient_id}
+
+
+def test_parquet_filters_are_passed_to_the_reader(workdir, monkeypatch):
+    prep.main(output_format='parquet')
+    calls = []
+    read_parquet = pd.read_parquet
+    
+    def recording_read_parquet(path, columns=None, filters=None, **kwargs):
+        calls.append((columns, filters))
+        return read_parquet(path, columns=columns, filters=filters, **kwargs)
+    
+    monkeypatch.setattr(prep.pd, 'read_parquet', recording_read_parquet)
+    query.query_records(columns=['patient_id', 'chan_doan'], filters=FILTERS)
+    
+    (patient_columns, patient_filters), (record_columns, record_filters) = calls
+    assert patient_filters == [('thanh_pho', 'in', CITIES)]
+    assert record_filters == [('ngay_kham', '>=', pd.Timestamp('2022-01-01')),
+                              ('ngay_kham', '<=', pd.Timestamp('2023-12-31'))]
+    # Chỉ đọc cột cần cho kết quả, khóa join và cột lọc
+    assert set(patient_columns) == {'patient_id', 'thanh_pho'}
+    assert set(record_columns) == {'patient_id', 'ngay_kham', 'chan_doan'}
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+def test_filters_apply_to_appended_parts(workdir, output_format):
+    prep.main(output_format=output_format)
+    append.append_medical_records(write_delta())
+    
+    full = query.query_records(columns=['record_id', *COLUMNS], rename=False)
+    assert set(NEW_IDS) <= set(full['record_id'])
+    filtered = query.query_records(columns=['record_id', *COLUMNS], rename=False, filters=FILTERS)
+    pd.testing.assert_frame_equal(filtered, filter_result(full))
+    
+    new_records = query.query_records(columns=['record_id'], filters={'record_id': NEW_IDS})
+    assert sorted(new_records['record_id']) == NEW_IDS
+
+
+def test_unknown_filter_column_is_rejected(workdir):
+    prep.main(output_format='parquet')
+    with pytest.raises(ValueError):
+        query.query_records(columns=COLUMNS, filters={'khong_co': 1})
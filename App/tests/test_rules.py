@@ -0,0 +1,89 @@
+"""Bộ luật DATA_RULES: bitmap vi phạm một lượt mỗi bảng, dùng lại cho kiểm tra nhất quán, ngoại lai và báo cáo"""
+
+import numpy as np
+import pandas as pd
+
+import preprocessing_healthcare_data as prep
+
+
+def sample_data():
+    patients = prep.encode_id_columns(pd.DataFrame({
+        'patient_id': pd.Series([f'BN{i:07d}' for i in range(1, 12)] + ['BN0000003'], dtype='str'),
+        'tuoi': pd.Series([30, 41, 25, 130, 52, 60, 33, 28, 47, 39, 90, 25], dtype='Int32'),
+        'ngay_sinh': pd.to_datetime([f'{pd.Timestamp.now().year - age}-06-01' for age in
+                                     [30, 41, 25, 50, 52, 60, 33, 28, 47, 39, 90, 25]]),
+        'email': pd.Series(['a@b.vn', 'sai-email', None] + ['x@y.com'] * 9, dtype='str'),
+    }))
+    medical_records = prep.encode_id_columns(pd.DataFrame({
+        'record_id': pd.Series(['KB01', 'KB02', 'KB03', 'KB04'], dtype='str'),
+        'patient_id': pd.Series(['BN0000001', 'BN0000002', 'BN0000099', 'BN0000004'], dtype='str'),
+        'chi_phi_kham': pd.Series([100_000, 200_000, -5, 150_000], dtype='Int32'),
+        'chi_phi_thuoc': pd.Series([50_000, 0, 10, 20_000], dtype='Int32'),
+        'tong_chi_phi': pd.Series([150_000, 200_500, 5, 100_000], dtype='Int32'),
+    }))
+    return {'patients': patients, 'medical_records': medical_records}
+
+
+def rule_mask(rule_results, name, rule_name):
+    return prep.violation_mask(rule_results[name]['rules'][rule_name], rule_results[name]['rows']).tolist()
+
+
+def test_violation_mask_round_trip():
+    for n in (0, 1, 7, 8, 9, 1001):
+        mask = np.random.default_rng(n).random(n) < 0.3
+        assert prep.violation_mask({'bitmap': np.packbits(mask)}, n).tolist() == mask.tolist()
+
+
+def test_rules_evaluate_to_bitmaps():
+    data = sample_data()
+    rule_results = prep.evaluate_rules(data)
+    
+    assert rule_mask(rule_results, 'patients', 'tuoi_range') == [False] * 3 + [True] + [False] * 8
+    assert rule_mask(rule_results, 'patients', 'patients_age') == [False] * 3 + [True] + [False] * 8
+    assert rule_mask(rule_results, 'patients', 'email_format') == [False, True, True] + [False] * 9
+    assert rule_mask(rule_results, 'patients', 'patient_id_unique') == [False] * 11 + [True]
+    assert rule_mask(rule_results, 'medical_records', 'medical_records_total') == [False, False, False, True]
+    assert rule_mask(rule_results, 'medical_records', 'chi_phi_kham_range') == [False, False, True, False]
+    assert rule_mask(rule_results, 'medical_records', 'patient_id_exists') == [False, False, True, False]
+    # Luật khóa ngoại tới bảng không có trong data bị bỏ qua
+    assert 'doctor_id_exists' not in rule_results['medical_records']['rules']
+    assert prep.rule_summary(rule_results)['patients']['tuoi_range'] == 1
+
+
+def test_consistency_and_outliers_return_rows():
+    data = sample_data()
+    rule_results = prep.evaluate_rules(data)
+    
+    issues = prep.check_data_consistency(data, rule_results=rule_results)
+    assert [name for name, _ in issues] == ['patients_age', 'medical_records_total']
+    pd.testing.assert_frame_equal(issues[0][1], data['patients'].iloc[[3]])
+    pd.testing.assert_frame_equal(issues[1][1], data['medical_records'].iloc[[3]])
+    
+    outliers_report = prep.detect_outliers(data, rule_results=rule_results)
+    ages = data['patients']['tuoi']
+    lower, upper = prep.exact_iqr_bounds(ages)
+    pd.testing.assert_frame_equal(outliers_report['patients_age'], data['patients'][(ages < lower) | (ages > upper)])
+
+
+def test_outliers_of_sketch_only_tables_are_not_returned():
+    sketch = prep.new_quantile_sketch()
+    prep.sketch_update(sketch, np.r_[np.arange(100), 10_000])
+    data = {'patients': sample_data()['patients']}
+    
+    outliers_report = prep.detect_outliers(data, sketches={'medical_records': {'chi_phi_kham': sketch}})
+    assert 'mr_chi_phi_kham' not in outliers_report
+    assert isinstance(outliers_report['patients_age'], pd.DataFrame)
+
+
+def test_pipeline_evaluates_rules_once_after_cleaning(workdir, monkeypatch):
+    calls = []
+    evaluate_rules = prep.evaluate_rules
+    
+    def counting_evaluate_rules(data, groups=None, **kwargs):
+        calls.append(groups)
+        return evaluate_rules(data, groups=groups, **kwargs)
+    
+    monkeypatch.setattr(prep, 'evaluate_rules', counting_evaluate_rules)
+    prep.main()
+    # Bước 7 trên dữ liệu trước khi sửa, bước 8 một lượt cho mọi luật (bước 9 và 10 dùng lại)
+    assert calls == [['consistency'], None]
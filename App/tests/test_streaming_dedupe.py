@@ -0,0 +1,85 @@
+"""Xóa trùng lặp giữa các chunk ở chế độ streaming: tập khóa dạng dãy đã sắp xếp và số dòng trùng trong báo cáo"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+import preprocessing_healthcare_data as prep
+
+
+def record_ids(values):
+    return prep.encode_id_columns(pd.DataFrame({'record_id': pd.Series(values, dtype='str')}))['record_id']
+
+
+def test_key_set_uses_surrogate_codes():
+    key_set = prep.key_set_add(prep.new_key_set(), record_ids(['KB0000001', 'KB0000005']))
+    
+    assert key_set['id_format'] == ('KB', 7)
+    assert np.issubdtype(key_set['runs'][0].dtype, np.integer)
+    assert prep.key_set_contains(key_set, record_ids(['KB0000005', 'KB0000002'])).tolist() == [True, False]
+    # Cùng khóa ở dạng chuỗi (chunk có mã không đúng dạng) vẫn được nhận ra
+    strings = pd.Series(['KB0000001', 'X-1', None], name='record_id', dtype='str')
+    assert prep.key_set_contains(key_set, strings).tolist() == [True, False, False]
+
+
+def test_key_set_switches_to_strings_and_tracks_missing():
+    key_set = prep.key_set_add(prep.new_key_set(), record_ids(['KB0000001', 'KB0000002']))
+    prep.key_set_add(key_set, pd.Series(['X-1', None], name='record_id', dtype='str'))
+    
+    assert key_set['id_format'] is None
+    assert prep.key_set_size(key_set) == 3
+    values = pd.Series(['KB0000002', 'X-1', None, 'X-2'], name='record_id', dtype='str')
+    assert prep.key_set_contains(key_set, values).tolist() == [True, True, True, False]
+
+
+def test_key_set_keeps_few_runs():
+    key_set = prep.new_key_set()
+    for start in range(0, 10_000, 100):
+        prep.key_set_add(key_set, record_ids([f'KB{i:07d}' for i in range(start, start + 100)]))
+    
+    assert prep.key_set_size(key_set) == 10_000
+    assert len(key_set['runs']) <= 2 * np.log2(100)
+    assert all((np.diff(run) > 0).all() for run in key_set['runs'])
+    assert prep.key_set_contains(key_set, record_ids(['KB0000000', 'KB0009999', 'KB0010000'])).tolist() == \
+        [True, True, False]
+
+
+def test_chunks_drop_keys_seen_in_earlier_chunks():
+    stats = prep.new_stream_stats()
+    seen = prep.new_key_set()
+    for values in (['KB0000001', 'KB0000002', 'KB0000002'], ['KB0000002', 'KB0000003', None, None]):
+        chunk = prep.encode_id_columns(pd.DataFrame({
+            'record_id': pd.Series(values, dtype='str'),
+            'ghi_chu': [str(i) for i in range(len(values))]
+        }))
+        prep.process_medical_records_chunk(chunk, {}, seen, stats)
+    
+    assert stats['duplicate_keys'] == 3
+    assert stats['rows_out'] == 4
+    assert stats['duplicate_rows_after'] == 0
+
+
+def test_duplicate_rows_after_without_key_column():
+    stats = prep.new_stream_stats()
+    seen = prep.new_key_set()
+    for values in (['a', 'b', 'b'], ['b', 'c']):
+        prep.process_medical_records_chunk(pd.DataFrame({'ghi_chu': values}), {}, seen, stats)
+    
+    # Dòng trùng trong cùng chunk bị xóa; dòng trùng với chunk trước được ghi và được đếm
+    assert stats['duplicate_rows'] == 1
+    assert stats['rows_out'] == 4
+    assert prep.stream_table_report(stats)['duplicate_rows'] == 1
+
+
+def test_streaming_report_matches_sequential(workdir):
+    prep.main()
+    with open(prep.REPORT_FILE, encoding='utf-8') as f:
+        sequential = json.load(f)['tables']['medical_records']
+    
+    prep.main(streaming=True, chunksize=100)
+    with open(prep.REPORT_FILE, encoding='utf-8') as f:
+        streaming = json.load(f)['tables']['medical_records']
+    
+    for key in ['total_rows', 'missing_values', 'duplicate_rows']:
+        assert streaming[key] == sequential[key], key
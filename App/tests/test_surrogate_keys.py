@@ -0,0 +1,115 @@
+"""Khóa thay thế của các cột mã ID: đổi/đổi ngược, dạng mã lưu kèm bảng và tra cứu khóa ngoại"""
+
+import functools
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import preprocessing_healthcare_data as prep
+from conftest import FIXTURES_DIR
+
+
+def id_series(values, name='patient_id'):
+    return pd.Series(values, name=name, dtype='str')
+
+
+def test_encode_decode_round_trip():
+    ids = id_series(['BN0000001', 'BN0000042', 'BN9999999', 'BN0000001'])
+    encoded, id_format = prep.encode_id_column(ids)
+    
+    assert id_format == ('BN', 7)
+    assert encoded.dtype == np.int32
+    assert encoded.tolist() == [1, 42, 9999999, 1]
+    
+    df = prep.set_id_key_formats(pd.DataFrame({'patient_id': encoded}), {'patient_id': id_format})
+    assert prep.is_surrogate_key(df['patient_id'])
+    assert prep.decode_id_column(df['patient_id']).tolist() == ids.tolist()
+    assert prep.decode_id_columns(df)['patient_id'].tolist() == ids.tolist()
+    assert prep.id_key_formats(prep.decode_id_columns(df)) == {}
+
+
+def test_columns_with_missing_or_malformed_ids_stay_strings():
+    for values in (['BN0000001', None], ['BN0000001', 'X-17'], ['BN0000001', 'BN00000012']):
+        ids = id_series(values)
+        encoded, id_format = prep.encode_id_column(ids)
+        assert id_format is None
+        assert encoded is ids
+
+
+def test_formats_travel_with_the_table():
+    df = prep.encode_id_columns(pd.DataFrame({
+        'record_id': id_series(['HS01', 'HS02', 'HS03'], 'record_id'),
+        'patient_id': id_series(['BN001', None, 'BN003']),
+        'ghi_chu': ['a', 'b', 'c']
+    }))
+    assert prep.id_key_formats(df) == {'record_id': ('HS', 2)}
+    
+    filtered = df[df['ghi_chu'] != 'b']
+    assert prep.decode_id_column(filtered['record_id']).tolist() == ['HS01', 'HS03']
+    for derived in (df.copy(), df[['record_id']], pickle.loads(pickle.dumps(df))):
+        assert prep.decode_id_column(derived['record_id']).tolist() == ['HS01', 'HS02', 'HS03']
+
+
+def test_encode_with_reference_formats():
+    df = pd.DataFrame({
+        'patient_id': id_series(['BN0000002', 'BN0000005']),
+        'doctor_id': id_series(['BS01', 'BS02'], 'doctor_id')
+    })
+    df = prep.encode_id_columns(df, {'patient_id': ('BN', 7), 'doctor_id': None})
+    
+    assert prep.is_surrogate_key(df['patient_id'])
+    assert not prep.is_surrogate_key(df['doctor_id'])
+    assert prep.id_key_formats(df) == {'patient_id': ('BN', 7)}
+
+
+def test_lookup_keys_across_representations():
+    patients = prep.encode_id_columns(pd.DataFrame({'patient_id': id_series(['BN0000001', 'BN0000002', 'BN0000003'])}))
+    key_index = prep.build_key_index(patients, 'patient_id')
+    assert key_index['id_format'] == ('BN', 7)
+    
+    # Khóa ngoại giữ dạng chuỗi (có giá trị thiếu và mã sai dạng)
+    probe = id_series(['BN0000003', None, 'X-17', 'BN0000009', 'BN0000001'])
+    assert prep.lookup_keys(key_index, probe).tolist() == [2, -1, -1, -1, 0]
+    
+    # Bảng được tham chiếu giữ dạng chuỗi, khóa ngoại là khóa thay thế
+    string_index = prep.build_key_index(prep.decode_id_columns(patients), 'patient_id')
+    assert string_index['id_format'] is None
+    encoded_probe = prep.encode_id_columns(pd.DataFrame({'patient_id': id_series(['BN0000002', 'BN0000004'])}))
+    assert prep.lookup_keys(string_index, encoded_probe['patient_id']).tolist() == [1, -1]
+    
+    # Cùng tiền tố nhưng khác số chữ số: so sánh theo dạng của chỉ mục
+    other_width = prep.encode_id_columns(pd.DataFrame({'patient_id': id_series(['BN02', 'BN03'])}))
+    assert prep.lookup_keys(key_index, other_width['patient_id']).tolist() == [-1, -1]
+
+
+def test_read_table_chunks_share_formats(tmp_path):
+    path = tmp_path / 'medical_records.csv'
+    pd.DataFrame({
+        'record_id': ['HS001', 'HS002', 'HS003', 'HS004'],
+        'patient_id': ['BN0000001', 'BN0000002', None, 'BN0000003'],
+        'doctor_id': ['BS01', 'BS02', 'BS01', 'BS02']
+    }).to_csv(path, index=False, encoding='utf-8-sig')
+    
+    chunks = list(prep.read_table('medical_records', path, id_formats={'patient_id': ('BN', 7), 'doctor_id': None},
+                                  chunksize=2))
+    assert [prep.id_key_formats(chunk) for chunk in chunks] == [
+        {'record_id': ('HS', 3), 'patient_id': ('BN', 7)},
+        {'record_id': ('HS', 3)}
+    ]
+    assert not prep.is_surrogate_key(chunks[1]['patient_id'])
+
+
+def test_sharded_pipeline_with_spawned_workers(workdir, monkeypatch):
+    """Tiến trình con khởi động bằng spawn nhận dạng mã cùng với dữ liệu (không dùng trạng thái toàn cục)"""
+    spawn_pool = functools.partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context('spawn'))
+    monkeypatch.setattr(prep, 'ProcessPoolExecutor', spawn_pool)
+    prep.main(workers=2)
+    
+    for name in ('medical_records', 'patients'):
+        with open(workdir / 'cleaned_data' / f'{name}_cleaned.csv', 'rb') as f, \
+                open(os.path.join(FIXTURES_DIR, 'golden', f'{name}_cleaned.csv'), 'rb') as golden:
+            assert f.read() == golden.read()
@@ -0,0 +1,38 @@
+"""Sinh dữ liệu tổng hợp: mã ID không bị cắt khi vượt độ rộng của bảng, số dòng báo cáo đúng với file"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import generate_synthetic_data as gen
+
+
+def test_ids_wider_than_the_table_keep_every_digit():
+    sizes = {'patients': 9_000_000}
+    numbers = np.array([1, 9_000_000, 9_999_999, 10_000_000, 18_000_000, 123_456_789])
+    
+    ids = gen.make_ids('patients', numbers, sizes)
+    assert ids.tolist() == ['BN0000001', 'BN9000000', 'BN9999999', 'BN10000000', 'BN18000000', 'BN123456789']
+    assert gen.make_ids('patients', numbers[:2], sizes).dtype == np.dtype('U9')
+
+
+def test_dangling_foreign_keys_never_match_real_ids():
+    sizes = gen.table_sizes(0.01)
+    sizes['patients'] = 9_999_990
+    rng = np.random.default_rng(0)
+    
+    records = gen.generate_medical_records(rng, 0, 20_000, sizes)
+    numbers = records['patient_id'].str[2:].astype('int64')
+    valid = numbers <= sizes['patients']
+    assert (~valid).any()
+    assert (records.loc[~valid, 'patient_id'].str.len() > len('BN0000001')).all()
+
+
+def test_reported_rows_include_duplicates(tmp_path):
+    rows = gen.generate_data(scale=0.05, output_dir=str(tmp_path), workers=2)
+    
+    for name, filename in gen.FILES.items():
+        df = pd.read_csv(os.path.join(tmp_path, filename), encoding='utf-8-sig')
+        assert rows[name] == len(df), name
+    assert rows['medical_records'] > gen.table_sizes(0.05)['medical_records']
@@ -0,0 +1,97 @@
+"""Đồ thị tác vụ (DAG): thứ tự phụ thuộc, output theo từng tác vụ và kết quả giống chạy tuần tự"""
+
+import threading
+import time
+
+import pytest
+
+import preprocessing_healthcare_data as prep
+
+
+def writer(artifact, value, delay=0.0):
+    def fn(inputs, options):
+        time.sleep(delay)
+        print(f'ghi {artifact}', file=options['out'])
+        return {artifact: value}
+    return fn
+
+
+def test_dependencies_follow_readers_and_writers():
+    tasks = [
+        prep.pipeline_task('load', writer('a', 1), outputs=['a']),
+        prep.pipeline_task('read1', lambda inputs, options: {'b': inputs['a']}, ['a'], ['b']),
+        prep.pipeline_task('read2', lambda inputs, options: {'c': inputs['a']}, ['a'], ['c']),
+        prep.pipeline_task('rewrite', writer('a', 2), ['a'], ['a']),
+        prep.pipeline_task('final', lambda inputs, options: {}, ['a', 'b'])
+    ]
+    
+    assert prep.task_dependencies(tasks) == {
+        'load': [],
+        'read1': ['load'],
+        'read2': ['load'],
+        # Tác vụ ghi đè 'a' chờ mọi tác vụ còn đọc giá trị cũ
+        'rewrite': ['load', 'read1', 'read2'],
+        'final': ['read1', 'rewrite']
+    }
+
+
+def test_invalid_graphs_are_rejected():
+    with pytest.raises(ValueError):
+        prep.task_dependencies([prep.pipeline_task('x', writer('a', 1), ['missing'], ['a'])])
+    with pytest.raises(ValueError):
+        prep.task_dependencies([prep.pipeline_task('x', writer('a', 1), outputs=['a'])] * 2)
+
+
+def test_tasks_start_after_their_dependencies():
+    tasks = [
+        prep.pipeline_task('slow', writer('a', 1, delay=0.1), outputs=['a']),
+        prep.pipeline_task('fast', writer('b', 2), outputs=['b']),
+        prep.pipeline_task('reader', lambda inputs, options: {'c': inputs['a'] + inputs['b']}, ['a', 'b'], ['c']),
+        prep.pipeline_task('rewrite', writer('a', 10), ['a'], ['a'])
+    ]
+    state, timeline, task_outputs = prep.run_task_graph(tasks, {}, workers=4)
+    
+    assert state == {'a': 10, 'b': 2, 'c': 3}
+    assert task_outputs == {'slow': 'ghi a\n', 'fast': 'ghi b\n', 'reader': '', 'rewrite': 'ghi a\n'}
+    entries = {entry['step']: entry for entry in timeline}
+    for name, waits in prep.task_dependencies(tasks).items():
+        for dependency in waits:
+            assert entries[name]['start_s'] >= entries[dependency]['end_s'], (name, dependency)
+
+
+def test_task_output_is_captured_per_task(capsys):
+    def chatty(name):
+        def fn(inputs, options):
+            for i in range(50):
+                print(f'{name} {i}', file=options['out'])
+            return {name: threading.current_thread().name}
+        return fn
+    
+    tasks = [prep.pipeline_task(name, chatty(name), outputs=[name]) for name in ['t1', 't2', 't3']]
+    _, _, task_outputs = prep.run_task_graph(tasks, {}, workers=3)
+    
+    for name in ['t1', 't2', 't3']:
+        assert task_outputs[name].splitlines() == [f'{name} {i}' for i in range(50)]
+    # Mỗi tác vụ được in thành một khối liền sau dòng tiêu đề của nó
+    out = capsys.readouterr().out
+    assert out.count('\n>>> ') == 3
+    for block in out.split('\n>>> ')[1:]:
+        header, output = block.split('\n', 1)
+        assert output == task_outputs[header.split(']')[0].lstrip('[')]
+
+
+def test_dag_pipeline_writes_step_output_to_the_task_stream(workdir, capsys):
+    options = {'inplace': False, 'parsed_years': {}, 'output_dir': 'cleaned_data/', 'output_format': 'csv'}
+    _, _, task_outputs = prep.run_task_graph(prep.build_task_graph(), options, workers=4)
+    
+    assert 'Đã đọc patients.csv' in task_outputs['load/patients']
+    assert 'KIỂM TRA DỮ LIỆU TRÙNG LẶP' in task_outputs['duplicates/medical_records']
+    assert 'BÁO CÁO TỔNG HỢP CHẤT LƯỢNG DỮ LIỆU' in task_outputs['report']
+    # Mọi dòng in ra stdout đều nằm trong khối của một tác vụ
+    out = capsys.readouterr().out
+    assert out.startswith('\n>>> [')
+    blocks = out[len('\n>>> '):].split('\n>>> [')
+    assert len(blocks) == len(task_outputs)
+    for block in blocks:
+        header, output = block.split('\n', 1)
+        assert output == task_outputs[header.lstrip('[').split(']')[0]]